@@ -23,6 +23,8 @@
 # <li>The Temperature_UVI_deployment_log needs to be downloaded as a '.csv'.
 # <li>All of the date columns in the UVI deployment log must be formated as month/day/full year. e.g. 1/1/2024
 # <li>All of the time columns in the UVI deployment log must be formatted as hh:mm:ss in military time. e.g. 14:30:00
+# <li>The same steps can be run without the notebook with run_qaqc.py: copy qaqc_config.example.ini, set the folder paths in it and run python run_qaqc.py my_config.ini. Each step (ingest, deployment, trim, duplicates, offset, export, plot) is saved when it finishes, so a rerun starts at the first step whose files or settings changed instead of from the top.
+# <li>To try the code without the real data, python generate_hobo_data.py FOLDER --sites 38 --deployments 2 writes a working folder of synthetic HOBO files and a matching deployment log. python benchmarks.py --stages --sites 38 --deployments 10 times every step on a synthetic dataset of that size.
 
 # %% [markdown]
 # ### <b>FILE NAMING: duplicate files should be named _a and _b and offset files should be named _c and _d
@@ -43,7 +45,14 @@
 # <li>pandas(pd): pandas is used for data manipulation and analysis library providing data structures like DataFrames and Series, allowing you to work with structured data easily
 # <li>glob: provides a way to search for files that match a specified pattern
 # <li>matplotlib.pyplot(plt): this is a plotting library that enables the creation of plots and visualizations. The 'pyplot' module provides a MATLAB-like interface for creating plots interactively
-# <li>datetime: provides classes for working with dates and times, allowing you to create, manipulate, format, and perform operations on dates and times.
+# <li>hobo_io: helper functions for reading the HOBO files that are kept in hobo_io.py next to this script. <u>Make sure hobo_io.py is in the same folder as this script!</u>
+# <li>hobo_qc: helper functions for the duplicate checks and averaging that are kept in hobo_qc.py next to this script.
+# <li>hobo_plots: helper functions that save the plots of the exported files, kept in hobo_plots.py next to this script.
+# <li>hobo_long: helper functions for the long table that holds the readings of every file in one DataFrame, kept in hobo_long.py next to this script.
+# <li>hobo_rules: the range, spike, rate of change and flatline checks run on every reading at once, kept in hobo_rules.py next to this script.
+# <li>hobo_log: controls how much the code prints (see Run output below), kept in hobo_log.py next to this script.
+# <li>hobo_catalog: keeps a catalog (a small SQLite database) of every raw and exported file, kept in hobo_catalog.py next to this script.
+# <li>hobo_metrics: records how long each step took, how much memory was used and how many readings were kept or dropped, kept in hobo_metrics.py next to this script.
 
 # %%
 #%% Imports
@@ -51,7 +60,44 @@ import os
 import pandas as pd
 import glob
 import matplotlib.pyplot as plt
-from datetime import datetime
+import hobo_io
+import hobo_qc
+import hobo_long
+import hobo_rules
+import hobo_plots
+import hobo_metrics
+import hobo_log
+import hobo_catalog
+
+# %% [markdown]
+# ### Run output:
+# By default the code prints everything as it runs: whole DataFrames, a line for every file, and every plot is shown. For large working folders or runs without a screen this output gets very large and slow, and it is saved inside the notebook.
+# <li>Set quiet to True to only print summaries (number of files and readings, first and last times, number of flagged readings) and warnings, and to close the plots without showing them.
+# <li>Set dump_dir to a folder to still write the whole DataFrames to .csv files there when quiet is True, None to skip them.
+# <li>Set log_file to a file to also keep every message, including the per file ones, with the time it was printed, None to skip it.
+
+# %%
+#%% Run output
+
+quiet = False
+dump_dir = None
+log_file = None
+
+log = hobo_log.setup(quiet=quiet, dump_dir=dump_dir, log_file=log_file)
+
+# %% [markdown]
+# ### Export writer:
+# The exported files are written by background threads while the export loops go on to the next site, which saves a lot of time on a network drive. The writer is made once here and used by the Offload calculation comparisons and the export cells, and shut down at the end of the export cell.
+# <li>Set export_writers to the number of writer threads, or 0 to write the files one by one.
+# <li>Set export_engine to 'pyarrow' for the faster pyarrow csv writer, or None for pandas. The files are the same except that whole numbers are written as 29 instead of 29.0.
+# <li>If you rerun one of the export cells after the export cell has finished, rerun this cell first.
+
+# %%
+#%% Export writer
+
+export_writers = 4
+export_engine = None
+export_writer = hobo_io.start_export_writer(export_writers)
 
 # %% [markdown]
 # ## <b>Step 1. Downloading the data files and wrangling
@@ -74,7 +120,7 @@ file_pattern = '*.csv'
 csv_files = glob.glob(folder_path + '/' + file_pattern)
 
 # Print file paths
-print(csv_files)
+hobo_log.show('csv_files', csv_files)
 
 # %% [markdown]
 # ### Site codes:
@@ -96,58 +142,71 @@ site_codes = ["TCCORB","TCFSHB","TCMERI","TCBKPT","TCBOTB","TCBRWB","TCBKIT",
 
 # %% [markdown]
 # ### Generating dataframes:
-# To handle the 'a' and 'b' files, this code generates an empty dictionary to store them that can then be called through a nested dictionary structure. The nested dictonary structure splits the file name by the _ (underscore) to organize each file through a number of identifiers. If the file name does not contain a letter at the end of it, it will be assigned as 'a'. The code then checks the existence of each identifier through a series of if statements in a for loop, by doing nothing if it exists and moving to the next identifier. If the identifier doesn't exist, the else statements create that identifier for the file. The last if and else statement (the middle of the loop), checks if there is two 'a' identifiers for the file; if so then a warning message should appear indicating a duplicate file, if not then adds it to the dictionary. (example for calling a file provided at bottom of the cell)
+# To handle the 'a' and 'b' files, this code generates an empty dictionary to store them that can then be called through a nested dictionary structure. The nested dictonary structure splits the file name by the _ (underscore) to organize each file through a number of identifiers. If the file name does not contain a letter at the end of it, it will be assigned as 'a'. The code then checks the existence of each identifier, and if the identifier doesn't exist, creates that identifier for the file. If there are two 'a' identifiers for the file a warning message should appear indicating a duplicate file, if not then adds it to the dictionary. (example for calling a file provided at bottom of the cell)
+# <li>Reading the files is the slowest step for a large working folder. Set ingest_mode to 'thread' or 'process' to read the files in parallel, or 'serial' to read them one at a time.
+# <li>Set csv_engine to 'pyarrow' to use the faster pyarrow parser (pyarrow must be installed), or None for the default pandas parser.
+# <li>The 'Date Time, GMT-04:00' column is converted to datetime once, while the files are read, using the HOBO format month/day/2 digit year hour:minute:second (e.g. 10/01/22 14:30:00). The cells after this one never convert it again.
+# <li>Set stream_trim to True for very large files. The files are then not read into memory in this cell; instead the Trim part 1 cell reads each file in chunks (always with the default pandas parser, csv_engine is not used) and only keeps the readings inside the deployment window, so the air readings before deployment and after recovery never take up memory. The pre-trimmed plots are skipped in this mode.
+# <li>Set compact_dtypes to True to only read the '#', 'Date Time, GMT-04:00' and 'Temp, °C' columns, with the reading number stored as a 32 bit integer and the temperature as a 32 bit float. The coupler and logger event columns are dropped later anyway, so this roughly halves the memory used by the DataFrames. The temperatures are turned back into 64 bit floats (rounded to 4 decimals) wherever they are compared or averaged, so the results are the same.
+# <li>Each step (reading, deployment matching, trimming, duplicate comparison, export and plotting) adds a line to the metrics file at metrics_path with how long it took, the memory used and the number of files and readings it kept or dropped, so runs of different seasons can be compared. Read it with pd.read_json(metrics_path, lines=True). The metrics are off by default (metrics_path = None), set metrics_path to a .jsonl file, e.g. r'C:\UVI\QAQC stuff\Temp_TCRMP_2024_Output\qaqc_metrics.jsonl', to turn them on.
+# <li>The parquet cache is off (cache_dir = None). Set cache_dir to a folder, e.g. r'C:\UVI\QAQC stuff\QAQC_cache', to keep a parquet copy of every parsed file (pyarrow must be installed, without it the files are read as usual and a warning is shown). When the code is rerun, files that have not changed are loaded from the parquet copy with the 'Date Time, GMT-04:00' column already converted to datetime, which is much faster than reading the .csv again. Cache entries for files that were changed or removed from the working folder are deleted.
 
 # %%
 #%% Generate dataframes that can be called through a nested dictonary structure
 # This creates a nested dictionary that can handle situations when site codes 
 # have multiple different start times and multiple files i.e. 'a' and 'b' files
 
-# Create an empty dictionary to store DataFrames structured by site code, file number, file identifier, and file name
-df_files = {}
-
-# Iterate through each CSV file
-for csv_file in csv_files:
-    # Extract site code, file number, file identifier, and file name from the file name
-    file_name = os.path.basename(csv_file).split('.')[0]  # Remove the file extension
-    parts = file_name.split('_')
-    site_code = parts[1]  # Extract the site code
-    file_number = parts[2]  # Extract the file number
-    file_identifier = parts[-1] if len(parts) > 3 and parts[-1] != '' else "a" # Extract the file identifier ('a', 'b', etc.), assign 'a' if not present
-    
-    # Read CSV file into a DataFrame
-    df = pd.read_csv(csv_file)
-    
-    # Extract the base file name without the extension
-    base_file_name = os.path.splitext(os.path.basename(csv_file))[0]
-    
-    # Check if the site code already exists in the dictionary
-    if site_code in df_files:
-        # Check if the file number already exists in the dictionary for the site code
-        if file_number in df_files[site_code]:
-            # If the file number exists, check if the file identifier already exists
-            if file_identifier in df_files[site_code][file_number]:
-                print(f"Warning: Duplicate file identifier {file_identifier} for site code {site_code} and file number {file_number}. Ignoring.")
-            else:
-                # If the file identifier doesn't exist, add the DataFrame and file name to the dictionary
-                df_files[site_code][file_number][file_identifier] = {'DataFrame': df, 'File Name': base_file_name}
-        else:
-            # If the file number doesn't exist, create a new dictionary for the file number
-            df_files[site_code][file_number] = {file_identifier: {'DataFrame': df, 'File Name': base_file_name}}
-    else:
-        # If the site code doesn't exist, create a new dictionary for the site code
-        df_files[site_code] = {file_number: {file_identifier: {'DataFrame': df, 'File Name': base_file_name}}}
+# Choose how the files are read: 'serial', 'thread' or 'process'
+ingest_mode = 'thread'
+
+# Choose the csv parser: None for the default pandas parser or 'pyarrow'
+csv_engine = None
+
+# Set to True to only read the '#', date and temperature columns, in compact 32 bit types
+compact_dtypes = True
+
+# Folder for the parquet cache of parsed files (needs pyarrow), None turns the cache off
+cache_dir = None
+
+# Set to True for very large files: the files are then not read here but in the Trim part 1 cell,
+# in chunks, keeping only the readings inside the deployment window
+stream_trim = False
+
+# File the metrics of every step are added to, None turns the metrics off
+metrics_path = None
+
+# Read every CSV file into a DataFrame (the DataFrames come back in the same order as csv_files)
+step_start = hobo_metrics.start_step()
+if stream_trim:
+    dataframes = [None] * len(csv_files)
+else:
+    dataframes = hobo_io.read_logger_files(csv_files, mode=ingest_mode, engine=csv_engine, cache_dir=cache_dir,
+                                           compact=compact_dtypes)
+    if compact_dtypes:
+        plain_bytes, loaded_bytes = hobo_io.memory_savings(csv_files, dataframes)
+        log.info(f"DataFrames use {loaded_bytes / 1e6:.1f} MB instead of about {plain_bytes / 1e6:.1f} MB")
+
+# Remove cache entries for raw files that were changed or no longer exist
+if cache_dir is not None:
+    evicted_files = hobo_io.evict_stale_cache(cache_dir)
+    if evicted_files:
+        log.info(f"Removed {len(evicted_files)} stale cache entries")
+
+# Create the dictionary of DataFrames structured by site code, file number, file identifier, and file name
+df_files = hobo_io.build_df_files(csv_files, dataframes)
+hobo_metrics.record_step(metrics_path, 'ingest', step_start, files=len(csv_files),
+                         rows_out=None if stream_trim else hobo_metrics.count_rows(df_files))
 
 # Accessing the DataFrames by site code, file number, file identifier, and file name
 # For example, to access the DataFrame and file name for site code 'TCBKPT', file number '2209', and file identifier 'a'
 if 'TCSR41' in df_files and '2210' in df_files['TCSR41'] and 'a' in df_files['TCSR41']['2210']:
-    print("File Name:", df_files['TCSR41']['2210']['a']['File Name'])
-    print("DataFrame:")
-    print(df_files['TCSR41']['2210']['a']['DataFrame'])
+    log.debug(f"File Name: {df_files['TCSR41']['2210']['a']['File Name']}")
+    log.debug("DataFrame:")
+    hobo_log.show('TCSR41_2210_a', df_files['TCSR41']['2210']['a']['DataFrame'])
 else:
-    print("DataFrame not found for site code 'TCSR41', file number '2210', and file identifier 'a'")
+    log.debug("DataFrame not found for site code 'TCSR41', file number '2210', and file identifier 'a'")
 
-print(df_files)
+hobo_log.show('df_files', df_files)
 
 # %% [markdown]
 # ## File identifier check:
@@ -157,10 +216,10 @@ print(df_files)
 for site_code, site_data in df_files.items():
     for file_number, file_data in site_data.items():
         if 'a' not in file_data:
-            print(f"Warning: No 'a' identifier found for site code {site_code} and file number {file_number}.")
+            log.warning(f"Warning: No 'a' identifier found for site code {site_code} and file number {file_number}.")
         else:
             file_name = file_data['a']['File Name']
-            print(f"File with 'a' identifier found for site code {site_code} and file number {file_number}: {file_name}")
+            log.debug(f"File with 'a' identifier found for site code {site_code} and file number {file_number}: {file_name}")
 
 
 # %% [markdown]
@@ -187,7 +246,7 @@ csv_file_names = [os.path.basename(csv_file).split('.')[0] for csv_file in csv_f
 filtered_deployment_df = deployment_df[deployment_df['Offloaded Filename'].isin(csv_file_names)]
 
 # Print the filtered DataFrame
-print(filtered_deployment_df)
+hobo_log.show('filtered_deployment_df', filtered_deployment_df)
 
 # %% [markdown]
 # ### Warning check 1: unmatched files
@@ -195,7 +254,7 @@ print(filtered_deployment_df)
 
 # %%
 # %% Find which file names you are processing did not match with the file names in the deployment log.
-
+step_start = hobo_metrics.start_step()
 
 # Extract file names from csv_files
 csv_file_names = [os.path.basename(csv_file).split('.')[0] for csv_file in csv_files]
@@ -207,9 +266,14 @@ matched_files = deployment_df[deployment_df['Offloaded Filename'].isin(csv_file_
 unmatched_files = [file_name for file_name in csv_file_names if file_name not in matched_files]
 
 # Print files in csv_files that did not match
-print("!!!!!WARNING CHECK:!!!!!")
-print("Files in csv_files that did not match:")
-print(unmatched_files)
+if unmatched_files:
+    log.warning("!!!!!WARNING CHECK:!!!!!")
+    log.warning("Files in csv_files that did not match:")
+    log.warning(unmatched_files)
+else:
+    log.info("All files in csv_files matched the deployment log")
+hobo_metrics.record_step(metrics_path, 'deployment', step_start, files=len(csv_file_names),
+                         matched_files=len(matched_files), unmatched_files=len(unmatched_files))
 # These file names need to be fixed in the google sheet version and the sheet 
 # needs to be redownloaded and the code needs to be run again.
 
@@ -222,7 +286,36 @@ print(unmatched_files)
 
 subset_columns = ['Offloaded Filename','Date In','Time In', 'Date Full', 'Date Out', 'Time Out']
 filtered_deployment_df = filtered_deployment_df[subset_columns]
-print(filtered_deployment_df)
+hobo_log.show('filtered_deployment_df', filtered_deployment_df)
+
+# %% [markdown]
+# ### Incremental processing:
+# Each season only a few new offloads are added to the working folder. The manifest is a file that remembers which (site code, file number) groups were already exported, the fingerprints of their raw files and deployment log rows, and the output files they produced. When incremental is True, df_files is reduced to only the groups that are new or where a raw file or the deployment log row changed, so the rest of the code only trims, compares, plots and exports those groups. Outputs of the other groups are left untouched. The manifest is saved at the end of the export cell.
+# <li>Incremental is off by default, so every file in the working folder is processed. Set incremental to True to only process the new or changed groups.
+# <li>If an output file of a group was deleted by hand, remove the group from the manifest (or delete the manifest) so it is exported again.
+# <li><u>Make sure to update the manifest path in the cell!</u>
+
+# %%
+#%% Only keep the new or changed groups
+
+# True only processes the new or changed groups, False processes every group
+incremental = False
+
+# Define the path of the manifest file
+manifest_path = r'C:\UVI\QAQC stuff\Temp_TCRMP_2024_Output\qaqc_manifest.json'
+
+# Load the manifest from the previous run and fingerprint the groups in this run
+manifest = hobo_io.load_manifest(manifest_path)
+group_fingerprints = hobo_io.group_fingerprints(df_files, csv_files, filtered_deployment_df, manifest)
+
+if incremental:
+    all_groups = sum(len(site_data) for site_data in df_files.values())
+    df_files = hobo_io.select_changed_groups(df_files, group_fingerprints, manifest)
+    changed_groups = sum(len(site_data) for site_data in df_files.values())
+    log.info(f"{changed_groups} of {all_groups} site code/file number groups are new or changed and will be processed")
+
+# Output files written for each (site code, file number) during this run
+group_outputs = {}
 
 # %% [markdown]
 # ### Warning check 2: ? in the time columns
@@ -240,9 +333,8 @@ rows_with_question_mark = filtered_deployment_df[filtered_deployment_df['Time In
 
 # Print the value of Offloaded Filename where there is a "?" in Time In or Time Out
 if not rows_with_question_mark.empty:
-    print("!!!!!WARNING CHECK!!!!!!:"
-           "'?' file row", rows_with_question_mark['Offloaded Filename'].values[0],
-           "May want to process file separately")
+    log.warning(f"!!!!!WARNING CHECK!!!!!!: '?' file row {rows_with_question_mark['Offloaded Filename'].values[0]} "
+                "May want to process file separately")
 
 
 # %% [markdown]
@@ -261,7 +353,7 @@ filtered_deployment_df['Date Out'] = pd.to_datetime(filtered_deployment_df['Date
 
 
 
-print(filtered_deployment_df.dtypes)  # Check the data types after conversion
+log.debug(filtered_deployment_df.dtypes)  # Check the data types after conversion
 
 # %% [markdown]
 # ### Combine Date and Time:
@@ -277,9 +369,7 @@ filtered_deployment_df['Date Out Time Out'] = pd.to_datetime(filtered_deployment
 # Drop the separate Date In, Time In, Date Out, and Time Out columns if needed
 #filtered_deployment_df.drop(columns=['Date In', 'Time In', 'Date Out', 'Time Out'], inplace=True)
 
-print(filtered_deployment_df)
-
-print(filtered_deployment_df['Date In Time In'], filtered_deployment_df['Date Out Time Out'])
+hobo_log.show('filtered_deployment_df', filtered_deployment_df)
 
 # %% [markdown]
 # ### Problematic rows
@@ -291,126 +381,128 @@ problematic_row = filtered_deployment_df.iloc[34] #position number
 print(problematic_row)
 
 # %% [markdown]
-# ### Deployment data dictionary:
-# To quickly search for the deployment data without having to look through the deployment log, this cell creates a dictionary to call the related deployment data for each site code.
+# ### Deployment data table:
+# To quickly search for the deployment data without having to look through the deployment log, this cell creates a table of the deployment data indexed by the Offloaded Filename, so the row for each file can be called by its name.
 
 # %%
-#%% Make a dictonary for each record contained in the filtered_deployment_df
-
-# Create a dictionary to hold entries based on Offloaded Filename
-deployment_data_dict = {}
-
-# Iterate through DataFrame rows
-for index, row in filtered_deployment_df.iterrows():
-    file_info = {
-        'Date In': row['Date In'], #From here
-        'Time In': row['Time In'],
-        'Date Full': row['Date Full'],
-        'Date Out': row['Date Out'],
-        'Time Out': row['Time Out'], #To here would need to be commented out if dropped in previous cell
-        'Date In Time In': row['Date In Time In'],
-        'Date Out Time Out': row['Date Out Time Out'],
-        'Offloaded Filename': row['Offloaded Filename']
-    }
-    # Append file info to the dictionary using Offloaded Filename as key
-    deployment_data_dict[row['Offloaded Filename']] = file_info
-
-# Print the created dictionary
-for filename, file_info in deployment_data_dict.items():
-    print(f"Offloaded Filename: {filename}")
-    print(f"File Info: {file_info}")
+#%% Make a table of the records in filtered_deployment_df indexed by Offloaded Filename
+
+deployment_data = hobo_qc.deployment_table(filtered_deployment_df)
+
+# Print the created table
+hobo_log.show('deployment_data', deployment_data)
 
 # %% [markdown]
-# ### Example deployment metadata call using the deployment_data_dict dictionary:
+# ### File catalog:
+# The catalog is a small database that remembers every raw file that was read and every file that was exported: its site code, file number, identifier, size, number of readings, first and last reading time and its row from the deployment log. Only new or changed files are read to update it, so questions about the files can be answered without reading any data, e.g.
+# <li>hobo_catalog.files_covering(catalog, 'TCSR41', '2023-01-01', '2024-01-01') for the files that cover TCSR41 in 2023
+# <li>hobo_catalog.unmatched_files(catalog) for the raw files that are not in the deployment log
+# <li>hobo_catalog.query(catalog, "SELECT ...") for any other question
+# <li>The catalog is off by default (catalog_path = None). Set catalog_path to a .sqlite file, e.g. r'C:\UVI\QAQC stuff\QAQC_catalog.sqlite', to turn it on.
 
 # %%
-# Example deployment data call
-#deployment_data_dict["BT_TCSR41_2210_a"]
+#%% Update the file catalog
+
+# File of the catalog database, None turns the catalog off
+catalog_path = None
+
+if catalog_path is not None:
+    catalog = hobo_catalog.connect(catalog_path)
+    hobo_catalog.remove_missing(catalog)
+    updated_files = hobo_catalog.update_catalog(catalog, csv_files, kind='raw')
+    hobo_catalog.match_deployments(catalog, deployment_data, csv_file_names)
+    log.info(f"Catalog: {updated_files} new or changed raw files added, "
+             f"{len(hobo_catalog.unmatched_files(catalog))} raw files are not in the deployment log")
 
 # %% [markdown]
-# ### Match the Date Times data type in deployment data dictionary to the times data type in df_files ###
-# This loop iterates through each file in the deployment data dictionary and converts the Date Times into a stringtime format.
+# ### Raw file start and end check:
+# Before any trimming, this cell checks that every logger was recording for its whole deployment window. Only the first and last line of each file is read (hobo_io.file_time_span), so it takes well under a second even for a whole season.
+# <li>Starts Late: the first reading is after Date In Time In, the logger was started (or launched) after it went in the water.
+# <li>Ends Early: the last reading is before Date Out Time Out, the logger stopped (battery, full memory) before it was recovered.
+# <li>Either one means the trimmed file will be shorter than the deployment log says. Check the logger and the deployment log.
 
 # %%
-#%% Change Date Times in deployment_data_dict to match the times in df_files
+#%% Raw file start and end check
+file_spans = hobo_qc.check_file_spans(csv_files, deployment_data)
+late_or_early = file_spans[file_spans['Starts Late'] | file_spans['Ends Early']]
+if late_or_early.empty:
+    log.info(f"All {len(file_spans)} raw files cover their deployment window")
+else:
+    log.warning(f"Warning: {len(late_or_early)} raw files do not cover their whole deployment window:")
+    hobo_log.show('late_or_early', late_or_early)
 
-# Iterate through deployment_data_dict
-for filename, file_info in deployment_data_dict.items():
-    # Convert 'Date In Time Out' and 'Date Out Time Out' to the specified format
-    file_info['Date In Time In'] = file_info['Date In Time In'].strftime('%m/%d/%y %H:%M:%S')
-    file_info['Date Out Time Out'] = file_info['Date Out Time Out'].strftime('%m/%d/%y %H:%M:%S')
+# %% [markdown]
+# ### Example deployment metadata call using the deployment_data table:
 
-# Now the values for 'Date In Time Out' and 'Date Out Time Out' are in the specified time format
+# %%
+# Example deployment data call
+#deployment_data.loc["BT_TCSR41_2210_a"]
 
 # %% [markdown]
 # ## Plot pre-trimmed files
 # This plots the pre-trimmed version of the files
+# <li>Year-long files have far more readings than can be seen on a plot, so by default only about plot_points readings are drawn. 'minmax' keeps the lowest and highest reading of each small stretch of time so spikes and flatlines still show, 'lttb' keeps the overall shape of the curve. Set plot_decimation to None to draw every reading. Each plotting cell has its own setting.
 
 # %%
-# Loop through df_files and plot graphs for each DataFrame
-for site_code, site_data in df_files.items():
-    for file_number, file_data in site_data.items():
-        for file_identifier, file_info in file_data.items():
-            # Get the DataFrame
-            df = file_info['DataFrame']
-            
-            # Convert the 'Date Time, GMT-04:00' column to datetime format
-            df['Date Time, GMT-04:00'] = pd.to_datetime(df['Date Time, GMT-04:00'])
-
-            # Plot the temperature over time
-            plt.figure(figsize=(12, 6))
-            plt.plot(df.index, df['Temp, °C'], color='blue', marker='o', linestyle='-')
-            plt.title('Temperature Over Time')
-            plt.xlabel('Date Time')
-            plt.ylabel('Temp, °C')  # Modified label
-            plt.grid(True)
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.show()
+# Choose how the readings are downsampled before plotting: 'minmax', 'lttb' or None to plot every reading
+plot_decimation = 'minmax'
+plot_points = 4000
+
+# The files are not read yet when stream_trim is True
+if not stream_trim:
+    # Loop through df_files and plot graphs for each DataFrame
+    for site_code, site_data in df_files.items():
+        for file_number, file_data in site_data.items():
+            for file_identifier, file_info in file_data.items():
+                # Get the DataFrame ('Date Time, GMT-04:00' was already converted to datetime when the file was read)
+                df = file_info['DataFrame']
+
+                # Pick the readings to draw
+                plot_df = hobo_plots.decimate_frame(df, plot_decimation, plot_points)
+
+                # Plot the temperature over time
+                plt.figure(figsize=(12, 6))
+                plt.plot(plot_df.index, plot_df['Temp, °C'], color='blue', marker='o', linestyle='-')
+                plt.title('Temperature Over Time')
+                plt.xlabel('Date Time')
+                plt.ylabel('Temp, °C')  # Modified label
+                plt.grid(True)
+                plt.xticks(rotation=45)
+                plt.tight_layout()
+                hobo_log.show_figure()
 
 # %% [markdown]
 # ### <b>Trim the data based on Date Time:
-# Trimming the data occurs in two steps, first is to trim the data based on the deployment log, then trim the data to account for human error. The cell below checks if the newly combined Date and Time values are a string and then formats it to a datetime object with the structure of m/d/y and h:m:s. 
-
-# %%
-#%% Trim Data Based on Date Time
-# The data is being trimmed to the closest related start and endpoint 
-
-# Convert timestamps to datetime objects in deployment_data_dict
-for filename, file_info in deployment_data_dict.items():
-    # Check if the values are already strings
-    if isinstance(file_info['Date In Time In'], str):
-        file_info['Date In Time In'] = datetime.strptime(file_info['Date In Time In'], '%m/%d/%y %H:%M:%S')
-    if isinstance(file_info['Date Out Time Out'], str):
-        file_info['Date Out Time Out'] = datetime.strptime(file_info['Date Out Time Out'], '%m/%d/%y %H:%M:%S')
-
+# Trimming the data occurs in two steps, first is to trim the data based on the deployment log, then trim the data to account for human error. The 'Date Time, GMT-04:00' column of the data was already converted to datetime when the files were read, and the Date In Time In and Date Out Time Out columns of the deployment data are datetime, so they can be compared directly.
 
 # %% [markdown]
 # ### Trim part 1: deployment log
-# This cell trims the data based on the start and end times specified in the deployment log to the nearest point in the data.
+# This cell trims the data based on the start and end times specified in the deployment log to the nearest point in the data. The readings of every file are joined to their deployment window and filtered in one pass, instead of one file at a time. If a file is not in the deployment log, or its Date In Time In or Date Out Time Out is missing, all of its data is removed and a warning is printed.
 
 # %%
 # Trim the data in each DataFrame based on the specified time range
-for site_code, site_data in df_files.items():
-    for file_number, file_data in site_data.items():
-        for file_identifier, file_info in file_data.items():
-            df = file_info['DataFrame']
-            date_column = 'Date Time, GMT-04:00'  # Assuming this is the column containing timestamps
-            
-            # Convert the date column to datetime objects, specifying the format
-           # df[date_column] = pd.to_datetime(df[date_column], format='%m/%d/%Y %H:%M')
-            df[date_column] = pd.to_datetime(df[date_column], format='%m/%d/%y %H:%M:%S')
-            
-            # Filter the DataFrame based on the specified time range
-            df = df[(df[date_column] >= deployment_data_dict[file_info['File Name']]['Date In Time In']) &
-                    (df[date_column] <= deployment_data_dict[file_info['File Name']]['Date Out Time Out'])]
-            
-            # Update the DataFrame in df_files
-            df_files[site_code][file_number][file_identifier]['DataFrame'] = df
+step_start = hobo_metrics.start_step()
+rows_before_trim = None if stream_trim else hobo_metrics.count_rows(df_files)
+if stream_trim:
+    # Read each file in chunks, trimming it to the deployment window and by 4/5 readings on each end while reading
+    files_without_window = hobo_io.stream_trim_files(df_files, csv_files, deployment_data, head=4, tail=5, compact=compact_dtypes)
+else:
+    files_without_window = hobo_qc.trim_to_deployment(df_files, deployment_data)
+
+for file_name in files_without_window:
+    log.warning(f"Warning: {file_name} has no deployment start and end time in the deployment log, all of its data was trimmed")
+
+# When stream_trim is True the readings dropped before the window can't be counted, they were never read
+rows_after_trim = hobo_metrics.count_rows(df_files)
+hobo_metrics.record_step(metrics_path, 'trim deployment window', step_start, files=hobo_metrics.count_files(df_files),
+                         rows_in=rows_before_trim, rows_out=rows_after_trim,
+                         rows_dropped_deployment=None if stream_trim else rows_before_trim - rows_after_trim,
+                         files_without_window=len(files_without_window))
 
 # %% [markdown]
 # ### Trim part 2: account for human error
 # To remove the possibility of human error from deployment and retreival of the loggers, the loop iterates through the data frames and trims the first and last hour of the data. This section can be altered in the "trimmed_df = df.iloc[4:-5]" section based on outputs of graphing section of the code.
+# <li>When stream_trim is True this was already done while the files were read in Trim part 1 (change head=4 and tail=5 there), so this cell does nothing.
 
 # %%
 #%% Trim data down on both ends by an hour THIS SECTION CAN BE COMMENTED OUT IF FURTHER TRIMMING IS NOT REQUIRED.
@@ -418,18 +510,100 @@ for site_code, site_data in df_files.items():
 # In terms of data processing it may be better to eliminate human error and just inerpolate these points
 # When connecting the data to previous data. 
 
-# Loop through each site code, file number, and file identifier in df_files
-for site_code, site_data in df_files.items():
-    for file_number, file_data in site_data.items():
-        for file_identifier, file_info in file_data.items():
-            # Get the DataFrame for the current file
-            df = file_info['DataFrame']
+# When stream_trim is True this was already done in Trim part 1
+if not stream_trim:
+    step_start = hobo_metrics.start_step()
+    rows_before_trim = hobo_metrics.count_rows(df_files)
+
+    # Loop through each site code, file number, and file identifier in df_files
+    for site_code, site_data in df_files.items():
+        for file_number, file_data in site_data.items():
+            for file_identifier, file_info in file_data.items():
+                # Get the DataFrame for the current file
+                df = file_info['DataFrame']
             
-            # Reduce the number of start points 4 and end points by 5 on each end of the DataFrame
-            trimmed_df = df.iloc[4:-5]
+                # Reduce the number of start points 4 and end points by 5 on each end of the DataFrame
+                trimmed_df = df.iloc[4:-5]
             
-            # Update the DataFrame in df_files
-            df_files[site_code][file_number][file_identifier]['DataFrame'] = trimmed_df
+                # Update the DataFrame in df_files
+                df_files[site_code][file_number][file_identifier]['DataFrame'] = trimmed_df
+
+    rows_after_trim = hobo_metrics.count_rows(df_files)
+    hobo_metrics.record_step(metrics_path, 'trim edges', step_start, files=hobo_metrics.count_files(df_files),
+                             rows_in=rows_before_trim, rows_out=rows_after_trim,
+                             rows_dropped_edge=rows_before_trim - rows_after_trim)
+
+# %% [markdown]
+# ### Long table (optional):
+# This cell puts the trimmed readings of every file into one long table (long_df) with site_code, file_number, file_identifier and file_name columns, 32 bit temperatures and datetime times. The checks that look at every logger at once use the long table instead of looping through df_files. hobo_long.from_long(long_df) turns the long table back into the df_files structure if needed.
+# <li>Set use_long_table to False to skip it.
+
+# %%
+#%% Build the long table of all trimmed readings
+
+use_long_table = True
+
+if use_long_table:
+    long_df = hobo_long.to_long(df_files)
+    log.info(f"Long table: {len(long_df)} readings from {long_df['file_name'].nunique()} files, "
+          f"{long_df.memory_usage(deep=True).sum() / 1e6:.1f} MB")
+
+# %% [markdown]
+# ### QC rules:
+# Instead of looking for bad readings on the plot of every file, this cell checks every reading in the long table against four rules at once and gives each reading a flag number (long_df['QC_Flag']):
+# <li>1 range: the temperature is below min_temp or above max_temp.
+# <li>2 spike: the temperature is more than spike_limit away from the median of the spike_window readings around it.
+# <li>4 rate: the temperature changed more than max_rate °C per hour since the reading before.
+# <li>8 flatline: the reading is one of flatline_readings or more identical readings in a row (a stuck sensor).
+# <li>The numbers are added when a reading fails more than one rule, e.g. 6 is a spike and a too fast change, hobo_rules.flag_names(6) gives the names. 0 passed every rule.
+# <li>qc_summary lists the files with the most flagged readings first, only those need to be looked at on their plots.
+# <li>The same check can be run on the whole parquet archive: hobo_rules.run_rules(archive_df, qc_rules, groups=['site_code', 'file_number']) with archive_df = hobo_io.read_archive(archive_dir).
+# <li>Needs the long table (use_long_table = True).
+
+# %%
+#%% QC rules on every reading
+
+# Limits of the rules: the defaults from hobo_rules.DEFAULT_RULES (see there for what each one means),
+# change a limit here only if it should differ for this run, e.g. qc_rules['max_temp'] = 33.0
+qc_rules = dict(hobo_rules.DEFAULT_RULES)
+
+if use_long_table:
+    long_df['QC_Flag'] = hobo_rules.run_rules(long_df, qc_rules)
+    qc_summary = hobo_rules.flag_summary(long_df, long_df['QC_Flag'].to_numpy())
+    log.info(f"QC rules: {int((long_df['QC_Flag'] > 0).sum())} of {len(long_df)} readings flagged "
+             f"in {int((qc_summary['flagged'] > 0).sum())} of {len(qc_summary)} files")
+    hobo_log.show('qc_summary', qc_summary)
+
+# %% [markdown]
+# ### Sampling interval check:
+# The row counts below only show that two files have a different length. This cell sorts the readings of every file in the long table by time and looks at the time between every two readings, for all files at once:
+# <li>The nominal interval of a file is its most common time step rounded to interval_grid (e.g. 15 minutes), so a logger clock that runs a little fast or slow does not change it.
+# <li>gap: one or more readings are missing, missing_readings says how many.
+# <li>duplicate: the same time twice in a row.
+# <li>irregular: a step that is off the nominal interval by more than interval_tolerance.
+# <li>out_of_order: readings that came before an earlier reading in the file (they are sorted by time before the checks above).
+# <li>max_offset: how far the readings drifted from the nominal grid that starts at the first reading (clock drift, up to half an interval), e.g. a logger that reads every 15:02 instead of every 15:00.
+# <li>interval_summary has one row per file, interval_events one row per gap, duplicate or irregular stretch with its start and end time.
+# <li>The same check can be run on the whole parquet archive: hobo_rules.interval_check(archive_df, groups=['site_code', 'file_number']).
+# <li>Needs the long table (use_long_table = True).
+
+# %%
+#%% Sampling interval check
+
+# Largest difference from the nominal interval that is still a regular step
+interval_tolerance = '30s'
+# The most common time step of a file is rounded to this to give its nominal interval
+interval_grid = '1min'
+
+if use_long_table:
+    interval_summary, interval_events = hobo_rules.interval_check(long_df, tolerance=interval_tolerance, grid=interval_grid)
+    log.info(f"Sampling intervals: {int(interval_summary['gaps'].sum())} gaps "
+             f"({int(interval_summary['missing_readings'].sum())} missing readings), "
+             f"{int(interval_summary['duplicates'].sum())} duplicate times, "
+             f"{int(interval_summary['irregular'].sum())} irregular steps and "
+             f"{int(interval_summary['out_of_order'].sum())} readings out of order in {len(interval_summary)} files")
+    hobo_log.show('interval_summary', interval_summary)
+    hobo_log.show('interval_events', interval_events)
 
 # %% [markdown]
 # ### Checking the lengths:
@@ -452,9 +626,9 @@ for site_code, file_numbers in df_files.items():
             
             # Check if files associated with the file number have different numbers of data points
             if len(set(num_rows)) != 1:
-                print(f"Site code: {site_code}, File number: {file_number} have files with different numbers of data points.")
+                log.warning(f"Site code: {site_code}, File number: {file_number} have files with different numbers of data points.")
             else:
-                print(f"Site code: {site_code}, File number: {file_number} have files with the same number of data points: {num_rows[0]}.")
+                log.debug(f"Site code: {site_code}, File number: {file_number} have files with the same number of data points: {num_rows[0]}.")
 
 # %%
 #calls a dataframe
@@ -463,50 +637,99 @@ for site_code, file_numbers in df_files.items():
 # %% [markdown]
 # ### Calculations check:
 # To merge the duplicate temperature columns, the difference between each temperature must be checked before they can be averaged. After checking if there is an a and b file for each site code, the code then takes the absoulte value of the difference between them. 
+# <li>The 'b' readings are matched to the 'a' readings by their 'Date Time, GMT-04:00' (closest time within duplicate_tolerance) and not by their row number, so two loggers that start one sample apart are still compared at the same times. The matched 'b' temperature is kept in the 'Temp B' column.
+# <li>The number of readings in each file that had no match is reported, if this is not 0 check the start and end times of the files.
+# <li>Any number of duplicate loggers can be compared ('a', 'b' and any further letters other than the offset 'c' and 'd', see hobo_qc.split_identifiers). Their temperatures are stacked into one array with a column per logger (hobo_qc.stack_duplicates), and hobo_qc.duplicate_consensus calculates the difference of every pair, the largest difference (Temperature_Difference), the mean or median (duplicate_consensus_method) and the flags for all readings at once. A triplicate then takes about as long per reading as a pair.
+# <li>The results are kept in duplicate_results for the calculations and averaging cells below.
 
 # %%
 #%% Check to see if there is a .2 degrees difference then average the two columns and record the site codes where this occured 
 # Also take the average between the two temperature columns if the difference is less than or equal to .2 degrees.
 # Use the new average temperature column as the temperature column 
+
+# Largest time difference allowed between an 'a' and a 'b' reading for them to be compared
+duplicate_tolerance = '1min'
+
+# How the duplicate loggers are combined: 'mean' or 'median'
+duplicate_consensus_method = 'mean'
+
+# Largest temperature difference that is averaged, above it the readings are flagged and the file is a calculation file
+# (used by every cell below, see the Threshold sweep cell to compare other values)
+duplicate_threshold = 0.2
+
+step_start = hobo_metrics.start_step()
+duplicate_counts = {'pairs': 0, 'rows_in': 0, 'unmatched_a': 0, 'unmatched_b': 0}
+
+# (site code, file number) -> (duplicate identifiers, stacked temperatures, consensus results)
+duplicate_results = {}
+
 # Iterate through each site code
 for site_code, file_numbers in df_files.items():
     # Iterate through each file number
     for file_number, identifiers in file_numbers.items():
-        # Check if there are both 'a' and 'b' files for the current site code and file number
-        if 'a' in identifiers and 'b' in identifiers:
-            # Get the 'a' and 'b' dataframes
-            df_a = identifiers['a']['DataFrame']
-            df_b = identifiers['b']['DataFrame']
+        # Get the duplicate identifiers ('a' first), this needs 'a' and at least one other
+        duplicate_identifiers, _ = hobo_qc.split_identifiers(identifiers)
+        if len(duplicate_identifiers) >= 2 and duplicate_identifiers[0] == 'a':
+            # Get the duplicate dataframes
+            duplicate_frames = {identifier: identifiers[identifier]['DataFrame'] for identifier in duplicate_identifiers}
+            df_a = duplicate_frames['a']
             
-            # Check if the temperature columns exist in both dataframes
-            if 'Temp, °C' in df_a.columns and 'Temp, °C' in df_b.columns:
-                # Calculate the temperature difference
-                df_a['Temperature_Difference'] = abs(df_a['Temp, °C'] - df_b['Temp, °C'])
+            # Check if the temperature columns exist in all dataframes
+            if all('Temp, °C' in df.columns for df in duplicate_frames.values()):
+                # Match the other readings to the 'a' readings by time, one column per logger
+                duplicate_temps, unmatched = hobo_qc.stack_duplicates(duplicate_frames, tolerance=duplicate_tolerance)
+                if any(unmatched.values()):
+                    log.warning(f"Site: {site_code}, File Number: {file_number}: "
+                                + ", ".join(f"{count} '{identifier}' readings" for identifier, count in unmatched.items())
+                                + f" had no match within {duplicate_tolerance}")
+                for column, identifier in enumerate(duplicate_identifiers[1:], start=1):
+                    df_a[f"Temp {identifier.upper()}"] = duplicate_temps[:, column]
+
+                # Calculate the temperature difference (the largest difference between the loggers), the consensus and the flags
+                consensus = hobo_qc.duplicate_consensus(duplicate_temps, threshold=duplicate_threshold, method=duplicate_consensus_method)
+                df_a['Temperature_Difference'] = consensus['spread']
+                duplicate_results[(site_code, file_number)] = (duplicate_identifiers, duplicate_temps, consensus)
+
+                # Add the group to the counts for the metrics file
+                duplicate_counts['pairs'] += 1
+                duplicate_counts['rows_in'] += sum(len(df) for df in duplicate_frames.values())
+                for identifier, count in unmatched.items():
+                    duplicate_counts[f'unmatched_{identifier}'] = duplicate_counts.get(f'unmatched_{identifier}', 0) + count
             else:
-                print(f"Temperature columns not found for Site: {site_code}, File Number: {file_number}")
+                log.warning(f"Temperature columns not found for Site: {site_code}, File Number: {file_number}")
         else:
-            print(f"Only one file for Site: {site_code}, File Number: {file_number}, so averaging could not occur")
+            log.debug(f"Only one file for Site: {site_code}, File Number: {file_number}, so averaging could not occur")
+
+hobo_metrics.record_step(metrics_path, 'duplicates', step_start, **duplicate_counts)
 
 # %% [markdown]
 # ### Merge the offset files:
 # This loop checks if the c and d identifiers exist within the files. If they exist, then the code gets the data frame for each and merges them based on the Date Time column. For the instances where the merge occured, a new identifier is added to the df_files dictionary called 'merged'. <u>This code needs to be further tested<u>
+# <li>Offset loggers rarely record on the exact same seconds, so instead of an exact merge (which gives every reading its own half empty row) the readings are put on one timeline with hobo_qc.align_loggers: every reading goes to the row of the closest reading of the first logger, if it is within offset_tolerance.
+# <li>offset_tolerance = None uses half the logging interval, so 'c' and 'd' loggers that sample half an interval apart share a row. Set it to e.g. '1min' to only put readings a few seconds apart on one row.
+# <li>Any number of offset loggers can be aligned, every identifier in hobo_qc.OFFSET_IDENTIFIERS ('c' and 'd') that the file number has is included.
+# <li>The 'merged' DataFrame has the date column and a 'Temp, °C_c', 'Temp, °C_d', ... column per logger (NaN where that logger has no reading).
 
 # %%
 #%% If dataframes are 'c' and 'd' then merge the dataframes on the 'Date Time, GMT-04:00'
+# Largest time difference between readings of the offset loggers for them to share a row, None uses half the logging interval
+offset_tolerance = None
+
 # Iterate through each site code
 for site_code, file_numbers in df_files.items():
     # Iterate through each file number
     for file_number, identifiers in file_numbers.items():
-        # Check if 'c' and 'd' identifiers exist for the current site code and file number
-        if 'c' in identifiers and 'd' in identifiers:
-            # Get the 'c' and 'd' DataFrames
-            df_c = identifiers['c']['DataFrame']
-            df_d = identifiers['d']['DataFrame']
+        # Check if 'c' and 'd' (or more offset) identifiers exist for the current site code and file number
+        _, offset_identifiers = hobo_qc.split_identifiers(identifiers)
+        if len(offset_identifiers) >= 2:
+            # Get the offset DataFrames
+            offset_frames = {identifier: identifiers[identifier]['DataFrame'] for identifier in offset_identifiers}
             
-            # Check if the 'Date Time, GMT-04:00' column exists in both DataFrames
-            if 'Date Time, GMT-04:00' in df_c.columns and 'Date Time, GMT-04:00' in df_d.columns:
-                # Merge the DataFrames on the 'Date Time, GMT-04:00' column
-                merged_df = pd.merge(df_c, df_d, on='Date Time, GMT-04:00', how='outer', suffixes=('_c', '_d'))
+            # Check if the 'Date Time, GMT-04:00' column exists in all of the DataFrames
+            if all('Date Time, GMT-04:00' in df.columns for df in offset_frames.values()):
+                # Align the DataFrames on one timeline of 'Date Time, GMT-04:00'
+                aligned_times, aligned_temps, aligned_identifiers = hobo_qc.align_loggers(offset_frames, offset_tolerance)
+                merged_df = hobo_qc.aligned_frame(aligned_times, aligned_temps, aligned_identifiers)
                 
                 # Add the merged DataFrame to df_files under a new identifier 'merged'
                 df_files[site_code][file_number]['merged'] = {'DataFrame': merged_df, 'File Name': 'merged'}
@@ -515,9 +738,9 @@ for site_code, file_numbers in df_files.items():
                 # del df_files[site_code][file_number]['c']
                 # del df_files[site_code][file_number]['d']
             else:
-                print(f"'Date Time, GMT-04:00' column not found in 'c' or 'd' DataFrame for Site: {site_code}, File Number: {file_number}")
+                log.warning(f"'Date Time, GMT-04:00' column not found in an offset DataFrame for Site: {site_code}, File Number: {file_number}")
         else:
-            print(f"Only one file for Site: {site_code}, File Number: {file_number}, so merging could not occur")
+            log.debug(f"Only one file for Site: {site_code}, File Number: {file_number}, so merging could not occur")
 
 # %% [markdown]
 # ### Calculations:
@@ -539,8 +762,8 @@ for site_code, file_numbers in df_files.items():
             
             # Check if the 'Temperature_Difference' column exists in the dataframe
             if 'Temperature_Difference' in df_a.columns:
-                # Filter rows where 'Temperature_Difference' is above 0.2
-                above_threshold = df_a[df_a['Temperature_Difference'] > 0.2]
+                # Filter rows where 'Temperature_Difference' is above the threshold (0.2)
+                above_threshold = df_a[df_a['Temperature_Difference'] > duplicate_threshold]
                 
                 # Check if there are any rows above the threshold
                 if not above_threshold.empty:
@@ -551,10 +774,26 @@ for site_code, file_numbers in df_files.items():
                     calculations[(site_code, file_number)] = file_name
             #else:
             #    print(f"Temperature_Difference column not found for Site: {site_code}, File Number: {file_number}")
-print()
-print('These are the files that need to be labeled as calculations:')
+log.info(f"These are the {len(calculations)} files that need to be labeled as calculations:")
 for key, value in calculations.items():
-    print(key, value)
+    log.info(f"{key} {value}")
+
+# %% [markdown]
+# ### Threshold sweep:
+# To see what a different threshold than duplicate_threshold would do without rerunning the notebook, this cell counts for every threshold in sweep_thresholds how many readings would be flagged, in how many separate intervals (runs of flagged readings one after the other), and how many files would become calculation files.
+# <li>sweep is the table per site code and file number, sweep_totals the totals per threshold.
+# <li>The differences of each file are sorted once and every threshold is counted with a binary search, so a long list of thresholds takes no longer than one.
+# <li>To use another threshold, change duplicate_threshold in the Calculations check cell and rerun from there.
+
+# %%
+#%% Threshold sweep
+sweep_thresholds = [0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5]
+
+sweep = hobo_qc.threshold_sweep({key: consensus['spread'] for key, (_, _, consensus) in duplicate_results.items()},
+                                sweep_thresholds)
+sweep_totals = hobo_qc.sweep_summary(sweep)
+hobo_log.show('sweep_totals', sweep_totals)
+hobo_log.show('sweep', sweep)
 
 # %% [markdown]
 # ### Copy df_files
@@ -577,7 +816,8 @@ for (site_code, file_number), file_name in calculations.items():
     if site_code in calc_df:
         # Check if the file number exists for the site code
         if file_number in calc_df[site_code]:
-            for identifier in ['a', 'b']:  # Iterate through both 'a' and 'b' identifiers
+            # Iterate through the duplicate identifiers ('a', 'b', ...)
+            for identifier in hobo_qc.split_identifiers(calc_df[site_code][file_number])[0]:
                 # Extract the DataFrame corresponding to the identifier from df_files dictionary
                 df = calc_df[site_code][file_number].get(identifier)
                 if df is not None:
@@ -588,15 +828,15 @@ for (site_code, file_number), file_name in calculations.items():
                         calc_df_files[site_code][file_number] = {}
                     calc_df_files[site_code][file_number][identifier] = df
         else:
-            print(f"File number {file_number} not found for site code {site_code} in calc_df.")
+            log.warning(f"File number {file_number} not found for site code {site_code} in calc_df.")
     else:
-        print(f"Site code {site_code} not found in calc_df.")
+        log.warning(f"Site code {site_code} not found in calc_df.")
 
-# Now, calc_df_files will contain the DataFrames corresponding to the files listed in the calculations dictionary, including both 'a' and 'b' identifiers.
+# Now, calc_df_files will contain the DataFrames corresponding to the files listed in the calculations dictionary, including every duplicate identifier.
 
 # %% [markdown]
 # ### Create comparison columns for calculations
-# This cell iterates through the dataframes in calc_df_files, and adds the temperature column from the _b dataframe to the _a dataframe. These columns are then renamed as Temp A and Temp B.
+# This cell iterates through the dataframes in calc_df_files, and copies the temperature column of the _a dataframe to Temp A. Temp B (and Temp E, ... for more loggers) already holds the temperatures that were matched by time in the Calculations check cell, and the average and flags come from its duplicate_results.
 
 # %%
 # Iterate through each site code
@@ -606,23 +846,22 @@ for site_code, file_numbers in calc_df_files.items():
         if 'a' in identifiers:
             # Get the dataframe calc_a
             calc_a = identifiers['a']['DataFrame']
-            calc_b = identifiers['b']['DataFrame']
             
-            # Add the temp column from b to a and rename both
-            calc_a["Temp A"] = calc_a.loc[:, "Temp, °C"]
-            calc_a["Temp B"] = calc_b.loc[:, "Temp, °C"]
+            # Add the temp column from a (Temp B was matched by time in the Calculations check cell)
+            calc_a["Temp A"] = hobo_io.temps_as_float64(calc_a["Temp, °C"])
             
-            #Add the average column
-            calc_a["Average_temp"] = (calc_a['Temp A'] + calc_a['Temp B'])/2
+            #Add the average column (mean or median of all the loggers)
+            consensus = duplicate_results[(site_code, file_number)][2]
+            calc_a["Average_temp"] = consensus['average']
 
             #Add a boolean flag column
-            calc_a['Flag'] = calc_a["Temperature_Difference"] > 0.2
+            calc_a['Flag'] = consensus['flag']
             
 
             # Print calc_a
-            print(f"DataFrame for Site Code: {site_code}, File Number: {file_number} (calc_a)")
-            print(calc_a)
-            print("\n")
+            log.debug(f"DataFrame for Site Code: {site_code}, File Number: {file_number} (calc_a)")
+            hobo_log.show(f"calc_a_{site_code}_{file_number}", calc_a)
+            log.debug("\n")
 
 # %% [markdown]
 # ### Report number of "true" flags for each calculations file
@@ -639,11 +878,13 @@ for site_code, file_numbers in calc_df_files.items():
             
             # Count the number of 'True' values in the filtered DataFrame
             true_count = calc_a['Flag'].astype(str).value_counts().get('True',0)
-            print(f"{site_code} {file_number}, Number of 'True' values flagged: {true_count}")
+            log.info(f"{site_code} {file_number}, Number of 'True' values flagged: {true_count}")
 
 # %% [markdown]
 # ### Offload calculation comparisons
 # This cell will offload the files marked as calculations. Each file will have the number, date time, and two temperature columns for comparison and the difference between them. These files will then be uploaded to the calculations folder on the google drive for the year specified.
+# <li>The files are written by the background threads of the export writer (see the Export writer cell) while the loop goes on to the next site.
+# <li>Each file is written under a temporary name and only renamed when it is complete, so a file in the output folder is never half written.
 # 
 # <l><u>Make sure to update the working directory!
 
@@ -658,6 +899,9 @@ calculations_folder = os.path.join(output_folder, "Provisional Duplicates")
 if not os.path.exists(calculations_folder):
     os.makedirs(calculations_folder)
 
+# Files queued on the export writer (see the Export writer cell)
+queued_exports = []
+
 # Iterate through each site code
 for site_code, file_numbers in calc_df_files.items():
     # Iterate through each file number
@@ -680,19 +924,25 @@ for site_code, file_numbers in calc_df_files.items():
             output_file_name = f"PD_{base_file_name}.csv"
             output_file_path = os.path.join(calculations_folder, output_file_name)
             
-            # Drop unnecessary columns from calc_a
-            calc_a = calc_a[['#', 'Date Time, GMT-04:00', 'Temp A', 'Temp B', 'Temperature_Difference','Average_temp','Flag']]
+            # Drop unnecessary columns from calc_a (one Temp column per duplicate logger)
+            temp_columns = [f"Temp {identifier.upper()}" for identifier in duplicate_results[(site_code, file_number)][0]]
+            calc_a = calc_a[['#', 'Date Time, GMT-04:00'] + temp_columns + ['Temperature_Difference','Average_temp','Flag']]
             
-            # Save the 'a' DataFrame to CSV
-            calc_a.to_csv(output_file_path, index=False)
-            
-            print(f"File saved: Site: {site_code}, File Number: {file_number}, Path: {output_file_path}")
+            # Queue the 'a' DataFrame to be saved to CSV
+            queued_exports.append(hobo_io.queue_export(export_writer, hobo_io.write_csv_atomic,
+                                                       calc_a, output_file_path, export_engine))
+            group_outputs.setdefault((site_code, file_number), []).append(output_file_path)
         else:
-            print(f"No 'a' version found for Site: {site_code}, File Number: {file_number}")
+            log.debug(f"No 'a' version found for Site: {site_code}, File Number: {file_number}")
+
+# Wait for the queued files to be written
+for output_file_path in hobo_io.finish_exports(queued_exports):
+    log.debug(f"File saved: {output_file_path}")
 
 # %% [markdown]
 # ### Averaging:
 # If the difference is 0.2 or less, the old temperature columns are dropped and replaced by the averaged one. If the difference is greater than 0.2 the columns are not averaged and are left blank to be identified in a later cell.
+# The average is the consensus worked out for the whole column at once in the Calculations check cell (hobo_qc.duplicate_consensus) instead of row by row, which takes seconds instead of minutes on year-long files. Run benchmarks.py to compare the two.
 
 # %%
 #%% Check to see if there is a .2 degrees difference then average the two columns and record the site codes where this occured 
@@ -702,19 +952,16 @@ for site_code, file_numbers in calc_df_files.items():
 for site_code, file_numbers in df_files.items():
     # Iterate through each file number
     for file_number, identifiers in file_numbers.items():
-        # Check if there are both 'a' and 'b' files for the current site code and file number
-        if 'a' in identifiers and 'b' in identifiers:
-            # Get the 'a' and 'b' dataframes
+        # Check if the duplicates of the current site code and file number were compared in the Calculations check cell
+        if (site_code, file_number) in duplicate_results:
+            # Get the 'a' dataframe
             df_a = identifiers['a']['DataFrame']
-            df_b = identifiers['b']['DataFrame']
             
-            # Check if the temperature columns exist in both dataframes
-            if 'Temp, °C' in df_a.columns and 'Temp, °C' in df_b.columns:
-                # Calculate the average temperature between the two temperature columns of "a" and "b" if the temperature difference is .2 or below
-                df_a['Average_Temperature'] = df_a.apply(
-                    lambda row: (row['Temp, °C'] + df_b.loc[row.name,'Temp, °C']) / 2 if row['Temperature_Difference'] <= 0.2 else None,
-                    axis=1
-                )
+            # Check if the temperature column exists
+            if 'Temp, °C' in df_a.columns:
+                # Use the consensus of the duplicate loggers if the temperature difference is duplicate_threshold (.2) or below
+                # (calculated for the whole column at once in the Calculations check cell, rows above .2 are left as NaN)
+                df_a['Average_Temperature'] = duplicate_results[(site_code, file_number)][2]['consensus']
                 # Drop the old 'Temp, °C' column to replace with new average column
                 df_a.drop(columns=['Temp, °C'], inplace=True)
                 
@@ -722,9 +969,9 @@ for site_code, file_numbers in df_files.items():
                 df_a.rename(columns={'Average_Temperature': 'Temp, °C'}, inplace=True)
                 
             else:
-                print(f"Temperature columns not found for Site: {site_code}, File Number: {file_number}")
+                log.warning(f"Temperature columns not found for Site: {site_code}, File Number: {file_number}")
         else:
-            print(f"Only one file for Site: {site_code}, File Number: {file_number}, so averaging could not occur")
+            log.debug(f"Only one file for Site: {site_code}, File Number: {file_number}, so averaging could not occur")
 
 # %% [markdown]
 # ### Show NaNs for calculations:
@@ -745,9 +992,7 @@ for (site_code, file_number), file_name in calculations.items():
         nan_count = df_a['Temp, °C'].isna().sum()
 
         # Print the file details and the NaN count
-        print(f"For file {file_name}") 
-        print(f"{nan_count} is the number of points where the temperature difference was above .2°C")
-        print()
+        log.info(f"For file {file_name}: {nan_count} is the number of points where the temperature difference was above .2°C")
 
 
 # %% [markdown]
@@ -756,52 +1001,20 @@ for (site_code, file_number), file_name in calculations.items():
 
 # %%
 #%% Drop columns
-# Iterate through each site code
+# Iterate through every file of every site code and file number
 for site_code, file_numbers in df_files.items():
-    # Iterate through each file number
     for file_number, identifiers in file_numbers.items():
-        # Check if there are both 'a' and 'b' files for the current site code and file number
-        if 'a' in identifiers:
-            # Get the 'a' dataframe
-            df_a = identifiers['a']['DataFrame']
-            
-            # Drop all columns except '#' 'Date Time, GMT-04:00' and 'Temp, °C'
+        for file_identifier, file_info in identifiers.items():
+            # The 'merged' offset table has its own columns (see Merge the offset files)
+            if file_identifier == 'merged':
+                continue
+
+            # Drop all columns except '#', 'Date Time, GMT-04:00' and 'Temp, °C'
             columns_to_keep = ['#', 'Date Time, GMT-04:00', 'Temp, °C']
-            df_a = df_a[columns_to_keep]
             #df_a = df_a.rename(columns={'#': 'number','Date Time, GMT-04:00': 'Date Time GMT-04:00','Temp, °C': 'Temp C'})
-            
-            # Update the dataframe in df_files
-            df_files[site_code][file_number]['a']['DataFrame'] = df_a
-
-            if 'b' in identifiers:
-                # Get the 'b' dataframe
-                df_b = identifiers['b']['DataFrame']
-
-                # Drop all columns except '#', 'Date Time, GMT-04:00' and 'Temp, °C'
-                df_b = df_b[columns_to_keep]
 
-                # Update the dataframe in df_files
-                df_files[site_code][file_number]['b']['DataFrame'] = df_b
-
-                if 'c' in identifiers:
-                    # Get the 'c' dataframe
-                    df_c = identifiers['c']['DataFrame']
-
-                    # Drop all columns except '#', 'Date Time, GMT-04:00' and 'Temp, °C'
-                    df_c = df_c[columns_to_keep]
-
-                    # Update the dataframe in df_files
-                    df_files[site_code][file_number]['c']['DataFrame'] = df_c
-                    
-                    if 'd' in identifiers:
-                        # Get the 'd' dataframe
-                        df_d = identifiers['d']['DataFrame']
-
-                        # Drop all columns except '#', 'Date Time, GMT-04:00' and 'Temp, °C'
-                        df_d = df_d[columns_to_keep]
-
-                        # Update the dataframe in df_files
-                        df_files[site_code][file_number]['d']['DataFrame'] = df_d
+            # Update the dataframe in df_files
+            file_info['DataFrame'] = file_info['DataFrame'][columns_to_keep]
 
 # %% [markdown]
 # ### <b>Plotting graphs:
@@ -814,23 +1027,26 @@ for site_code, file_numbers in df_files.items():
 # %%
 #%% Individual plots
 
+# Choose how the readings are downsampled before plotting: 'minmax', 'lttb' or None to plot every reading
+plot_decimation = 'minmax'
+plot_points = 4000
+
 # # Get the DataFrame
 df = df_files['TCSPTH']['2311']['a']['DataFrame']
 
-# # Convert the 'Date Time, GMT-04:00' column to datetime format
-df['Date Time, GMT-04:00'] = pd.to_datetime(df['Date Time, GMT-04:00'])
-
+# # Pick the readings to draw
+plot_df = hobo_plots.decimate_frame(df, plot_decimation, plot_points)
 
 # # Plot the temperature over time
 plt.figure(figsize=(12, 6))
-plt.plot(df.index, df['Temp, °C'], color='blue', marker='o', linestyle='-')
+plt.plot(plot_df.index, plot_df['Temp, °C'], color='blue', marker='o', linestyle='-')
 plt.title('Temperature Over Time')
 plt.xlabel('Date Time')
 plt.ylabel('Temp, °C')  # Modified label
 plt.grid(True)
 plt.xticks(rotation=45)
 plt.tight_layout()
-plt.show()
+hobo_log.show_figure()
 
 # %% [markdown]
 # ### Plotting Loop without displaying months:
@@ -839,23 +1055,23 @@ plt.show()
 # %%
 #%% Loop all plots without altering time to display as months -- Runs Faster
 
+# # Choose how the readings are downsampled before plotting: 'minmax', 'lttb' or None to plot every reading
+# plot_decimation = 'minmax'
+# plot_points = 4000
+
 # # Loop through df_files and plot graphs for each DataFrame
 # for site_code, site_data in df_files.items():
 #     for file_number, file_data in site_data.items():
 #         for file_identifier, file_info in file_data.items():
-#             # Get the DataFrame
+#             # Get the DataFrame ('Date Time, GMT-04:00' was already converted to datetime when the file was read)
 #             df = file_info['DataFrame']
 
-#             # Convert the 'Date Time, GMT-04:00' column to datetime format
-#             #df['Date Time, GMT-04:00'] = pd.to_datetime(df['Date Time, GMT-04:00'])
-            
-#             # This was changed to deal with a error caused by modify a slice of a dataframe
-#             # This iloc explicitly sets values in the dataframe 
-#             df.loc[:, 'Date Time, GMT-04:00'] = pd.to_datetime(df['Date Time, GMT-04:00'])
+#             # Pick the readings to draw
+#             plot_df = hobo_plots.decimate_frame(df, plot_decimation, plot_points)
 
 #             # Plot the temperature over time
 #             plt.figure(figsize=(12, 6))
-#             plt.plot(df.index, df['Temp, °C'], color='blue', marker='o', linestyle='-')
+#             plt.plot(plot_df.index, plot_df['Temp, °C'], color='blue', marker='o', linestyle='-')
 #             plt.title(f'Temperature Over Time - Site: {site_code}, File Number: {file_number}, Identifier: {file_identifier}')
 #             plt.xlabel('Date Time')
 #             plt.ylabel('Temp, °C')
@@ -871,19 +1087,23 @@ plt.show()
 # %%
 #%% Loop through df_files and plot graphs for each DataFrame where time is displayed as months
 
+# Choose how the readings are downsampled before plotting: 'minmax', 'lttb' or None to plot every reading
+plot_decimation = 'minmax'
+plot_points = 4000
+
 # Loop through df_files and plot graphs for each DataFrame
 for site_code, site_data in df_files.items():
     for file_number, file_data in site_data.items():
         for file_identifier, file_info in file_data.items():
-            # Get the DataFrame
+            # Get the DataFrame ('Date Time, GMT-04:00' was already converted to datetime when the file was read)
             df = file_info['DataFrame']
 
-            # Convert the 'Date Time, GMT-04:00' column to datetime format
-            df.loc[:, 'Date Time, GMT-04:00'] = pd.to_datetime(df['Date Time, GMT-04:00'])
+            # Pick the readings to draw (the month ticks below still use every reading)
+            plot_df = hobo_plots.decimate_frame(df, plot_decimation, plot_points)
 
             # Plot the temperature over time
             plt.figure(figsize=(12, 6))
-            plt.plot(df.index, df['Temp, °C'], color='blue', marker='o', linestyle='-')
+            plt.plot(plot_df.index, plot_df['Temp, °C'], color='blue', marker='o', linestyle='-')
             plt.title(f'Temperature Over Time - Site: {site_code}, File Number: {file_number}, Identifier: {file_identifier}')
             plt.xlabel('Date Time')
             plt.ylabel('Temp, °C')
@@ -894,7 +1114,7 @@ for site_code, site_data in df_files.items():
             plt.xticks(first_day_of_month_indices, [dt.strftime('%b') for dt in df.loc[first_day_of_month_indices, 'Date Time, GMT-04:00']], rotation=45, fontdict={'family': 'sans-serif', 'size': 25, 'style': 'normal'})
             
             plt.tight_layout()
-            plt.show()
+            hobo_log.show_figure()
 
 # %% [markdown]
 # ### Individual start and end time checks:
@@ -903,11 +1123,11 @@ for site_code, site_data in df_files.items():
 # %%
 # %% Individual start time end time checks 
 print("DataFrame Start Time:", df_files['TCBKIT']['2310']['a']['DataFrame']['Date Time, GMT-04:00'].iloc[0])
-print("Deployment Data Start Time:", deployment_data_dict['BT_TCBKIT_2310_']['Date In Time In'])
+print("Deployment Data Start Time:", deployment_data.loc['BT_TCBKIT_2310_', 'Date In Time In'])
 
 # Print end time
 print("DataFrame End Time:", df_files['TCBKIT']['2310']['a']['DataFrame']['Date Time, GMT-04:00'].iloc[-1])
-print("Deployment Data End Time:", deployment_data_dict['BT_TCBKIT_2310_']['Date Out Time Out'])
+print("Deployment Data End Time:", deployment_data.loc['BT_TCBKIT_2310_', 'Date Out Time Out'])
 
 # Then, check if the extracted timestamps match the expected start and end times.
 
@@ -929,34 +1149,32 @@ for site_code, site_data in df_files.items():
             
             if not df.empty:  # Check if the DataFrame is not empty
                 # Print the start and end times for the current DataFrame
-                print(f"DataFrame Start Time ({site_code}_{file_number}_{file_identifier}):", df['Date Time, GMT-04:00'].iloc[0])
-                print(f"DataFrame End Time ({site_code}_{file_number}_{file_identifier}):", df['Date Time, GMT-04:00'].iloc[-1])
+                log.debug(f"DataFrame Start Time ({site_code}_{file_number}_{file_identifier}): {df['Date Time, GMT-04:00'].iloc[0]}")
+                log.debug(f"DataFrame End Time ({site_code}_{file_number}_{file_identifier}): {df['Date Time, GMT-04:00'].iloc[-1]}")
 
                 # Get the corresponding offloaded file name
                 offloaded_file_name = file_info['File Name']
                 
                 # Retrieve deployment data using the offloaded file name
-                deployment_data = deployment_data_dict.get(offloaded_file_name)
-                
-                if deployment_data:
+                if offloaded_file_name in deployment_data.index:
                     # Print the start and end times from deployment data
-                    print(f"Deployment Data Start Time ({offloaded_file_name}):", deployment_data['Date In Time In'])
-                    print(f"Deployment Data End Time ({offloaded_file_name}):", deployment_data['Date Out Time Out'])
+                    log.debug(f"Deployment Data Start Time ({offloaded_file_name}): {deployment_data.loc[offloaded_file_name, 'Date In Time In']}")
+                    log.debug(f"Deployment Data End Time ({offloaded_file_name}): {deployment_data.loc[offloaded_file_name, 'Date Out Time Out']}")
                 else:
-                    print(f"No deployment data found for {offloaded_file_name}")
+                    log.warning(f"No deployment data found for {offloaded_file_name}")
 
-                print()  # Add an empty line for better readability
+                log.debug("")  # Add an empty line for better readability
             else:
                 # If DataFrame is empty, append its name to the list
                 empty_dataframes.append(f"{site_code}_{file_number}_{file_identifier}")
 
 # Print names of empty DataFrames
 if empty_dataframes:
-    print("Names of empty DataFrames:")
+    log.warning(f"Names of the {len(empty_dataframes)} empty DataFrames:")
     for name in empty_dataframes:
-        print(name)
+        log.warning(name)
 else:
-    print("No empty DataFrames found.")
+    log.info("No empty DataFrames found.")
 
 # %% [markdown]
 # ## <u>Trimmed file dates </u>
@@ -985,9 +1203,9 @@ for site_code, site_data in df_files.items():
             else:
                 output_file_name = f"{base_file_name}.csv"
             
-            print(f"{output_file_name}")
+            log.debug(f"{output_file_name}")
         else:
-            print(f"No 'a' version found for Site: {site_code}, File Number: {file_number}")
+            log.debug(f"No 'a' version found for Site: {site_code}, File Number: {file_number}")
 
 # %% [markdown]
 # ## <b>Step 2 and 3. Offload data and file naming conventions
@@ -995,6 +1213,7 @@ for site_code, site_data in df_files.items():
 # %% [markdown]
 # ### Setting output folder and exporting the .csv files:
 # This cell defines the output folder, creating the folder if not existing previously, then runs a loop, first checking for the a version of the file and then extracting that data frame to export the .csv files by the naming convention set in the SOP as BT_site_code_year_month_first_year_month_last. Inside the loop also checks if the file was identified as "calculations", if so then adds "_calculations.csv" as is the naming convention set for them in the SOP. Internal calculations offloads the files that have the temperature columns averaged and empty cells to show the number of instances where there was a difference >0.2 and will not be uploaded to the drive.
+# <li>The cleaned data is also added to a parquet archive in the parquet_archive folder, split into folders by site code and year, with a 'calculations' column marking the calculation files. Multi-year questions for a site can then be answered with hobo_io.read_archive(archive_dir, site_codes=['TCSR41'], years=[2022, 2023]) without reading every .csv. The archive is off by default (archive_dir = None). To turn it on set archive_dir to a folder, e.g. os.path.join(output_folder, "parquet_archive") (pyarrow must be installed to use it). The partition files of every group are recorded in the manifest, so files left over from an earlier run (e.g. a year that was trimmed off) are deleted.
 # <li><u>Make sure to update the folder path in the cell!</u>
 
 # %%
@@ -1004,10 +1223,20 @@ output_folder = r"C:\UVI\QAQC stuff\Temp_TCRMP_2024_Output"
 # Define the internal calculations folder within the output folder
 internal_calculations_folder = os.path.join(output_folder, "internal_calculations")
 
+# Define the parquet archive folder (e.g. os.path.join(output_folder, "parquet_archive")), None skips the archive
+archive_dir = None
+
 # Create the calculations folder if it doesn't exist
 if not os.path.exists(internal_calculations_folder):
     os.makedirs(internal_calculations_folder)
 
+# Files queued on the export writer (see the Export writer cell)
+queued_exports = []
+queued_archives = {}
+
+step_start = hobo_metrics.start_step()
+exported_rows = 0
+
 # Iterate through df_files to extract and save the "a" version of the files
 for site_code, site_data in df_files.items():
     for file_number, file_data in site_data.items():
@@ -1032,12 +1261,51 @@ for site_code, site_data in df_files.items():
                 output_file_name = f"{base_file_name}.csv"
                 output_file_path = os.path.join(output_folder, output_file_name)
             
-            # Save the DataFrame to CSV
-            df_a.to_csv(output_file_path, index=False)
-            
-            print(f"File saved: {output_file_path}")
+            # Queue the DataFrame to be saved to CSV
+            queued_exports.append(hobo_io.queue_export(export_writer, hobo_io.write_csv_atomic,
+                                                       df_a, output_file_path, export_engine))
+            group_outputs.setdefault((site_code, file_number), []).append(output_file_path)
+            exported_rows += len(df_a)
+
+            # Queue the data to be added to the parquet archive
+            if archive_dir is not None:
+                queued_archives[(site_code, file_number)] = hobo_io.queue_export(
+                    export_writer, hobo_io.write_archive, df_a, archive_dir, site_code, file_number, base_file_name,
+                    calculations=(site_code, file_number) in calculations)
         else:
-            print(f"No 'a' version found for Site: {site_code}, File Number: {file_number}")
+            log.debug(f"No 'a' version found for Site: {site_code}, File Number: {file_number}")
+
+# Wait for the queued files to be written
+for output_file_path in hobo_io.finish_exports(queued_exports):
+    log.debug(f"File saved: {output_file_path}")
+group_archives = dict(zip(queued_archives, hobo_io.finish_exports(list(queued_archives.values()))))
+
+# This was the last export, so the writer threads can be stopped
+if export_writer is not None:
+    export_writer.shutdown()
+
+# Record the exported groups and their archive files in the manifest so they are skipped next run
+# (with the archive turned off the archive files recorded on earlier runs are left alone)
+for (site_code, file_number), outputs in group_outputs.items():
+    archive_files = group_archives.get((site_code, file_number), []) if archive_dir is not None else None
+    removed_outputs = hobo_io.record_group(manifest, site_code, file_number,
+                                           group_fingerprints[hobo_io.group_key(site_code, file_number)], outputs,
+                                           archive_files)
+    for removed_output in removed_outputs:
+        log.info(f"Removed old output: {removed_output}")
+hobo_io.save_manifest(manifest, manifest_path)
+log.info(f"Exported {sum(len(outputs) for outputs in group_outputs.values())} files to {output_folder}")
+if archive_dir is not None:
+    log.info(f"Added {sum(len(archive_files) for archive_files in group_archives.values())} files to the parquet archive in {archive_dir}")
+
+# Add the exported files to the file catalog
+if catalog_path is not None:
+    hobo_catalog.update_catalog(catalog, [output for outputs in group_outputs.values() for output in outputs
+                                          if output.endswith('.csv')], kind='exported')
+
+hobo_metrics.record_step(metrics_path, 'export', step_start,
+                         files=sum(output.endswith('.csv') for outputs in group_outputs.values() for output in outputs),
+                         rows_out=exported_rows)
 
 # %% [markdown]
 # ### Offload loop: a and merged data
@@ -1080,7 +1348,8 @@ for site_code, site_data in df_files.items():
 # %% [markdown]
 # ### Offloading plots: only a files
 # Code below reads in the newly offloaded csv files, converts the date time, and plots the temperature over time for each .csv file then exports them to a folder.
-# <li><u>To save the plots, you will need to create a directory (a folder). Make sure to update that folder path in the save_dir = part of the cell!</u>
+# <li>The plots are saved without being shown, so many plots can be made without running out of memory. Set plot_mode to 'process' to make the plots in parallel on every CPU core, or 'serial' to make them one at a time.
+# <li><u>The graphs folder is created if it doesn't exist. Make sure to update that folder path in the save_dir = part of the cell!</u>
 
 # %%
 #%% Using new offloaded files create plots and save plots to a folder
@@ -1093,42 +1362,26 @@ file_pattern = '*.csv'
 # Use glob to get a list of file paths matching the pattern set in file_pattern
 exported_csv_files = glob.glob(exported_folder_path + '/' + file_pattern)
 
-# Loop through each CSV file
-for csv_file in exported_csv_files:
-    # Read the CSV file into a pandas DataFrame
-    df = pd.read_csv(csv_file)
-    
-    df['Date Time, GMT-04:00'] = pd.to_datetime(df['Date Time, GMT-04:00'], format='%Y-%m-%d %H:%M:%S')
-
-    # Convert the 'Date Time, GMT-04:00' column to datetime format
-    #df.loc[:, 'Date Time, GMT-04:00'] = pd.to_datetime(df['Date Time, GMT-04:00'])
-    df['Date Time, GMT-04:00'] = pd.to_datetime(df['Date Time, GMT-04:00'])
-    # Plot the data
-    plt.figure(figsize=(12, 6))
-    plt.plot(df['Date Time, GMT-04:00'], df['Temp, °C'], color='blue', marker='o', linestyle='-')
-    plt.title('Temperature Over Time')
-    plt.xlabel('Date Time')
-    plt.ylabel('Temp, °C')
-    plt.grid(True)
-    
-    # Set x-axis ticks to display month names at regular intervals
-    # first_day_of_month_indices = df.index[df['Date Time, GMT-04:00'].dt.day == 1]
-    # plt.xticks(first_day_of_month_indices, [dt.strftime('%b') for dt in df.loc[first_day_of_month_indices, 'Date Time, GMT-04:00']], rotation=45, fontdict={'family': 'sans-serif', 'size': 25, 'style': 'normal'})
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    
-    # Extract file name from the file path
-    file_name = os.path.basename(csv_file)
-    
-    # Define the file name for the plot
-    plot_file_name = os.path.splitext(file_name)[0] + '_plot.png'
-    
-    save_dir = r"C:\UVI\QAQC stuff\Temp_TCRMP_2024_Output\graphs"
-    # Save the plot
-    plt.savefig(os.path.join(save_dir, plot_file_name))
-    
-    # Show the plot (optional)
-    # plt.show()
+# When running incrementally only plot the files that were exported in this run
+if incremental:
+    run_output_files = {os.path.normpath(output) for outputs in group_outputs.values() for output in outputs}
+    exported_csv_files = [csv_file for csv_file in exported_csv_files if os.path.normpath(csv_file) in run_output_files]
+
+save_dir = r"C:\UVI\QAQC stuff\Temp_TCRMP_2024_Output\graphs"
+
+# Choose how the plots are made: 'serial', 'thread' or 'process'
+plot_mode = 'process'
+
+# Choose how the readings are downsampled before plotting: 'minmax', 'lttb' or None to plot every reading
+plot_decimation = 'minmax'
+plot_points = 4000
+
+# Save a {file name}_plot.png for every exported file
+step_start = hobo_metrics.start_step()
+plot_files = hobo_plots.plot_exported_files(exported_csv_files, save_dir, mode=plot_mode,
+                                            decimation=plot_decimation, max_points=plot_points)
+log.info(f"Saved {len(plot_files)} plots to {save_dir}")
+hobo_metrics.record_step(metrics_path, 'plot', step_start, files=len(plot_files))
 
 # %% [markdown]
 # ### Offload loop: a and merged plots
@@ -1142,15 +1395,15 @@ for csv_file in exported_csv_files:
 #         for file_identifier, file_info in file_data.items():
 #             # Check if the file_identifier starts with 'a' or is 'merged'
 #             if file_identifier.startswith('a') or file_identifier == 'merged':
-#                 # Get the DataFrame
+#                 # Get the DataFrame ('Date Time, GMT-04:00' was already converted to datetime when the file was read)
 #                 df = file_info['DataFrame']
 
-#                 # Convert the 'Date Time, GMT-04:00' column to datetime format
-#                 df.loc[:, 'Date Time, GMT-04:00'] = pd.to_datetime(df['Date Time, GMT-04:00'])
+#                 # Pick the readings to draw ('minmax', 'lttb' or None to plot every reading)
+#                 plot_df = hobo_plots.decimate_frame(df, 'minmax', 4000)
 
 #                 # Plot the temperature over time
 #                 plt.figure(figsize=(12, 6))
-#                 plt.plot(df.index, df['Temp, °C'], color='blue', marker='o', linestyle='-')
+#                 plt.plot(plot_df.index, plot_df['Temp, °C'], color='blue', marker='o', linestyle='-')
 #                 plt.title(f'Temperature Over Time - Site: {site_code}, File Number: {file_number}, Identifier: {file_identifier}')
 #                 plt.xlabel('Date Time')
 #                 plt.ylabel('Temp, °C')
@@ -0,0 +1,181 @@
+#%% Benchmarks
+# Times the slow steps of QAQC_V1.7.3.py against the faster versions in hobo_qc.py on
+# synthetic data, so the speedup can be checked without the real working folder.
+# The stage benchmark times every stage of the pipeline (hobo_pipeline.py) on a synthetic
+# working folder made by generate_hobo_data.py, to see where it slows down as the data grows.
+# Run with: python benchmarks.py
+#       or: python benchmarks.py --stages --sites 38 --deployments 10
+
+#%% Imports
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import generate_hobo_data
+import hobo_pipeline
+import hobo_qc
+import hobo_rules
+from hobo_io import TEMP_COLUMN
+
+
+#%% Synthetic data
+def synthetic_duplicate_pair(n_rows=365 * 24 * 4, seed=0):
+    """Make a synthetic year-long pair of 15 minute 'a' and 'b' DataFrames.
+
+    About 1% of the 'b' readings are pushed more than 0.2 °C away from 'a' so some rows are flagged.
+    """
+    rng = np.random.default_rng(seed)
+    times = pd.date_range('2023-01-01', periods=n_rows, freq='15min')
+    temp = 27 + np.sin(np.arange(n_rows) / 96 * 2 * np.pi) + rng.normal(0, 0.05, n_rows)
+    temp_b = temp + rng.normal(0, 0.03, n_rows)
+    off = rng.random(n_rows) < 0.01
+    temp_b[off] += 0.5
+
+    df_a = pd.DataFrame({'#': np.arange(1, n_rows + 1), 'Date Time, GMT-04:00': times, TEMP_COLUMN: temp.round(3)})
+    df_b = pd.DataFrame({'#': np.arange(1, n_rows + 1), 'Date Time, GMT-04:00': times, TEMP_COLUMN: temp_b.round(3)})
+    df_a['Temperature_Difference'] = abs(df_a[TEMP_COLUMN] - df_b[TEMP_COLUMN])
+    return df_a, df_b
+
+
+def timed(function, *args, **kwargs):
+    """Run a function and return (result, seconds)."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+#%% a/b averaging
+def rowwise_average(df_a, df_b):
+    """The original row by row averaging from the Averaging cell."""
+    return df_a.apply(
+        lambda row: (row[TEMP_COLUMN] + df_b.loc[row.name, TEMP_COLUMN]) / 2 if row['Temperature_Difference'] <= 0.2 else None,
+        axis=1
+    )
+
+
+def benchmark_averaging(n_rows=365 * 24 * 4):
+    """Compare the row by row averaging with hobo_qc.duplicate_consensus on a year-long pair."""
+    df_a, df_b = synthetic_duplicate_pair(n_rows)
+
+    old, old_seconds = timed(rowwise_average, df_a, df_b)
+    temps = np.column_stack([df_a[TEMP_COLUMN].to_numpy(), df_b[TEMP_COLUMN].to_numpy()])
+    result, new_seconds = timed(hobo_qc.duplicate_consensus, temps, 0.2)
+    new = pd.Series(result['consensus'], index=df_a.index)
+
+    # Both versions must give the same numbers, including NaN where the difference is above 0.2
+    pd.testing.assert_series_equal(old.astype(float), new, check_names=False)
+
+    print(f"a/b averaging on {n_rows} rows: row-wise {old_seconds:.3f} s, vectorized {new_seconds:.4f} s, "
+          f"{old_seconds / new_seconds:.0f}x faster ({int(new.isna().sum())} rows above 0.2)")
+
+
+#%% a/b matching by time
+def benchmark_duplicate_matching(n_rows=365 * 24 * 4):
+    """Time hobo_qc.match_duplicate_times on a year-long pair where 'b' started one sample late."""
+    df_a, df_b = synthetic_duplicate_pair(n_rows)
+    df_b = df_b.iloc[1:].reset_index(drop=True)
+
+    (temp_b, unmatched_a, unmatched_b), seconds = timed(hobo_qc.match_duplicate_times, df_a, df_b)
+
+    # Every 'b' reading should line up with the 'a' reading taken at the same time
+    assert np.array_equal(temp_b.to_numpy()[1:], df_b[TEMP_COLUMN].to_numpy())
+    print(f"a/b matching by time on {n_rows} rows: {seconds:.4f} s "
+          f"({unmatched_a} 'a' and {unmatched_b} 'b' readings unmatched)")
+
+
+#%% Offset alignment
+def benchmark_offset_alignment(n_rows=365 * 24 * 4):
+    """Time hobo_qc.align_loggers on a year-long 'c' and 'd' pair where 'd' samples half an interval later."""
+    df_c, df_d = synthetic_duplicate_pair(n_rows)
+    df_d['Date Time, GMT-04:00'] += pd.Timedelta('7min 30s')
+
+    (times, temps, _), seconds = timed(hobo_qc.align_loggers, {'c': df_c, 'd': df_d})
+
+    # With the default tolerance (half the logging interval) every 'd' reading shares a row with a 'c' reading
+    assert len(times) == n_rows and not np.isnan(temps).any()
+    assert np.array_equal(temps[:, 1], df_d[TEMP_COLUMN].to_numpy())
+    print(f"c/d alignment on {n_rows} rows: {seconds:.4f} s")
+
+
+#%% QC rules
+def benchmark_qc_rules(n_series=38 * 5, n_rows=365 * 24 * 4):
+    """Time hobo_rules.run_rules and interval_check on an archive-sized long table (by default 38 sites x 5 years of 15 minute readings)."""
+    df_a, _ = synthetic_duplicate_pair(n_rows)
+    long_df = pd.DataFrame({
+        'file_name': pd.Categorical.from_codes(np.repeat(np.arange(n_series), n_rows), [str(i) for i in range(n_series)]),
+        'Date Time, GMT-04:00': np.tile(df_a['Date Time, GMT-04:00'].to_numpy(), n_series),
+        TEMP_COLUMN: np.tile(df_a[TEMP_COLUMN].to_numpy(dtype=np.float32), n_series),
+    })
+
+    flags, seconds = timed(hobo_rules.run_rules, long_df)
+    print(f"QC rules on {len(long_df)} readings ({n_series} series): {seconds:.2f} s "
+          f"({int((flags > 0).sum())} readings flagged)")
+    (summary, events), seconds = timed(hobo_rules.interval_check, long_df)
+    print(f"Sampling interval check on {len(long_df)} readings ({n_series} series): {seconds:.2f} s "
+          f"({len(events)} gaps, duplicates and irregular steps)")
+
+
+#%% Pipeline stages
+def peak_memory(function, *args, **kwargs):
+    """Run a function and return the peak MB of python memory allocated while it ran.
+
+    The memory is measured with tracemalloc, which makes the run several times slower (so it is
+    not used for the timings) and does not see memory used by worker processes.
+    """
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / 1e6
+
+
+def benchmark_stages(n_sites=38, n_deployments=1, interval='15min', deployment_days=365, plot_mode='serial',
+                     memory=True):
+    """Time and memory profile every pipeline stage on a synthetic dataset of the given size.
+
+    Every stage is run once for the time and, if memory is True, once more for the peak memory.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        _, seconds = timed(generate_hobo_data.generate_dataset, folder, n_sites, n_deployments,
+                           interval, deployment_days)
+        config = hobo_pipeline.default_config(working_folder=f"{folder}/working_folder",
+                                              deployment_log=f"{folder}/Temperature_UVI_deployment_log.csv",
+                                              output_folder=f"{folder}/output", stage_cache=f"{folder}/stage_cache")
+        config['plot']['mode'] = plot_mode
+        csv_files = hobo_pipeline.working_files(config)
+        print(f"{len(csv_files)} files from {n_sites} sites x {n_deployments} deployments at {interval} "
+              f"(generated in {seconds:.1f} s)")
+
+        results = {}
+        for stage in hobo_pipeline.STAGES:
+            inputs = [results[name] for name in hobo_pipeline.STAGE_INPUTS[stage]]
+            results[stage], seconds = timed(hobo_pipeline.run_stage, config, stage, csv_files, inputs)
+            if memory:
+                peak_mb = peak_memory(hobo_pipeline.run_stage, config, stage, csv_files, inputs)
+                print(f"  {stage:<11} {seconds:8.2f} s  {peak_mb:8.1f} MB peak")
+            else:
+                print(f"  {stage:<11} {seconds:8.2f} s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the QAQC steps on synthetic data.")
+    parser.add_argument('--stages', action='store_true', help="time the pipeline stages instead of the a/b steps")
+    parser.add_argument('--sites', type=int, default=38, help="number of sites (default: %(default)s)")
+    parser.add_argument('--deployments', type=int, default=1, help="deployments per site (default: %(default)s)")
+    parser.add_argument('--interval', default='15min', help="sampling interval (default: %(default)s)")
+    parser.add_argument('--no-memory', action='store_true', help="only time the stages (each stage then runs once)")
+    args = parser.parse_args()
+
+    if args.stages:
+        benchmark_stages(args.sites, args.deployments, args.interval, memory=not args.no_memory)
+    else:
+        benchmark_averaging()
+        benchmark_duplicate_matching()
+        benchmark_offset_alignment()
+        benchmark_qc_rules()
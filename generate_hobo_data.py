@@ -0,0 +1,142 @@
+#%% Synthetic HOBO data
+# Makes a working folder of realistic HOBO .csv files and a matching Temperature_UVI_deployment_log
+# .csv, so the script and the pipeline can be tried and timed without the real data, at any size.
+#
+# Every logger is launched a day before it goes in the water and read out half a day after it is
+# taken out, so the files start and end with air readings that the deployment trim has to remove.
+# Each deployment is either one logger (file identifier left blank), a duplicate pair ('a' and 'b')
+# or an offset pair ('c' and 'd', the 'd' logger sampling half an interval later). Some of the 'b'
+# loggers drift away from their 'a' logger so they are flagged as calculation files.
+#
+# Run with: python generate_hobo_data.py OUTPUT_FOLDER --sites 38 --deployments 2 --interval 15min
+
+#%% Imports
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from hobo_io import DATE_COLUMN, DATE_FORMAT, TEMP_COLUMN
+
+# The site codes of the site codes cell in QAQC_V1.7.3.py. When more sites are asked for,
+# the extra sites are named TC0001, TC0002, ...
+SITE_CODES = ["TCCORB", "TCFSHB", "TCMERI", "TCBKPT", "TCBOTB", "TCBRWB", "TCBKIT",
+              "TCCORK", "TCCLGE", "TCFLTC", "TCGB63", "TCGMKT", "TCHB40", "TCHB30",
+              "TCHB20", "TCMAGB", "TCSAVA", "TCSHCS", "TCSCAP", "TCSC35", "TCSWAT",
+              "TCLSTJ", "TCBKIX", "TCBX33", "TCCB08", "TCCB40", "TCCB99", "TCCB67",
+              "TCCSTL", "TCEAGR", "TCGRPD", "TCJCKB", "TCKNGC", "TCLBEM", "TCLB99",
+              "TCLB67", "TCLBRH", "TCMT24", "TCMT40", "TCSR30", "TCSR99", "TCSR41",
+              "TCSR67", "TCSR10", "TCSPTH"]
+
+# The logger event columns that come after the temperature in a HOBO export
+EVENT_COLUMNS = ['Coupler Attached (LGR S/N: 20502000)', 'Host Connected (LGR S/N: 20502000)',
+                 'End Of File (LGR S/N: 20502000)']
+
+DEPLOYMENT_LOG_COLUMNS = ['Offloaded Filename', 'Date In', 'Time In', 'Date Full', 'Date Out', 'Time Out']
+
+
+#%% Site codes and temperatures
+def site_code_list(n_sites):
+    """Return n_sites site codes, starting with the real ones."""
+    extra = [f"TC{number:04d}" for number in range(1, max(0, n_sites - len(SITE_CODES)) + 1)]
+    return (SITE_CODES + extra)[:n_sites]
+
+
+def water_temperature(times, site_offset, rng):
+    """Return a water temperature for every time: a seasonal and a daily cycle plus noise."""
+    day_of_year = times.dayofyear.to_numpy()
+    hour = (times.hour + times.minute / 60).to_numpy()
+    seasonal = 28 + 1.5 * np.sin((day_of_year - 120) / 365.25 * 2 * np.pi)
+    daily = 0.3 * np.sin((hour - 9) / 24 * 2 * np.pi)
+    return seasonal + daily + site_offset + rng.normal(0, 0.05, len(times))
+
+
+def logger_frame(times, temps):
+    """Return a DataFrame laid out like a HOBO export ('#', date, temperature and the event columns)."""
+    df = pd.DataFrame({'#': np.arange(1, len(times) + 1), DATE_COLUMN: times.strftime(DATE_FORMAT),
+                       TEMP_COLUMN: np.round(temps, 3)})
+    for column in EVENT_COLUMNS:
+        df[column] = ''
+    if len(df):
+        df.loc[len(df) - 1, EVENT_COLUMNS[-1]] = 'Logged'
+    return df
+
+
+#%% Dataset
+def generate_dataset(output_folder, n_sites=10, n_deployments=1, interval='15min', deployment_days=365,
+                     start='2022-10-01', duplicate_fraction=0.5, offset_fraction=0.1, drift_fraction=0.2, seed=0):
+    """Write a working folder of synthetic HOBO files and a deployment log to output_folder.
+
+    Every site has n_deployments back to back deployments of deployment_days days. The files are
+    named BT_{site code}_{yymm of retrieval}_{identifier}, so deployment_days should be at least a month.
+    Returns (working_folder, deployment_log_path).
+    """
+    rng = np.random.default_rng(seed)
+    step = pd.Timedelta(interval)
+    working_folder = os.path.join(output_folder, 'working_folder')
+    os.makedirs(working_folder, exist_ok=True)
+
+    log_rows = []
+    for site_code in site_code_list(n_sites):
+        site_offset = rng.normal(0, 0.5)
+        for deployment in range(n_deployments):
+            # Deployed and retrieved in the late morning, at a slightly different time every trip
+            date_in = (pd.Timestamp(start) + pd.Timedelta(days=deployment * deployment_days)
+                       + pd.Timedelta(hours=9) + pd.Timedelta(minutes=int(rng.integers(0, 180))))
+            date_out = date_in + pd.Timedelta(days=deployment_days) - pd.Timedelta(minutes=int(rng.integers(0, 120)))
+            file_number = date_out.strftime('%y%m')
+
+            kind = rng.random()
+            if kind < duplicate_fraction:
+                identifiers = ['a', 'b']
+            elif kind < duplicate_fraction + offset_fraction:
+                identifiers = ['c', 'd']
+            else:
+                identifiers = ['']
+
+            # Launched a day before deployment and read out half a day after retrieval
+            launch = (date_in - pd.Timedelta(days=1)).floor(step)
+            times = pd.date_range(launch, date_out + pd.Timedelta(hours=12), freq=step)
+            in_water = (times >= date_in) & (times <= date_out)
+            water = water_temperature(times, site_offset, rng)
+            air = 30 + rng.normal(0, 1.0, len(times))
+
+            for identifier in identifiers:
+                logger_times = times + step / 2 if identifier == 'd' else times
+                temps = np.where(in_water, water + rng.normal(0, 0.02, len(times)), air)
+                if identifier == 'b' and rng.random() < drift_fraction:
+                    # The 'b' logger slowly drifts away over the deployment
+                    temps = temps + np.linspace(0, 0.5, len(times))
+                file_name = f"BT_{site_code}_{file_number}_{identifier}"
+                logger_frame(logger_times, temps).to_csv(os.path.join(working_folder, file_name + '.csv'), index=False)
+                log_rows.append({'Offloaded Filename': file_name,
+                                 'Date In': f"{date_in.month}/{date_in.day}/{date_in.year}",
+                                 'Time In': date_in.strftime('%H:%M:%S'),
+                                 'Date Full': date_in.strftime('%m/%d/%Y'),
+                                 'Date Out': f"{date_out.month}/{date_out.day}/{date_out.year}",
+                                 'Time Out': date_out.strftime('%H:%M:%S')})
+
+    deployment_log_path = os.path.join(output_folder, 'Temperature_UVI_deployment_log.csv')
+    pd.DataFrame(log_rows, columns=DEPLOYMENT_LOG_COLUMNS).to_csv(deployment_log_path, index=False)
+    return working_folder, deployment_log_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic HOBO .csv files and a matching deployment log.")
+    parser.add_argument('output_folder', help="folder for the working folder and the deployment log")
+    parser.add_argument('--sites', type=int, default=10, help="number of sites (default: %(default)s)")
+    parser.add_argument('--deployments', type=int, default=1, help="deployments per site (default: %(default)s)")
+    parser.add_argument('--interval', default='15min', help="sampling interval (default: %(default)s)")
+    parser.add_argument('--days', type=int, default=365, help="length of a deployment in days (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    working_folder, deployment_log_path = generate_dataset(args.output_folder, args.sites, args.deployments,
+                                                           args.interval, args.days, seed=args.seed)
+    print(f"Wrote {len(os.listdir(working_folder))} files to {working_folder}")
+    print(f"Wrote the deployment log to {deployment_log_path}")
+
+
+if __name__ == '__main__':
+    main()
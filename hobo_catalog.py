@@ -0,0 +1,176 @@
+#%% Catalog of the raw and exported files
+# A SQLite database with one row for every raw HOBO file and every exported file: the parsed site
+# code, file number and identifier, the size, hash and number of readings, the first and last
+# reading time, and (for raw files) the matching row of the deployment log. Questions like
+# "which files cover TCSR41 in 2023?" or "which files are not in the deployment log?" can then be
+# answered from the catalog without reading any data.
+#
+# A file is only read again when its size or modified time changed since it was catalogued, and the
+# first and last reading times come from the first and last lines only (hobo_io.file_time_span).
+# Times are stored as 'YYYY-MM-DD HH:MM:SS' text, so they can be compared as strings in SQL.
+
+#%% Imports
+import hashlib
+import json
+import os
+import sqlite3
+
+import pandas as pd
+
+import hobo_io
+from hobo_io import DATE_FORMAT, EXPORT_DATE_FORMAT
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path              TEXT PRIMARY KEY,
+    kind              TEXT NOT NULL,      -- 'raw' or 'exported'
+    file_name         TEXT NOT NULL,
+    site_code         TEXT,
+    file_number       TEXT,
+    file_identifier   TEXT,
+    size              INTEGER,
+    mtime             INTEGER,
+    hash              TEXT,
+    row_count         INTEGER,
+    first_time        TEXT,
+    last_time         TEXT,
+    date_in_time_in   TEXT,
+    date_out_time_out TEXT,
+    deployment_row    TEXT                -- the deployment log row as JSON, NULL if not in the log
+);
+CREATE INDEX IF NOT EXISTS files_site_time ON files (site_code, first_time, last_time);
+"""
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+#%% Opening the catalog
+def connect(catalog_path):
+    """Open (or create) the catalog database."""
+    folder = os.path.dirname(catalog_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    connection = sqlite3.connect(catalog_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+#%% Reading a file's details
+def scan_file(csv_file, chunk_size=1024 * 1024):
+    """Return (sha1 hash, number of readings) of a .csv file, counting the lines without parsing them.
+
+    Blank lines (e.g. the empty lines some exports end with) are not counted.
+    """
+    sha1 = hashlib.sha1()
+    lines = 0
+    partial_line = b''
+    with open(csv_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+            # The last piece of a chunk may be the start of a line that goes on in the next chunk
+            chunk_lines = (partial_line + chunk).split(b'\n')
+            partial_line = chunk_lines.pop()
+            lines += sum(1 for line in chunk_lines if line.strip())
+    if partial_line.strip():
+        lines += 1  # the last line has no line break
+    return sha1.hexdigest(), max(lines - 1, 0)  # the header is not a reading
+
+
+def time_bounds(csv_file, date_format):
+    """Return the (first, last) reading times of a .csv file as text (None if missing), reading only its first and last lines."""
+    return tuple(None if bound is None else bound.strftime(TIME_FORMAT)
+                 for bound in hobo_io.file_time_span(csv_file, date_format))
+
+
+def parse_catalog_name(csv_file, kind):
+    """Return (site code, file number, file identifier) of a raw or exported file name.
+
+    Exported names (BT_{site}_{yymm}_{yymm}, with PD_ in front for the duplicate comparisons) only
+    carry the site code, their file number and identifier are None.
+    """
+    if kind == 'raw':
+        return hobo_io.parse_file_name(csv_file)[:3]
+    file_name = os.path.splitext(os.path.basename(csv_file))[0]
+    if file_name.startswith('PD_'):
+        file_name = file_name[3:]
+    parts = file_name.split('_')
+    return (parts[1] if len(parts) > 1 else None), None, None
+
+
+#%% Updating the catalog
+def update_catalog(connection, csv_files, kind='raw'):
+    """Add new files to the catalog and refresh the ones whose size or modified time changed.
+
+    kind is 'raw' for HOBO files from the working folder or 'exported' for files written by the script.
+    Returns the number of files that were (re)read.
+    """
+    date_format = DATE_FORMAT if kind == 'raw' else EXPORT_DATE_FORMAT
+    known = {path: (size, mtime) for path, size, mtime in connection.execute("SELECT path, size, mtime FROM files")}
+    updated = 0
+    for csv_file in csv_files:
+        path = os.path.abspath(csv_file)
+        stat = os.stat(path)
+        if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+            continue
+        site_code, file_number, file_identifier = parse_catalog_name(path, kind)
+        file_hash, row_count = scan_file(path)
+        first_time, last_time = time_bounds(path, date_format)
+        connection.execute(
+            "INSERT INTO files (path, kind, file_name, site_code, file_number, file_identifier, size, mtime, hash,"
+            " row_count, first_time, last_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(path) DO UPDATE SET kind=excluded.kind, file_name=excluded.file_name,"
+            " site_code=excluded.site_code, file_number=excluded.file_number, file_identifier=excluded.file_identifier,"
+            " size=excluded.size, mtime=excluded.mtime, hash=excluded.hash, row_count=excluded.row_count,"
+            " first_time=excluded.first_time, last_time=excluded.last_time",
+            (path, kind, os.path.splitext(os.path.basename(path))[0], site_code, file_number, file_identifier,
+             stat.st_size, stat.st_mtime_ns, file_hash, row_count, first_time, last_time))
+        updated += 1
+    connection.commit()
+    return updated
+
+
+def match_deployments(connection, deployment_data, file_names):
+    """Store the deployment log row of the raw files in file_names in the catalog (NULL for files not in the log).
+
+    deployment_data is the table from hobo_qc.deployment_table. Only the catalog is changed, no files are read.
+    """
+    rows = []
+    for file_name in file_names:
+        if file_name in deployment_data.index:
+            row = deployment_data.loc[file_name]
+            window = [None if pd.isna(row[column]) else pd.Timestamp(row[column]).strftime(TIME_FORMAT)
+                      for column in ['Date In Time In', 'Date Out Time Out']]
+            rows.append((*window, json.dumps({column: str(value) for column, value in row.items()}), file_name))
+        else:
+            rows.append((None, None, None, file_name))
+    connection.executemany("UPDATE files SET date_in_time_in = ?, date_out_time_out = ?, deployment_row = ?"
+                           " WHERE kind = 'raw' AND file_name = ?", rows)
+    connection.commit()
+
+
+def remove_missing(connection):
+    """Remove the catalog rows of files that no longer exist and return their paths."""
+    missing = [path for (path,) in connection.execute("SELECT path FROM files") if not os.path.exists(path)]
+    connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in missing])
+    connection.commit()
+    return missing
+
+
+#%% Questions
+def query(connection, sql, parameters=()):
+    """Run a SELECT on the catalog and return the result as a DataFrame."""
+    return pd.read_sql_query(sql, connection, params=parameters)
+
+
+def files_covering(connection, site_code, start, end, kind='raw'):
+    """Return the files of a site with readings between start and end.
+
+    e.g. files_covering(connection, 'TCSR41', '2023-01-01', '2024-01-01') for the files that cover 2023.
+    """
+    return query(connection, "SELECT * FROM files WHERE kind = ? AND site_code = ? AND first_time < ? AND last_time >= ?"
+                             " ORDER BY first_time", (kind, site_code, str(pd.Timestamp(end)), str(pd.Timestamp(start))))
+
+
+def unmatched_files(connection):
+    """Return the raw files that are not in the deployment log."""
+    return query(connection, "SELECT * FROM files WHERE kind = 'raw' AND deployment_row IS NULL ORDER BY file_name")
@@ -0,0 +1,735 @@
+#%% HOBO file input/output helpers
+# These functions are used by QAQC_V1.7.3.py to read the HOBO logger .csv files.
+# They live in their own file so that they can be imported by worker processes
+# (a process pool cannot run functions that were only defined inside a notebook cell).
+
+#%% Imports
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+#%% Column names and formats used by the HOBO files
+DATE_COLUMN = 'Date Time, GMT-04:00'
+TEMP_COLUMN = 'Temp, °C'
+DATE_FORMAT = '%m/%d/%y %H:%M:%S'
+EXPORT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'  # how pandas writes the datetime column to the exported .csv files
+
+# Warnings go to the 'hobo' logger (see hobo_log.py)
+log = logging.getLogger('hobo')
+
+# The only columns the SOP keeps, and the compact types they are read as when compact=True.
+# The coupler/host/stopped event columns are never read.
+SOP_COLUMNS = ['#', DATE_COLUMN, TEMP_COLUMN]
+COMPACT_DTYPES = {'#': 'int32', TEMP_COLUMN: 'float32'}
+
+# float32 keeps about 7 significant digits, so a 32 bit temperature is rounded back to 4 decimals
+# when it is turned into a 64 bit one: the HOBO files have 3 and the a/b averages have at most 4.
+TEMP_DECIMALS = 4
+
+
+#%% File name parsing
+def parse_file_name(csv_file):
+    """Split a HOBO file path into site code, file number, file identifier and base file name.
+
+    e.g. 'BT_TCCB08_2210_a.csv' -> ('TCCB08', '2210', 'a', 'BT_TCCB08_2210_a')
+    If the file name does not end in a letter it is assigned as 'a'.
+    """
+    file_name = os.path.basename(csv_file).split('.')[0]  # Remove the file extension
+    parts = file_name.split('_')
+    site_code = parts[1]  # Extract the site code
+    file_number = parts[2]  # Extract the file number
+    file_identifier = parts[-1] if len(parts) > 3 and parts[-1] != '' else "a"  # Assign 'a' if not present
+
+    # Extract the base file name without the extension
+    base_file_name = os.path.splitext(os.path.basename(csv_file))[0]
+    return site_code, file_number, file_identifier, base_file_name
+
+
+#%% Reading the files
+def csv_read_options(engine=None, compact=False):
+    """Return the pd.read_csv options for reading a HOBO file.
+
+    compact=True only reads the '#', date and temperature columns, with '#' as int32 and the
+    temperature as float32.
+    """
+    read_options = {}
+    if engine is not None:
+        read_options['engine'] = engine
+    if compact:
+        read_options['usecols'] = SOP_COLUMNS
+        read_options['dtype'] = COMPACT_DTYPES
+    return read_options
+
+
+def temps_as_float64(temps, decimals=TEMP_DECIMALS):
+    """Return temperatures as float64. 32 bit temperatures are rounded back to the decimals they had before."""
+    temps = np.asarray(temps)
+    if temps.dtype == np.float32:
+        return np.round(temps.astype(np.float64), decimals)
+    return temps.astype(np.float64)
+
+
+def read_logger_csv(csv_file, engine=None, cache_dir=None, compact=False):
+    """Read one HOBO .csv file into a DataFrame with 'Date Time, GMT-04:00' converted to datetime.
+
+    The date column is converted once here with the fixed HOBO format (no format guessing),
+    so the rest of the script never has to convert it again.
+    engine can be None (default pandas parser) or 'pyarrow' (faster, needs pyarrow installed).
+    compact=True only reads the SOP columns, in compact types (see csv_read_options).
+    If cache_dir is given the file is loaded through the parquet cache (see read_logger_csv_cached).
+    """
+    if cache_dir is not None:
+        return read_logger_csv_cached(csv_file, cache_dir, engine, compact=compact)
+    df = pd.read_csv(csv_file, **csv_read_options(engine, compact))
+    return parse_date_column(df)
+
+
+def read_exported_csv(csv_file):
+    """Read a .csv file exported by the script with 'Date Time, GMT-04:00' converted to datetime."""
+    df = pd.read_csv(csv_file)
+    return parse_date_column(df, EXPORT_DATE_FORMAT)
+
+
+def read_logger_files(csv_files, mode='serial', engine=None, workers=None, cache_dir=None, compact=False):
+    """Read a list of HOBO .csv files and return the DataFrames in the same order as csv_files.
+
+    mode:
+        'serial'  - read the files one at a time (the original behaviour)
+        'thread'  - read the files in a thread pool
+        'process' - read the files in a process pool (uses every CPU core)
+    workers is the number of threads/processes to use, None lets python pick.
+    cache_dir is an optional folder for the parquet cache of parsed files. If pyarrow is not
+    installed the cache can't be used, a warning is logged and the files are read without it.
+    compact=True only reads the SOP columns, in compact types (see csv_read_options).
+    """
+    if cache_dir is not None and not parquet_available():
+        log.warning("Warning: pyarrow is not installed, so the parquet cache is not used (install pyarrow or set cache_dir to None)")
+        cache_dir = None
+    if mode == 'serial':
+        return [read_logger_csv(csv_file, engine, cache_dir, compact) for csv_file in csv_files]
+
+    if mode == 'thread':
+        executor_class = ThreadPoolExecutor
+    elif mode == 'process':
+        executor_class = ProcessPoolExecutor
+    else:
+        raise ValueError(f"Unknown ingest mode '{mode}', use 'serial', 'thread' or 'process'")
+
+    # executor.map returns the results in the order the files were given,
+    # so df_files is filled in exactly the same order as the serial loop
+    with executor_class(max_workers=workers) as executor:
+        count = len(csv_files)
+        return list(executor.map(read_logger_csv, csv_files, [engine] * count, [cache_dir] * count, [compact] * count))
+
+
+def memory_savings(csv_files, dataframes, sample_rows=1000):
+    """Compare the memory used by the loaded DataFrames with what a plain pd.read_csv would have used.
+
+    The plain read is measured on the first sample_rows rows of each file and scaled up to the
+    number of rows loaded. Returns (plain_bytes, loaded_bytes).
+    """
+    plain_bytes = 0
+    loaded_bytes = 0
+    for csv_file, df in zip(csv_files, dataframes):
+        if df is None:
+            continue
+        sample = pd.read_csv(csv_file, nrows=sample_rows)
+        if len(sample):
+            plain_bytes += sample.memory_usage(deep=True, index=False).sum() / len(sample) * len(df)
+        loaded_bytes += df.memory_usage(deep=True, index=False).sum()
+    return int(plain_bytes), int(loaded_bytes)
+
+
+#%% First and last readings without reading the whole file
+# Naming, the deployment window checks and the file catalog only need the time of the first and
+# last reading of a file. Instead of parsing every line, the header and the first reading are read
+# from the start of the file and the last reading is found by reading small blocks backwards from
+# the end, so the time span of a file takes about the same time whatever its length.
+
+def first_and_last_lines(csv_file, block_size=4096):
+    """Return (header, first line, last line) of a text file, reading only its start and end.
+
+    Empty and whitespace-only lines are skipped. first line and last line are None if the file has no
+    lines after the header.
+    """
+    with open(csv_file, 'rb') as f:
+        head = f.readline()
+        first = f.readline()
+        while first and not first.strip():
+            first = f.readline()
+        if not first.strip():
+            return head.decode('utf-8-sig'), None, None
+
+        # Read blocks backwards until the last block holds a complete non-empty line
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        tail = b''
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+            # Trailing line breaks and whitespace-only lines are dropped before taking the last line
+            lines = tail.rstrip().split(b'\n')
+            if len(lines) > 1 or position == 0:
+                break
+        last = lines[-1]
+    return head.decode('utf-8-sig'), first.decode('utf-8').rstrip('\r\n'), last.decode('utf-8').rstrip('\r\n')
+
+
+def file_time_span(csv_file, date_format=DATE_FORMAT):
+    """Return the (first, last) reading times of a HOBO or exported .csv file as Timestamps.
+
+    Only the header, the first reading and the last reading are read (see first_and_last_lines).
+    Use date_format=EXPORT_DATE_FORMAT for the exported files. A time that is missing or can't be
+    read is returned as None, e.g. for a file without readings.
+    """
+    header, first, last = first_and_last_lines(csv_file)
+    date_index = next(csv.reader([header])).index(DATE_COLUMN)
+    span = []
+    for line in (first, last):
+        fields = next(csv.reader([line])) if line is not None else []
+        try:
+            # strptime on one value is much faster than pd.to_datetime
+            span.append(pd.Timestamp(datetime.strptime(fields[date_index], date_format)))
+        except (IndexError, ValueError):
+            span.append(None)
+    return tuple(span)
+
+
+#%% Streaming trim for very large files
+# For long high-frequency deployments, reading the whole file before trimming wastes memory on the
+# air readings from before deployment and after recovery. These functions read the file in chunks,
+# keep only the readings inside the deployment window while reading, and drop the first `head` and
+# last `tail` readings of the window (the same as df.iloc[4:-5]) by holding back only the last
+# `tail` readings. Reading stops at the first chunk that goes past the end of the window.
+
+def iter_trimmed_chunks(csv_file, start, end, head=4, tail=5, chunksize=100_000, compact=False):
+    """Yield the trimmed readings of a HOBO .csv file one chunk at a time.
+
+    start and end are the Date In Time In and Date Out Time Out of the file (compared on the time
+    shown, see wall_clock). The readings are
+    assumed to be in time order (as the HOBO files are). The default pandas parser is always used
+    because the pyarrow parser can't read in chunks.
+    """
+    start, end = wall_clock(pd.Timestamp(start)), wall_clock(pd.Timestamp(end))
+    read_options = csv_read_options(compact=compact)
+    read_options['chunksize'] = chunksize
+
+    skipped = 0
+    pending = None  # the last `tail` readings seen so far, held back until more readings come
+    with pd.read_csv(csv_file, **read_options) as reader:
+        for chunk in reader:
+            parse_date_column(chunk)
+            times = chunk[DATE_COLUMN]
+            window = chunk[(times >= start) & (times <= end)]
+
+            # Drop the first `head` readings of the deployment window
+            if skipped < head:
+                drop = min(head - skipped, len(window))
+                window = window.iloc[drop:]
+                skipped += drop
+
+            if pending is not None and len(pending):
+                window = pd.concat([pending, window])
+            # Everything except the last `tail` readings is final
+            keep = max(len(window) - tail, 0)
+            if keep:
+                yield window.iloc[:keep]
+            pending = window.iloc[keep:]
+
+            # The file is in time order, so nothing after this chunk is inside the window
+            if len(times) and times.iloc[-1] > end:
+                break
+
+
+def read_trimmed_csv(csv_file, start, end, head=4, tail=5, chunksize=100_000, compact=False):
+    """Read a HOBO .csv file already trimmed to [start, end] and by head/tail readings (see iter_trimmed_chunks)."""
+    chunks = list(iter_trimmed_chunks(csv_file, start, end, head, tail, chunksize, compact))
+    if chunks:
+        return pd.concat(chunks)
+    return empty_logger_frame(csv_file, compact)
+
+
+def empty_logger_frame(csv_file, compact=False):
+    """Return an empty DataFrame with the columns of a HOBO .csv file (only the header line is read)."""
+    df = pd.read_csv(csv_file, nrows=0, **csv_read_options(compact=compact))
+    return df.astype({DATE_COLUMN: 'datetime64[ns]'})
+
+
+def stream_trim_files(df_files, csv_files, deployment_data, head=4, tail=5, chunksize=100_000, compact=False):
+    """Read every file in df_files with the streaming trim and put the trimmed DataFrames in df_files.
+
+    deployment_data is the table from hobo_qc.deployment_table. Files without a deployment window
+    get an empty DataFrame and their names are returned.
+    """
+    file_paths = {os.path.splitext(os.path.basename(csv_file))[0]: csv_file for csv_file in csv_files}
+    missing = []
+    for site_data in df_files.values():
+        for file_data in site_data.values():
+            for file_info in file_data.values():
+                file_name = file_info['File Name']
+                if file_name not in file_paths:
+                    continue
+                window = None
+                if file_name in deployment_data.index:
+                    window = deployment_data.loc[file_name, ['Date In Time In', 'Date Out Time Out']]
+                if window is None or window.isna().any():
+                    missing.append(file_name)
+                    file_info['DataFrame'] = empty_logger_frame(file_paths[file_name], compact)
+                    continue
+                file_info['DataFrame'] = read_trimmed_csv(file_paths[file_name], window['Date In Time In'],
+                                                          window['Date Out Time Out'], head, tail, chunksize, compact)
+    return missing
+
+
+#%% Parquet cache of parsed files
+# Every rerun of the script used to start again with pd.read_csv on every raw offload.
+# The cache keeps a parquet copy of each parsed file (with the date column already converted
+# to datetime) next to a small .json file that records the path, size, modified time and
+# content hash of the raw .csv it was made from. If the raw file has not changed the
+# parquet copy is loaded instead of parsing the .csv again.
+
+def file_hash(file_path, chunk_size=1024 * 1024):
+    """Return the sha1 hash of a file's contents."""
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def file_fingerprint(file_path, with_hash=True):
+    """Return the path, size, modified time and (optionally) hash of a file as a dictionary."""
+    stat = os.stat(file_path)
+    fingerprint = {'path': os.path.abspath(file_path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if with_hash:
+        fingerprint['hash'] = file_hash(file_path)
+    return fingerprint
+
+
+def cache_paths(csv_file, cache_dir, compact=False):
+    """Return the (parquet, json) paths of the cache entry for a raw .csv file."""
+    # The entry is named after the full path so files with the same name in different folders don't clash
+    key = hashlib.sha1(os.path.abspath(csv_file).encode('utf-8')).hexdigest()
+    base_name = os.path.splitext(os.path.basename(csv_file))[0]
+    entry = os.path.join(cache_dir, f"{base_name}_{key[:12]}" + ('_compact' if compact else ''))
+    return entry + '.parquet', entry + '.json'
+
+
+def parse_date_column(df, date_format=DATE_FORMAT):
+    """Convert the date column of a HOBO DataFrame to datetime in place, using a fixed format.
+
+    If the column doesn't match the format it is left as it is so nothing is lost.
+    """
+    if DATE_COLUMN in df.columns and not pd.api.types.is_datetime64_any_dtype(df[DATE_COLUMN]):
+        try:
+            df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN], format=date_format)
+        except (ValueError, TypeError):
+            log.warning(f"Warning: '{DATE_COLUMN}' does not match the format {date_format}, it was left unconverted.")
+    return df
+
+
+def wall_clock(times):
+    """Return deployment times as naive values of the time shown, so they can be compared with the logger times.
+
+    The notebook's 'Combine Date and Time' cell parses strings like '2022-10-01 1900-01-01 11:26:00',
+    which pandas reads as 11:26 in UTC-01:00. Converting those to datetime64 would move them to UTC
+    (an hour later), so the time zone is dropped instead and 11:26 stays 11:26. Takes a Timestamp
+    (returned as a Timestamp) or a column (returned as a datetime64[ns] array).
+    """
+    if isinstance(times, pd.Timestamp):
+        return times.tz_localize(None) if times.tzinfo is not None else times
+    times = pd.Series(times)
+    if isinstance(times.dtype, pd.DatetimeTZDtype):
+        times = times.dt.tz_localize(None)
+    return times.to_numpy(dtype='datetime64[ns]')
+
+
+def parquet_available():
+    """Return True if pyarrow (needed to read and write parquet files) is installed."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def read_cache_entry(csv_file, cache_dir, verify_hash=False, compact=False):
+    """Return the cached DataFrame for csv_file, or None if there is no up to date entry."""
+    parquet_path, json_path = cache_paths(csv_file, cache_dir, compact)
+    if not (os.path.exists(parquet_path) and os.path.exists(json_path)):
+        return None
+
+    with open(json_path) as f:
+        cached = json.load(f)
+    current = file_fingerprint(csv_file, with_hash=False)
+
+    # Same size and modified time: the file hasn't been touched
+    unchanged = current['size'] == cached['size'] and current['mtime'] == cached['mtime']
+    if unchanged and not verify_hash:
+        return pd.read_parquet(parquet_path)
+
+    # Otherwise compare the contents, a file that was only copied or touched can still use the cache
+    if current['size'] == cached['size'] and file_hash(csv_file) == cached['hash']:
+        if not unchanged:
+            cached['mtime'] = current['mtime']
+            with open(json_path, 'w') as f:
+                json.dump(cached, f)
+        return pd.read_parquet(parquet_path)
+    return None
+
+
+def write_cache_entry(csv_file, cache_dir, df, compact=False):
+    """Save a parsed DataFrame to the cache along with the fingerprint of its raw .csv file."""
+    os.makedirs(cache_dir, exist_ok=True)
+    parquet_path, json_path = cache_paths(csv_file, cache_dir, compact)
+    # The old .json file is removed first and the new one written last, so a half written entry is never used
+    if os.path.exists(json_path):
+        os.remove(json_path)
+    df.to_parquet(parquet_path, index=False)
+    with open(json_path, 'w') as f:
+        json.dump(file_fingerprint(csv_file), f)
+
+
+def read_logger_csv_cached(csv_file, cache_dir, engine=None, verify_hash=False, compact=False):
+    """Read a HOBO .csv file through the parquet cache.
+
+    Unchanged files are loaded from the parquet copy, new or changed files are parsed
+    from the .csv and the cache entry is (re)written. The date column is always returned as datetime.
+    Compact and full reads of the same file are cached separately.
+    """
+    df = read_cache_entry(csv_file, cache_dir, verify_hash, compact)
+    if df is None:
+        df = read_logger_csv(csv_file, engine, compact=compact)
+        write_cache_entry(csv_file, cache_dir, df, compact)
+    return df
+
+
+def evict_stale_cache(cache_dir):
+    """Remove cache entries whose raw .csv file has been changed or no longer exists.
+
+    Returns the list of raw file paths that were evicted.
+    """
+    evicted = []
+    if not os.path.isdir(cache_dir):
+        return evicted
+
+    for json_name in os.listdir(cache_dir):
+        if not json_name.endswith('.json'):
+            continue
+        json_path = os.path.join(cache_dir, json_name)
+        with open(json_path) as f:
+            cached = json.load(f)
+
+        source = cached['path']
+        if os.path.exists(source):
+            current = file_fingerprint(source, with_hash=False)
+            if current['size'] == cached['size'] and current['mtime'] == cached['mtime']:
+                continue  # still up to date
+
+        # Remove both the parquet copy and its .json file
+        os.remove(json_path)
+        parquet_path = json_path[:-len('.json')] + '.parquet'
+        if os.path.exists(parquet_path):
+            os.remove(parquet_path)
+        evicted.append(source)
+    return evicted
+
+
+#%% Build the nested dictionary
+def add_to_df_files(df_files, site_code, file_number, file_identifier, entry):
+    """Add one entry to df_files[site_code][file_number][file_identifier].
+
+    If the identifier is already there a warning is printed and the new entry is ignored.
+    Returns True if the entry was added.
+    """
+    # Create the site code and file number levels if they don't exist yet
+    file_data = df_files.setdefault(site_code, {}).setdefault(file_number, {})
+
+    # Check if the file identifier already exists
+    if file_identifier in file_data:
+        log.warning(f"Warning: Duplicate file identifier {file_identifier} for site code {site_code} and file number {file_number}. Ignoring.")
+        return False
+
+    file_data[file_identifier] = entry
+    return True
+
+
+def build_df_files(csv_files, dataframes):
+    """Build the nested df_files dictionary from the file paths and their DataFrames.
+
+    df_files[site_code][file_number][file_identifier] = {'DataFrame': df, 'File Name': base_file_name}
+    """
+    df_files = {}
+    for csv_file, df in zip(csv_files, dataframes):
+        site_code, file_number, file_identifier, base_file_name = parse_file_name(csv_file)
+        add_to_df_files(df_files, site_code, file_number, file_identifier,
+                        {'DataFrame': df, 'File Name': base_file_name})
+    return df_files
+
+
+#%% Incremental processing manifest
+# Each season only a handful of new offloads are added to the working folder. The manifest is a
+# .json file that remembers, for every (site code, file number) group that was exported, the
+# fingerprints of its raw files and deployment log rows and the output files it produced.
+# On the next run only the groups that are new or whose files/deployment rows changed are processed.
+
+def load_manifest(manifest_path):
+    """Load the manifest from disk, or return an empty one if it doesn't exist yet."""
+    if manifest_path is not None and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {'groups': {}}
+
+
+def save_manifest(manifest, manifest_path):
+    """Write the manifest to disk (through a temporary file so it is never left half written)."""
+    folder = os.path.dirname(manifest_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temp_path, manifest_path)
+
+
+def group_key(site_code, file_number):
+    """Return the manifest key of a (site code, file number) group, e.g. 'TCSR41_2210'."""
+    return f"{site_code}_{file_number}"
+
+
+def reuse_or_hash(file_path, previous):
+    """Return the fingerprint of a file, reusing the previous hash if size and modified time are unchanged."""
+    current = file_fingerprint(file_path, with_hash=False)
+    if previous and previous.get('size') == current['size'] and previous.get('mtime') == current['mtime']:
+        current['hash'] = previous['hash']
+    else:
+        current['hash'] = file_hash(file_path)
+    return current
+
+
+def deployment_row_hash(deployment_df, file_name):
+    """Return a hash of the deployment log row(s) for an offloaded file name."""
+    rows = deployment_df[deployment_df['Offloaded Filename'] == file_name]
+    return hashlib.sha1(rows.astype(str).to_csv(index=False).encode('utf-8')).hexdigest()
+
+
+def group_fingerprints(df_files, csv_files, deployment_df, manifest):
+    """Fingerprint the raw files and deployment log rows of every (site code, file number) group in df_files."""
+    # Match each base file name back to its raw .csv path
+    file_paths = {os.path.splitext(os.path.basename(csv_file))[0]: csv_file for csv_file in csv_files}
+
+    fingerprints = {}
+    for site_code, site_data in df_files.items():
+        for file_number, file_data in site_data.items():
+            key = group_key(site_code, file_number)
+            previous_files = manifest['groups'].get(key, {}).get('files', {})
+            files = {}
+            deployment = {}
+            for file_identifier, file_info in file_data.items():
+                file_name = file_info['File Name']
+                if file_name not in file_paths:
+                    continue  # e.g. the 'merged' entries made later in the script
+                files[file_name] = reuse_or_hash(file_paths[file_name], previous_files.get(file_name))
+                deployment[file_name] = deployment_row_hash(deployment_df, file_name)
+            fingerprints[key] = {'files': files, 'deployment': deployment}
+    return fingerprints
+
+
+def group_changed(manifest, key, fingerprint):
+    """Return True if a group is new or its raw file hashes or deployment rows differ from the manifest."""
+    previous = manifest['groups'].get(key)
+    if previous is None:
+        return True
+    previous_hashes = {name: info['hash'] for name, info in previous['files'].items()}
+    current_hashes = {name: info['hash'] for name, info in fingerprint['files'].items()}
+    return previous_hashes != current_hashes or previous['deployment'] != fingerprint['deployment']
+
+
+def select_changed_groups(df_files, fingerprints, manifest):
+    """Return a copy of df_files that only holds the new or changed (site code, file number) groups."""
+    selected = {}
+    for site_code, site_data in df_files.items():
+        for file_number, file_data in site_data.items():
+            if group_changed(manifest, group_key(site_code, file_number), fingerprints[group_key(site_code, file_number)]):
+                selected.setdefault(site_code, {})[file_number] = file_data
+    return selected
+
+
+def record_group(manifest, site_code, file_number, fingerprint, outputs, archive_files=None):
+    """Record a processed group and its output files in the manifest.
+
+    Output files the group produced on an earlier run that were not produced again (e.g. because the
+    trimmed dates in the file name changed) are deleted, and their paths are returned.
+    The parquet archive files of the group (site_code=/year= partition files) are recorded apart from
+    the other outputs. They are only replaced when archive_files is given, so a run with the archive
+    turned off leaves the archive alone, while a run that writes it again deletes the old partition
+    files (e.g. a year that is no longer in the trimmed file).
+    """
+    key = group_key(site_code, file_number)
+    previous = manifest['groups'].get(key, {})
+    outputs = sorted(set(outputs))
+    archive_files = previous.get('archive', []) if archive_files is None else sorted(set(archive_files))
+    kept = set(outputs) | set(archive_files)
+
+    removed = []
+    for old_output in previous.get('outputs', []) + previous.get('archive', []):
+        if old_output not in kept and os.path.exists(old_output):
+            os.remove(old_output)
+            removed.append(old_output)
+
+    manifest['groups'][key] = {'files': fingerprint['files'], 'deployment': fingerprint['deployment'],
+                               'outputs': outputs, 'archive': archive_files}
+    return removed
+
+
+#%% Writing the exported files
+# The exported files are written to a temporary file next to the final one, which is renamed when it
+# is complete, so a file with the final name is never half written (e.g. when the network share drops
+# out). The temporary name starts with a '.' so the parquet archive and the glob of the .csv files
+# never pick it up.
+#
+# The export loops can also queue the files on a few writer threads (start_export_writer/queue_export)
+# so the next site is processed while the previous files are still being written to a slow share.
+
+@contextmanager
+def atomic_output(output_path):
+    """Yield a temporary path to write to, renamed to output_path if the write finishes and removed if it fails."""
+    folder, file_name = os.path.split(output_path)
+    temp_path = os.path.join(folder, f".{file_name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        yield temp_path
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def write_csv_pyarrow(df, output_path):
+    """Write df to a .csv file with the pyarrow writer, in the same format as df.to_csv(index=False).
+
+    Dates are written as '%Y-%m-%d %H:%M:%S' (pyarrow would add microseconds) and True/False columns
+    as True/False (pyarrow would write true/false), so the file reads back the same either way.
+    pyarrow quotes every text value, so the header is written the pandas way first, and the values
+    are only quoted if df has text columns of its own. The one difference left is that whole numbers
+    in float columns are written without '.0' (29 instead of 29.0), which reads back the same.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    has_text = any(pa.types.is_string(field.type) or pa.types.is_large_string(field.type) for field in table.schema)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            seconds = pc.cast(table.column(i), pa.timestamp('s'), safe=False)
+            table = table.set_column(i, field.name, pc.strftime(seconds, format=EXPORT_DATE_FORMAT))
+        elif pa.types.is_boolean(field.type):
+            table = table.set_column(i, field.name, pc.if_else(table.column(i), 'True', 'False'))
+
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f, lineterminator='\n').writerow(df.columns)
+    with pa.OSFile(output_path, 'ab') as f:
+        pa_csv.write_csv(table, f, pa_csv.WriteOptions(include_header=False,
+                                                      quoting_style='needed' if has_text else 'none'))
+
+
+def write_csv_atomic(df, output_path, engine=None):
+    """Write df without its index to output_path through a temporary file (see atomic_output) and return the path.
+
+    engine can be None (pandas to_csv) or 'pyarrow' (faster, needs pyarrow installed, see write_csv_pyarrow).
+    """
+    with atomic_output(output_path) as temp_path:
+        if engine == 'pyarrow':
+            write_csv_pyarrow(df, temp_path)
+        else:
+            df.to_csv(temp_path, index=False)
+    return output_path
+
+
+def start_export_writer(workers=4):
+    """Return a thread pool to queue exports on with queue_export. workers=0 returns None (write straight away)."""
+    return ThreadPoolExecutor(max_workers=workers) if workers else None
+
+
+def queue_export(writer, function, *args, **kwargs):
+    """Run function(*args, **kwargs) on the export writer threads and return its Future.
+
+    e.g. queue_export(writer, write_csv_atomic, df_a, output_file_path, engine)
+    With writer=None the function runs straight away. The DataFrame must not be changed after it is
+    queued, because it is written while the loop goes on.
+    """
+    if writer is not None:
+        return writer.submit(function, *args, **kwargs)
+    future = Future()
+    try:
+        future.set_result(function(*args, **kwargs))
+    except Exception as error:
+        future.set_exception(error)
+    return future
+
+
+def finish_exports(futures):
+    """Wait for every queued export and return their results in order.
+
+    Every write is waited for before the first error (if any) is raised, so no write is left running.
+    """
+    wait(futures)
+    return [future.result() for future in futures]
+
+
+#%% Parquet archive of the QC'd data
+# Besides the BT_{site}_{yymm}_{yymm}.csv files, the cleaned data of every deployment can be added to
+# a parquet dataset that is split into folders by site code and year:
+#   archive_dir/site_code=TCSR41/year=2023/BT_TCSR41_2210_2311.parquet
+# A query for a few sites or years then only reads those folders instead of every exported .csv.
+
+def write_archive(df, archive_dir, site_code, file_number, base_file_name, calculations=False, compression='zstd'):
+    """Add the '#', date and temperature columns of one exported deployment to the parquet archive.
+
+    The rows are split by year, and each year is written to its own site code/year folder under the
+    deployment's base file name, so rerunning the same deployment replaces its files instead of
+    adding them twice. The calculations flag and file number are stored as columns.
+    Returns the list of parquet files written.
+    """
+    archive_df = pd.DataFrame({
+        '#': df['#'].to_numpy(),
+        DATE_COLUMN: df[DATE_COLUMN].to_numpy(),
+        TEMP_COLUMN: df[TEMP_COLUMN].to_numpy(),
+        'file_number': file_number,
+        'calculations': bool(calculations),
+    })
+    years = archive_df[DATE_COLUMN].dt.year
+
+    written = []
+    for year, year_df in archive_df.groupby(years):
+        partition = os.path.join(archive_dir, f"site_code={site_code}", f"year={year}")
+        os.makedirs(partition, exist_ok=True)
+        part_path = os.path.join(partition, f"{base_file_name}.parquet")
+        with atomic_output(part_path) as temp_path:
+            year_df.to_parquet(temp_path, index=False, compression=compression)
+        written.append(part_path)
+    return written
+
+
+def read_archive(archive_dir, site_codes=None, years=None):
+    """Read the parquet archive, only opening the site code and year folders that are asked for.
+
+    e.g. read_archive(archive_dir, site_codes=['TCSR41'], years=[2022, 2023])
+    """
+    filters = []
+    if site_codes is not None:
+        filters.append(('site_code', 'in', list(site_codes)))
+    if years is not None:
+        filters.append(('year', 'in', [int(year) for year in years]))
+    return pd.read_parquet(archive_dir, filters=filters or None)
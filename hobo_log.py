@@ -0,0 +1,159 @@
+#%% Run output
+# Controls how much the script prints. Messages go to the 'hobo' logger:
+#   debug   - a line for every file (file saved, start and end times, ...)
+#   info    - summaries (counts, first and last timestamps, flagged counts)
+#   warning - things that need to be fixed or checked
+# With quiet=False (the default) every message is shown, whole DataFrames are printed and the plots
+# are shown, the same as before. With quiet=True (headless runs) only the info and warning messages
+# are shown, every DataFrame is replaced by a one line summary and plots are closed without being
+# shown. Whole DataFrames are then only written to dump_dir, if one is given.
+
+#%% Imports
+import logging
+import os
+import sys
+
+import pandas as pd
+
+from hobo_io import DATE_COLUMN
+
+log = logging.getLogger('hobo')
+
+QUIET = False
+DUMP_DIR = None
+
+
+#%% Setup
+def setup(quiet=False, dump_dir=None, log_file=None):
+    """Set up the 'hobo' logger and the quiet mode, and return the logger.
+
+    Messages are printed without a prefix so they look like the old print() output. If log_file
+    is given every message (debug included) is also added to that file with its time and level.
+    Can be called again to change the settings.
+    """
+    global QUIET, DUMP_DIR
+    QUIET = quiet
+    DUMP_DIR = dump_dir
+
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+        handler.close()
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(logging.INFO if quiet else logging.DEBUG)
+    console.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(console)
+    if log_file is not None:
+        folder = os.path.dirname(log_file)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        to_file = logging.FileHandler(log_file)
+        to_file.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        log.addHandler(to_file)
+    return log
+
+
+#%% Summaries
+def time_range(times):
+    """Return 'first to last' for a datetime column, or '' if it is empty."""
+    if len(times) == 0:
+        return ''
+    return f"{times.iloc[0]} to {times.iloc[-1]}"
+
+
+def summarize_frame(df):
+    """Return a one line summary of a DataFrame: its size, first and last time and the flagged count."""
+    parts = [f"{len(df)} rows x {len(df.columns)} columns"]
+    if DATE_COLUMN in df.columns and len(df):
+        parts.append(time_range(df[DATE_COLUMN]))
+    if 'Flag' in df.columns:
+        parts.append(f"{int(df['Flag'].sum())} flagged")
+    return ', '.join(parts)
+
+
+def is_df_files(obj):
+    """Return True if obj is a nested df_files dictionary (site code -> file number -> identifier -> file info)."""
+    if not isinstance(obj, dict) or not obj:
+        return False
+    try:
+        return all('DataFrame' in file_info for site_data in obj.values()
+                   for file_data in site_data.values() for file_info in file_data.values())
+    except (AttributeError, TypeError):
+        return False
+
+
+def summarize_df_files(df_files):
+    """Return a one line summary of df_files: the number of sites, files and readings and the overall time range.
+
+    Files that are not read yet (None, e.g. with stream_trim) count as files without readings.
+    """
+    entries = [file_info['DataFrame'] for site_data in df_files.values()
+               for file_data in site_data.values() for file_info in file_data.values()]
+    frames = [df for df in entries if df is not None]
+    summary = f"{len(df_files)} site codes, {len(entries)} files, {sum(len(df) for df in frames)} readings"
+    times = [df[DATE_COLUMN] for df in frames if DATE_COLUMN in df.columns and len(df)]
+    if times:
+        summary += f", {min(t.min() for t in times)} to {max(t.max() for t in times)}"
+    empty = sum(df.empty for df in frames)
+    if empty:
+        summary += f", {empty} empty"
+    if len(frames) < len(entries):
+        summary += f", {len(entries) - len(frames)} not read yet"
+    return summary
+
+
+def summarize(obj):
+    """Return a one line summary of a DataFrame, a df_files dictionary or a list."""
+    if isinstance(obj, pd.DataFrame):
+        return summarize_frame(obj)
+    if is_df_files(obj):
+        return summarize_df_files(obj)
+    if isinstance(obj, (list, tuple, dict, pd.Series, pd.Index)):
+        return f"{len(obj)} items"
+    return repr(obj)
+
+
+#%% Showing and dumping
+def dump(name, obj, dump_dir):
+    """Write obj in full to dump_dir and return the path written.
+
+    A DataFrame is written as {name}.csv, a df_files dictionary as a {name} folder with a
+    {site code}_{file number}_{identifier}.csv per file, and anything else as {name}.txt.
+    """
+    os.makedirs(dump_dir, exist_ok=True)
+    if isinstance(obj, pd.DataFrame):
+        path = os.path.join(dump_dir, f"{name}.csv")
+        obj.to_csv(path)
+    elif is_df_files(obj):
+        path = os.path.join(dump_dir, name)
+        os.makedirs(path, exist_ok=True)
+        for site_code, site_data in obj.items():
+            for file_number, file_data in site_data.items():
+                for file_identifier, file_info in file_data.items():
+                    file_info['DataFrame'].to_csv(os.path.join(path, f"{site_code}_{file_number}_{file_identifier}.csv"))
+    else:
+        path = os.path.join(dump_dir, f"{name}.txt")
+        with open(path, 'w') as f:
+            f.write(str(obj))
+    return path
+
+
+def show(name, obj):
+    """Print obj in full, or in quiet mode log a one line summary (and write it to DUMP_DIR if set)."""
+    if not QUIET:
+        print(obj)
+        return
+    log.info(f"{name}: {summarize(obj)}")
+    if DUMP_DIR is not None:
+        log.debug(f"{name} written to {dump(name, obj, DUMP_DIR)}")
+
+
+def show_figure():
+    """Show the current matplotlib figure, or in quiet mode close it without showing it."""
+    import matplotlib.pyplot as plt
+    if QUIET:
+        plt.close()
+    else:
+        plt.show()
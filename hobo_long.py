@@ -0,0 +1,98 @@
+#%% Long table of all logger readings
+# Instead of a separate DataFrame for every file in the nested df_files dictionary, the long table
+# holds every reading of every file in one DataFrame, with the site code, file number, file identifier
+# and file name stored as categorical columns. The QC steps can then be done for all files at once
+# with grouped operations instead of a python loop over hundreds of small DataFrames.
+# The a/b consensus and the export stay on df_files (hobo_qc.duplicate_consensus and
+# hobo_io.write_csv_atomic), so there is only one version of the files that are written.
+#
+# Columns of the long table:
+#   site_code, file_number, file_identifier, file_name - categorical
+#   row                   - the index label the reading had in its df_files DataFrame
+#   #                     - the HOBO reading number
+#   Date Time, GMT-04:00  - datetime64
+#   Temp, °C              - float32
+
+#%% Imports
+import numpy as np
+import pandas as pd
+
+from hobo_io import DATE_COLUMN, SOP_COLUMNS, TEMP_COLUMN, TEMP_DECIMALS, add_to_df_files, temps_as_float64, wall_clock
+from hobo_qc import iterate_files
+
+KEY_COLUMNS = ['site_code', 'file_number', 'file_identifier', 'file_name']
+
+
+#%% Converters
+def repeated_categorical(values, lengths):
+    """Return a categorical where values[i] is repeated lengths[i] times (categories keep their first seen order)."""
+    categories = list(dict.fromkeys(values))
+    position = {value: code for code, value in enumerate(categories)}
+    codes = np.array([position[value] for value in values], dtype=np.int32)
+    return pd.Categorical.from_codes(np.repeat(codes, lengths), categories=categories)
+
+
+def to_long(df_files):
+    """Convert the nested df_files dictionary into one long table.
+
+    Only the '#', 'Date Time, GMT-04:00' and 'Temp, °C' columns are kept. Entries that don't have
+    them (e.g. the 'merged' c/d DataFrames) are left out.
+    """
+    keys = []
+    frames = []
+    for site_code, file_number, file_identifier, file_info in iterate_files(df_files):
+        df = file_info['DataFrame']
+        if not all(column in df.columns for column in SOP_COLUMNS):
+            continue
+        keys.append((site_code, file_number, file_identifier, file_info['File Name']))
+        frames.append(df)
+
+    lengths = np.array([len(df) for df in frames], dtype=np.int64)
+    long_df = pd.DataFrame({
+        column: repeated_categorical([key[i] for key in keys], lengths) for i, column in enumerate(KEY_COLUMNS)
+    })
+    if not frames:
+        return long_df.assign(**{'row': [], '#': [], DATE_COLUMN: pd.to_datetime([]), TEMP_COLUMN: np.array([], dtype=np.float32)})
+
+    long_df['row'] = np.concatenate([df.index.to_numpy() for df in frames])
+    long_df['#'] = np.concatenate([df['#'].to_numpy() for df in frames])
+    long_df[DATE_COLUMN] = np.concatenate([df[DATE_COLUMN].to_numpy(dtype='datetime64[ns]') for df in frames])
+    long_df[TEMP_COLUMN] = np.concatenate([df[TEMP_COLUMN].to_numpy(dtype=np.float32) for df in frames])
+    return long_df
+
+
+def from_long(long_df, decimals=TEMP_DECIMALS):
+    """Convert a long table back into the nested df_files dictionary used by the notebook cells."""
+    df_files = {}
+    for file_name, part in long_df.groupby('file_name', observed=True, sort=False):
+        first = part.iloc[0]
+        df = pd.DataFrame({
+            '#': part['#'].to_numpy(),
+            DATE_COLUMN: part[DATE_COLUMN].to_numpy(),
+            TEMP_COLUMN: temps_as_float64(part[TEMP_COLUMN], decimals),
+        }, index=part['row'].to_numpy())
+        add_to_df_files(df_files, first['site_code'], first['file_number'], first['file_identifier'],
+                        {'DataFrame': df, 'File Name': file_name})
+    return df_files
+
+
+#%% Trimming
+def trim_to_deployment(long_df, deployment_data):
+    """Keep the readings that are inside their file's [Date In Time In, Date Out Time Out] window.
+
+    deployment_data is the table from hobo_qc.deployment_table. Files without a window lose all their readings.
+    """
+    windows = deployment_data[['Date In Time In', 'Date Out Time Out']].reindex(long_df['file_name'].cat.categories)
+    codes = long_df['file_name'].cat.codes.to_numpy()
+    starts = wall_clock(windows['Date In Time In'])[codes]
+    ends = wall_clock(windows['Date Out Time Out'])[codes]
+    times = long_df[DATE_COLUMN].to_numpy(dtype='datetime64[ns]')
+    return long_df[(times >= starts) & (times <= ends)]
+
+
+def edge_trim(long_df, start=4, end=5):
+    """Drop the first `start` and last `end` readings of every file (the same as df.iloc[4:-5] on each file)."""
+    groups = long_df.groupby('file_name', observed=True, sort=False)
+    position = groups.cumcount().to_numpy()
+    size = groups['file_name'].transform('size').to_numpy()
+    return long_df[(position >= start) & (position < size - end)]
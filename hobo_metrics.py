@@ -0,0 +1,78 @@
+#%% Step metrics
+# Every processing step (reading, deployment matching, trimming, duplicate comparison, export and
+# plotting) can add one line of JSON to a metrics file, so the speed and the number of readings
+# kept or dropped can be compared between season runs. Each line has:
+#   run          - when the run started (the same for every step of one run or notebook session)
+#   step         - the name of the step (the stage name when run with run_qaqc.py; the notebook
+#                  records the two trim cells as 'trim deployment window' and 'trim edges')
+#   time         - when the step finished
+#   wall_seconds - how long the step took
+#   peak_rss_mb  - the most memory the python process has used so far (None if it can't be measured)
+# plus the counts of the step, e.g. files, rows_in, rows_out, rows_dropped_deployment, rows_dropped_edge.
+#
+# The file can be read back with pd.read_json(metrics_path, lines=True).
+
+#%% Imports
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+RUN_ID = datetime.now().isoformat(timespec='seconds')
+
+
+#%% Measurements
+def peak_rss_mb():
+    """Return the peak resident memory of this process in MB, or None if it can't be measured.
+
+    Uses the resource module (Linux and Mac) or psutil if it is installed (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on a Mac and in kilobytes everywhere else
+        return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory_info = psutil.Process().memory_info()
+    return getattr(memory_info, 'peak_wset', memory_info.rss) / 1e6
+
+
+def count_rows(df_files):
+    """Return the total number of readings in the nested df_files dictionary."""
+    return sum(len(file_info['DataFrame'])
+               for site_data in df_files.values() for file_data in site_data.values() for file_info in file_data.values())
+
+
+def count_files(df_files):
+    """Return the number of files in the nested df_files dictionary."""
+    return sum(len(file_data) for site_data in df_files.values() for file_data in site_data.values())
+
+
+#%% Recording
+def start_step():
+    """Return the start time of a step, to pass to record_step when the step is done."""
+    return time.perf_counter()
+
+
+def record_step(metrics_path, step, started, **counts):
+    """Add the metrics of a finished step to the metrics file and return them as a dictionary.
+
+    Nothing is written if metrics_path is None.
+    """
+    record = {'run': RUN_ID, 'step': step, 'time': datetime.now().isoformat(timespec='seconds'),
+              'wall_seconds': round(time.perf_counter() - started, 4), 'peak_rss_mb': peak_rss_mb()}
+    record.update(counts)
+    if metrics_path is not None:
+        folder = os.path.dirname(metrics_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(metrics_path, 'a') as f:
+            f.write(json.dumps(record, default=lambda value: value.item()) + '\n')
+    return record
@@ -0,0 +1,529 @@
+#%% HOBO QAQC pipeline
+# The steps of QAQC_V1.7.3.py as named stages that can be run from the command line (see run_qaqc.py).
+# Every stage takes the results of the stages before it and returns a new result without changing
+# them, so a stage can be rerun on its own without having to rerun everything from the top.
+#
+# Stages, in order (each one uses the results of the stages listed after the arrow):
+#   ingest      - read the .csv files of the working folder into df_files
+#   deployment  - read the deployment log and make the deployment window table
+#   trim        <- ingest, deployment: trim to the deployment window and by head/tail readings, and check
+#                  the sampling intervals of the trimmed files for gaps, duplicate times and drift
+#   duplicates  <- trim: compare and average the 'a'/'b' files, find the calculation files
+#   offset      <- duplicates: align the offset ('c' and 'd') files on one timeline
+#   export      <- offset: write the .csv files (and the parquet archive)
+#   plot        <- export: save a plot of every exported file
+#
+# The result of every stage is saved in the stage cache folder with a key made from the stage
+# settings, the keys of the stages it uses, and (for ingest and deployment) the size and modified
+# time of the files it reads. When the pipeline is rerun, every stage whose key did not change is
+# skipped, so the run starts again at the first stage whose inputs changed.
+#
+# If [paths] metrics_file is set, every stage that runs adds a line of metrics to it (see hobo_metrics.py).
+# If [paths] catalog is set, the ingest, deployment and export stages keep the file catalog up to
+# date (see hobo_catalog.py).
+
+#%% Imports
+import configparser
+import glob
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+
+import hobo_catalog
+import hobo_io
+import hobo_log
+import hobo_long
+import hobo_metrics
+import hobo_plots
+import hobo_qc
+import hobo_rules
+from hobo_io import DATE_COLUMN, SOP_COLUMNS, TEMP_COLUMN
+
+log = hobo_log.log
+
+STAGES = ['ingest', 'deployment', 'trim', 'duplicates', 'offset', 'export', 'plot']
+STAGE_INPUTS = {
+    'ingest': [],
+    'deployment': [],
+    'trim': ['ingest', 'deployment'],
+    'duplicates': ['trim'],
+    'offset': ['duplicates'],
+    'export': ['offset'],
+    'plot': ['export'],
+}
+
+# Settings used when they are not in the config file (see qaqc_config.example.ini)
+DEFAULT_CONFIG = {
+    'ingest': {'mode': 'thread', 'engine': '', 'compact': 'true', 'parse_cache_dir': ''},
+    'trim': {'head': '4', 'tail': '5', 'interval_tolerance': '30s', 'interval_grid': '1min'},
+    'duplicates': {'tolerance': '1min', 'threshold': '0.2', 'consensus': 'mean', 'sweep': ''},
+    'offset': {'tolerance': ''},
+    'export': {'archive': 'false', 'engine': '', 'writers': '4'},
+    'plot': {'mode': 'process', 'decimation': 'minmax', 'max_points': '4000', 'dpi': '100'},
+}
+
+
+#%% Config file
+def default_config(**paths):
+    """Return a ConfigParser with the default settings and the given [paths] options."""
+    config = configparser.ConfigParser()
+    config.read_dict(DEFAULT_CONFIG)
+    config.read_dict({'paths': paths})
+    return config
+
+
+def load_config(config_path):
+    """Read the pipeline config file (an .ini file) into a ConfigParser filled in with the defaults."""
+    config = default_config()
+    with open(config_path) as f:
+        config.read_file(f)
+    for option in ['working_folder', 'deployment_log', 'output_folder', 'stage_cache']:
+        if not config.get('paths', option, fallback=''):
+            raise ValueError(f"{config_path}: [paths] {option} must be set")
+    return config
+
+
+def stage_settings(config, stage):
+    """Return the config settings a stage uses as a dictionary (these are part of the stage key)."""
+    settings = dict(config[stage]) if config.has_section(stage) else {}
+    if stage == 'ingest':
+        # The read mode, parser and parquet cache only change how fast the files are read, not the result
+        settings = {'compact': settings['compact'], 'working_folder': config['paths']['working_folder']}
+    elif stage == 'deployment':
+        settings['deployment_log'] = config['paths']['deployment_log']
+    elif stage in ('export', 'plot'):
+        settings['output_folder'] = config['paths']['output_folder']
+    # The number of writer threads only changes how fast the files are written
+    settings.pop('writers', None)
+    return settings
+
+
+def working_files(config):
+    """Return the .csv files of the working folder, sorted so the runs are repeatable."""
+    return sorted(glob.glob(os.path.join(config['paths']['working_folder'], '*.csv')))
+
+
+#%% Stage keys and the stage cache
+def stage_key(config, stage, input_keys, csv_files):
+    """Return the cache key of a stage: a hash of its settings, the keys of its inputs and the files it reads."""
+    parts = {'stage': stage, 'settings': stage_settings(config, stage), 'inputs': input_keys}
+    if stage == 'ingest':
+        parts['files'] = [hobo_io.file_fingerprint(csv_file, with_hash=False) for csv_file in csv_files]
+    elif stage == 'deployment':
+        # The deployment table also reads the first and last reading times of every .csv file
+        parts['files'] = [hobo_io.file_fingerprint(file_path, with_hash=False)
+                          for file_path in [config['paths']['deployment_log']] + csv_files]
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def stage_paths(stage_cache, stage):
+    """Return the (pickle, json) paths of a stage's cache entry."""
+    entry = os.path.join(stage_cache, stage)
+    return entry + '.pkl', entry + '.json'
+
+
+def cached_key(stage_cache, stage):
+    """Return the key of the cached result of a stage, or None if there is no usable one.
+
+    The result of the export and plot stages is a list of files, so the entry is only usable
+    if those files still exist.
+    """
+    pickle_path, json_path = stage_paths(stage_cache, stage)
+    if not os.path.exists(json_path) or not os.path.exists(pickle_path):
+        return None
+    with open(json_path) as f:
+        entry = json.load(f)
+    if not all(os.path.exists(output) for output in entry.get('outputs', [])):
+        return None
+    return entry['key']
+
+
+def load_stage(stage_cache, stage):
+    """Load the cached result of a stage."""
+    with open(stage_paths(stage_cache, stage)[0], 'rb') as f:
+        return pickle.load(f)
+
+
+def save_stage(stage_cache, stage, key, result, outputs=()):
+    """Save the result of a stage (through temporary files so an entry is never left half written).
+
+    The json with the key is removed first and written last, so a stopped run can't leave an
+    old key next to a new result. Output files of the previous run of the stage that this run
+    did not write again (e.g. a file that is no longer a calculation file) are deleted and returned.
+    """
+    os.makedirs(stage_cache, exist_ok=True)
+    pickle_path, json_path = stage_paths(stage_cache, stage)
+    removed = []
+    if os.path.exists(json_path):
+        with open(json_path) as f:
+            old_outputs = json.load(f).get('outputs', [])
+        kept = {os.path.normpath(output) for output in outputs}
+        for old_output in old_outputs:
+            if os.path.normpath(old_output) not in kept and os.path.exists(old_output):
+                os.remove(old_output)
+                removed.append(old_output)
+        os.remove(json_path)
+    with open(pickle_path + '.tmp', 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(pickle_path + '.tmp', pickle_path)
+    with open(json_path + '.tmp', 'w') as f:
+        json.dump({'key': key, 'outputs': list(outputs)}, f, indent=1)
+    os.replace(json_path + '.tmp', json_path)
+    return removed
+
+
+#%% Helpers
+def copy_df_files(df_files):
+    """Return a copy of the nested df_files dictionary (the DataFrames themselves are not copied)."""
+    return {site_code: {file_number: {file_identifier: dict(file_info)
+                                      for file_identifier, file_info in file_data.items()}
+                        for file_number, file_data in site_data.items()}
+            for site_code, site_data in df_files.items()}
+
+
+def deployment_windows(deployment_df, csv_file_names):
+    """Return the deployment table of the working folder files with 'Date In Time In' and 'Date Out Time Out'.
+
+    Times that can't be read (e.g. with a '?' in them) become NaT, so those files lose all their
+    data when trimmed and are reported then.
+    """
+    deployment_df = deployment_df[deployment_df['Offloaded Filename'].isin(csv_file_names)]
+    deployment_df = deployment_df[['Offloaded Filename', 'Date In', 'Time In', 'Date Full', 'Date Out', 'Time Out']].copy()
+    for when in ['In', 'Out']:
+        times = pd.to_timedelta(deployment_df[f'Time {when}'].astype(str), errors='coerce')
+        dates = pd.to_datetime(deployment_df[f'Date {when}'], format='%m/%d/%Y', errors='coerce')
+        deployment_df[f'Date {when} Time {when}'] = dates + times
+    return hobo_qc.deployment_table(deployment_df)
+
+
+def exported_csv_files(written):
+    """Return the exported data files (BT_... and PD_... .csv) of the files written by the export stage."""
+    return [path for path in written if path.endswith('.csv') and os.path.basename(path).startswith(('BT_', 'PD_'))]
+
+
+def open_catalog(config):
+    """Return a connection to the file catalog, or None if [paths] catalog is not set."""
+    catalog_path = config.get('paths', 'catalog', fallback='')
+    return hobo_catalog.connect(catalog_path) if catalog_path else None
+
+
+#%% Stages
+def run_ingest(config, csv_files):
+    """Read every .csv file of the working folder into the nested df_files dictionary."""
+    catalog = open_catalog(config)
+    if catalog is not None:
+        hobo_catalog.remove_missing(catalog)
+        hobo_catalog.update_catalog(catalog, csv_files, kind='raw')
+        catalog.close()
+    settings = config['ingest']
+    dataframes = hobo_io.read_logger_files(csv_files, mode=settings['mode'], engine=settings['engine'] or None,
+                                           cache_dir=settings['parse_cache_dir'] or None,
+                                           compact=settings.getboolean('compact'))
+    df_files = hobo_io.build_df_files(csv_files, dataframes)
+    for site_code, site_data in df_files.items():
+        for file_number, file_data in site_data.items():
+            if 'a' not in file_data:
+                log.warning(f"Warning: No 'a' identifier found for site code {site_code} and file number {file_number}.")
+    return df_files
+
+
+def run_deployment(config, csv_files):
+    """Read the deployment log and return the deployment table of the working folder files."""
+    csv_file_names = [hobo_io.parse_file_name(csv_file)[3] for csv_file in csv_files]
+    deployment_df = pd.read_csv(config['paths']['deployment_log'])
+    unmatched_files = sorted(set(csv_file_names) - set(deployment_df['Offloaded Filename']))
+    if unmatched_files:
+        log.warning(f"Warning: files that did not match the deployment log: {unmatched_files}")
+    deployment_data = deployment_windows(deployment_df, csv_file_names)
+    spans = hobo_qc.check_file_spans(csv_files, deployment_data)
+    for file_name in spans.index[spans['Starts Late']]:
+        log.warning(f"Warning: {file_name} starts after its Date In Time In ({spans.loc[file_name, 'First Reading']})")
+    for file_name in spans.index[spans['Ends Early']]:
+        log.warning(f"Warning: {file_name} ends before its Date Out Time Out ({spans.loc[file_name, 'Last Reading']})")
+    catalog = open_catalog(config)
+    if catalog is not None:
+        hobo_catalog.match_deployments(catalog, deployment_data, csv_file_names)
+        catalog.close()
+    return deployment_data
+
+
+def run_trim(config, ingest, deployment, counts=None):
+    """Trim every file to its deployment window and drop the first head and last tail readings.
+
+    The sampling intervals of the trimmed files are then checked (hobo_rules.interval_check) and every
+    file with gaps, duplicate times or irregular steps is logged as a warning. If a counts dictionary
+    is given, the number of readings dropped by each trim and the interval problems are added to it.
+    """
+    head = config.getint('trim', 'head')
+    tail = config.getint('trim', 'tail')
+    interval_tolerance = config['trim']['interval_tolerance']
+    interval_grid = config['trim']['interval_grid']
+    df_files = copy_df_files(ingest)
+    files_without_window = hobo_qc.trim_to_deployment(df_files, deployment)
+    for file_name in files_without_window:
+        log.warning(f"Warning: {file_name} has no deployment start and end time in the deployment log, all of its data was trimmed")
+    rows_in_window = hobo_metrics.count_rows(df_files)
+    for _, _, _, file_info in hobo_qc.iterate_files(df_files):
+        df = file_info['DataFrame']
+        file_info['DataFrame'] = df.iloc[head:len(df) - tail]
+
+    interval_summary, _ = hobo_rules.interval_check(hobo_long.to_long(df_files), tolerance=interval_tolerance,
+                                                    grid=interval_grid)
+    problems = interval_summary[interval_summary[['gaps', 'duplicates', 'irregular', 'out_of_order']].sum(axis=1) > 0]
+    for file_name, row in problems.iterrows():
+        log.warning(f"Warning: {file_name} has {row['gaps']} gaps "
+                    f"({row['missing_readings']} missing readings), {row['duplicates']} duplicate times, "
+                    f"{row['irregular']} irregular steps and {row['out_of_order']} readings out of order")
+    if counts is not None:
+        counts['rows_dropped_deployment'] = hobo_metrics.count_rows(ingest) - rows_in_window
+        counts['rows_dropped_edge'] = rows_in_window - hobo_metrics.count_rows(df_files)
+        counts['files_without_window'] = len(files_without_window)
+        counts['gaps'] = int(interval_summary['gaps'].sum())
+        counts['missing_readings'] = int(interval_summary['missing_readings'].sum())
+        counts['duplicate_times'] = int(interval_summary['duplicates'].sum())
+        counts['irregular_steps'] = int(interval_summary['irregular'].sum())
+        counts['readings_out_of_order'] = int(interval_summary['out_of_order'].sum())
+    return df_files
+
+
+def run_duplicates(config, trim, counts=None):
+    """Compare the duplicate files ('a', 'b', ...) of every site code and file number and average them.
+
+    Returns {'df_files': ..., 'calculations': {(site code, file number): file name},
+    'comparisons': {(site code, file number): the Provisional Duplicates comparison DataFrame},
+    'sweep': the hobo_qc.threshold_sweep table of the [duplicates] sweep thresholds, None if not set}.
+    The 'a' DataFrames keep only the SOP columns, with 'Temp, °C' replaced by the consensus of the
+    loggers (NaN where their spread is above the threshold). If a counts dictionary is given, the
+    number of compared groups, unmatched readings and readings above the threshold are added to it.
+    """
+    tolerance = config['duplicates']['tolerance']
+    threshold = config.getfloat('duplicates', 'threshold')
+    method = config['duplicates']['consensus']
+    df_files = copy_df_files(trim)
+    calculations = {}
+    comparisons = {}
+    pair_counts = {'pairs': 0, 'unmatched_a': 0, 'unmatched_b': 0, 'rows_above_threshold': 0}
+    differences = {}
+    for site_code, site_data in df_files.items():
+        for file_number, file_data in site_data.items():
+            duplicate_identifiers, _ = hobo_qc.split_identifiers(file_data)
+            if len(duplicate_identifiers) < 2 or duplicate_identifiers[0] != 'a':
+                continue
+            df_a = file_data['a']['DataFrame'].copy()
+            temps, unmatched = hobo_qc.stack_duplicates({identifier: file_data[identifier]['DataFrame']
+                                                         for identifier in duplicate_identifiers}, tolerance)
+            if any(unmatched.values()):
+                log.warning(f"Site: {site_code}, File Number: {file_number}: "
+                            + ", ".join(f"{count} '{identifier}' readings" for identifier, count in unmatched.items())
+                            + f" had no match within {tolerance}")
+            result = hobo_qc.duplicate_consensus(temps, threshold, method)
+            differences[(site_code, file_number)] = result['spread']
+            pair_counts['pairs'] += 1
+            for identifier, count in unmatched.items():
+                pair_counts[f'unmatched_{identifier}'] = pair_counts.get(f'unmatched_{identifier}', 0) + count
+            pair_counts['rows_above_threshold'] += int(result['flag'].sum())
+
+            if result['flag'].any():
+                calculations[(site_code, file_number)] = file_data['a']['File Name']
+                comparisons[(site_code, file_number)] = hobo_qc.comparison_frame(df_a, temps, duplicate_identifiers, result)
+
+            df_a[TEMP_COLUMN] = result['consensus']
+            file_data['a']['DataFrame'] = df_a[SOP_COLUMNS]
+    if counts is not None:
+        counts.update(pair_counts, calculation_files=len(calculations))
+
+    sweep = None
+    sweep_thresholds = [float(value) for value in config['duplicates']['sweep'].split(',') if value.strip()]
+    if sweep_thresholds:
+        sweep = hobo_qc.threshold_sweep(differences, sweep_thresholds)
+        log.info(f"Threshold sweep:\n{hobo_qc.sweep_summary(sweep).to_string()}")
+    return {'df_files': df_files, 'calculations': calculations, 'comparisons': comparisons, 'sweep': sweep}
+
+
+def run_offset(config, duplicates):
+    """Align the offset files ('c' and 'd') of every site code and file number on one timeline, as a 'merged' entry."""
+    tolerance = config.get('offset', 'tolerance') or None
+    df_files = copy_df_files(duplicates['df_files'])
+    for site_code, site_data in df_files.items():
+        for file_number, file_data in site_data.items():
+            _, offset_identifiers = hobo_qc.split_identifiers(file_data)
+            if len(offset_identifiers) >= 2:
+                aligned = hobo_qc.align_loggers({identifier: file_data[identifier]['DataFrame']
+                                                 for identifier in offset_identifiers}, tolerance)
+                file_data['merged'] = {'DataFrame': hobo_qc.aligned_frame(*aligned), 'File Name': 'merged'}
+    return dict(duplicates, df_files=df_files)
+
+
+def run_export(config, offset):
+    """Write the 'a' file and the Provisional Duplicates comparison of every site code and file number.
+
+    Returns the list of written files.
+    """
+    output_folder = config['paths']['output_folder']
+    internal_calculations_folder = os.path.join(output_folder, "internal_calculations")
+    calculations_folder = os.path.join(output_folder, "Provisional Duplicates")
+    archive_dir = os.path.join(output_folder, "parquet_archive") if config.getboolean('export', 'archive') else None
+    os.makedirs(internal_calculations_folder, exist_ok=True)
+    os.makedirs(calculations_folder, exist_ok=True)
+
+    engine = config.get('export', 'engine') or None
+    writer = hobo_io.start_export_writer(config.getint('export', 'writers'))
+    calculations = offset['calculations']
+    csv_writes = []
+    archive_writes = []
+    for site_code, site_data in offset['df_files'].items():
+        for file_number, file_data in site_data.items():
+            if 'a' not in file_data:
+                continue
+            df_a = file_data['a']['DataFrame']
+            if df_a.empty:
+                log.warning(f"Warning: {file_data['a']['File Name']} has no readings left after trimming and was not exported")
+                continue
+            first_data_point = df_a[DATE_COLUMN].iloc[0]
+            last_data_point = df_a[DATE_COLUMN].iloc[-1]
+            base_file_name = f"BT_{site_code}_{first_data_point.strftime('%y%m')}_{last_data_point.strftime('%y%m')}"
+
+            if (site_code, file_number) in calculations:
+                output_file_path = os.path.join(internal_calculations_folder, f"{base_file_name}_internal_calculations.csv")
+                comparison_path = os.path.join(calculations_folder, f"PD_{base_file_name}.csv")
+                csv_writes.append(hobo_io.queue_export(writer, hobo_io.write_csv_atomic,
+                                                       offset['comparisons'][(site_code, file_number)], comparison_path, engine))
+            else:
+                output_file_path = os.path.join(output_folder, f"{base_file_name}.csv")
+            csv_writes.append(hobo_io.queue_export(writer, hobo_io.write_csv_atomic, df_a, output_file_path, engine))
+
+            if archive_dir is not None:
+                archive_writes.append(hobo_io.queue_export(writer, hobo_io.write_archive, df_a, archive_dir, site_code,
+                                                           file_number, base_file_name,
+                                                           calculations=(site_code, file_number) in calculations))
+    if offset.get('sweep') is not None:
+        csv_writes.append(hobo_io.queue_export(writer, hobo_io.write_csv_atomic, offset['sweep'],
+                                               os.path.join(internal_calculations_folder, "threshold_sweep.csv"), engine))
+    try:
+        written = hobo_io.finish_exports(csv_writes)
+        for output_file_path in written:
+            log.debug(f"File saved: {output_file_path}")
+        written += [path for paths in hobo_io.finish_exports(archive_writes) for path in paths]
+    finally:
+        if writer is not None:
+            writer.shutdown()
+    log.info(f"Exported {len(written)} files to {output_folder}")
+    catalog = open_catalog(config)
+    if catalog is not None:
+        hobo_catalog.update_catalog(catalog, exported_csv_files(written), kind='exported')
+        catalog.close()
+    return written
+
+
+def run_plot(config, export):
+    """Save a plot of every exported file that goes to the output folder (not the calculation files)."""
+    settings = config['plot']
+    output_folder = os.path.normpath(config['paths']['output_folder'])
+    csv_files = [path for path in export
+                 if path.endswith('.csv') and os.path.normpath(os.path.dirname(path)) == output_folder]
+    save_dir = config.get('paths', 'graphs_folder', fallback='') or os.path.join(output_folder, 'graphs')
+    plot_files = hobo_plots.plot_exported_files(csv_files, save_dir, mode=settings['mode'],
+                                                dpi=settings.getint('dpi'),
+                                                decimation=settings['decimation'] or None,
+                                                max_points=settings.getint('max_points'))
+    log.info(f"Saved {len(plot_files)} plots to {save_dir}")
+    return plot_files
+
+
+STAGE_FUNCTIONS = {
+    'ingest': run_ingest,
+    'deployment': run_deployment,
+    'trim': run_trim,
+    'duplicates': run_duplicates,
+    'offset': run_offset,
+    'export': run_export,
+    'plot': run_plot,
+}
+
+
+#%% Runner
+def run_stage(config, stage, csv_files, inputs, counts=None):
+    """Run one stage on the results of the stages it uses (inputs, in the order of STAGE_INPUTS).
+
+    If a counts dictionary is given, the trim and duplicates stages add their own counts to it.
+    """
+    if stage in ('ingest', 'deployment'):
+        return STAGE_FUNCTIONS[stage](config, csv_files)
+    if stage in ('trim', 'duplicates'):
+        return STAGE_FUNCTIONS[stage](config, *inputs, counts=counts)
+    return STAGE_FUNCTIONS[stage](config, *inputs)
+
+
+def stage_counts(stage, csv_files, inputs, result):
+    """Return the file and row counts of a stage that ran, for the metrics file."""
+    if stage == 'ingest':
+        return {'files': len(csv_files), 'rows_out': hobo_metrics.count_rows(result)}
+    if stage == 'deployment':
+        return {'files': len(csv_files), 'rows_out': len(result), 'unmatched_files': len(csv_files) - len(result)}
+    if stage == 'trim':
+        return {'files': hobo_metrics.count_files(result), 'rows_in': hobo_metrics.count_rows(inputs[0]),
+                'rows_out': hobo_metrics.count_rows(result)}
+    if stage in ('duplicates', 'offset'):
+        df_files_in = inputs[0] if stage == 'duplicates' else inputs[0]['df_files']
+        return {'files': hobo_metrics.count_files(result['df_files']), 'rows_in': hobo_metrics.count_rows(df_files_in),
+                'rows_out': hobo_metrics.count_rows(result['df_files'])}
+    if stage == 'export':
+        exported = [file_data['a']['DataFrame'] for site_data in inputs[0]['df_files'].values()
+                    for file_data in site_data.values() if 'a' in file_data]
+        return {'files': len(exported_csv_files(result)), 'rows_out': sum(len(df) for df in exported)}
+    return {'files': len(result)}
+
+
+def run_pipeline(config, until='plot', force=()):
+    """Run the stages up to and including `until`, reusing the cached results of unchanged stages.
+
+    force is a list of stages to rerun even if their inputs did not change (the stages that use
+    them are then rerun too). Returns {stage: result} of the stages that were needed.
+    """
+    stage_cache = config['paths']['stage_cache']
+    metrics_path = config.get('paths', 'metrics_file', fallback='') or None
+    csv_files = working_files(config)
+    stages = STAGES[:STAGES.index(until) + 1]
+
+    # The key of every stage can be worked out before anything is run
+    keys = {}
+    forced = set()
+    for stage in stages:
+        keys[stage] = stage_key(config, stage, [keys[name] for name in STAGE_INPUTS[stage]], csv_files)
+        if stage in force or forced.intersection(STAGE_INPUTS[stage]):
+            forced.add(stage)
+
+    # A cached result is only used if the cached results of the stages it uses are too
+    # (otherwise e.g. the plots of an older export could be reused)
+    reusable = {}
+    for stage in stages:
+        reusable[stage] = (stage not in forced and cached_key(stage_cache, stage) == keys[stage]
+                           and all(reusable[name] for name in STAGE_INPUTS[stage]))
+
+    results = {}
+
+    def result_of(stage):
+        # Run a stage (or load it from the stage cache), loading only the results that are needed
+        if stage in results:
+            return results[stage]
+        if reusable[stage]:
+            log.info(f"{stage}: unchanged, using the cached result")
+            results[stage] = load_stage(stage_cache, stage)
+            return results[stage]
+        inputs = [result_of(name) for name in STAGE_INPUTS[stage]]
+        log.info(f"{stage}: running")
+        started = hobo_metrics.start_step()
+        counts = {}
+        result = run_stage(config, stage, csv_files, inputs, counts)
+        hobo_metrics.record_step(metrics_path, stage, started, **stage_counts(stage, csv_files, inputs, result), **counts)
+        outputs = result if stage in ('export', 'plot') else ()
+        for removed_output in save_stage(stage_cache, stage, keys[stage], result, outputs):
+            log.info(f"Removed old output: {removed_output}")
+        results[stage] = result
+        return result
+
+    result_of(until)
+    return results
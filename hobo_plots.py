@@ -0,0 +1,163 @@
+#%% HOBO plotting helpers
+# These functions save the temperature plots of the exported .csv files without showing them.
+# They draw on matplotlib Figure objects directly (the Agg canvas, no plt.figure()/plt.show()),
+# so no window is opened, pyplot doesn't keep every figure open, and the plots can be made in
+# a process pool. They live in their own file so the worker processes can import them.
+
+#%% Imports
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import hobo_io
+from hobo_io import DATE_COLUMN, TEMP_COLUMN
+
+
+#%% Downsampling for plots
+# A year-long 15 minute file has ~35,000 readings, far more than the ~1,200 pixels across a plot.
+# Drawing a marker for every reading is what makes the plot cells slow. The functions below pick a
+# few thousand readings to draw that still look the same:
+#   'minmax' - split the readings into equal buckets (about one per pixel column) and keep the
+#              lowest and highest reading of each, so every spike and flatline stays visible
+#   'lttb'   - largest triangle three buckets: keep the reading in each bucket that makes the
+#              largest triangle with its neighbours, which keeps the shape of the curve
+# Missing temperatures (NaN) are kept at the start of every gap so the line still breaks there.
+
+def minmax_indices(y, n_buckets):
+    """Return the positions of the lowest and highest value in each of n_buckets equal buckets of y."""
+    n = len(y)
+    bucket_size = int(np.ceil(n / n_buckets))
+    n_buckets = int(np.ceil(n / bucket_size))
+
+    # Pad the end with NaN so the values can be reshaped into one row per bucket
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:n] = y
+    buckets = padded.reshape(n_buckets, bucket_size)
+
+    # NaN never wins: it counts as +inf for the minimum and -inf for the maximum
+    lowest = np.argmin(np.where(np.isnan(buckets), np.inf, buckets), axis=1)
+    highest = np.argmax(np.where(np.isnan(buckets), -np.inf, buckets), axis=1)
+    offsets = np.arange(n_buckets) * bucket_size
+    indices = np.concatenate([offsets + lowest, offsets + highest])
+    return indices[indices < n]
+
+
+def lttb_indices(x, y, n_out):
+    """Return the positions of the n_out points picked by largest triangle three buckets."""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # The first and last points are always kept, the rest are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average point of the next bucket (or the last point for the last bucket)
+        if bucket + 2 < len(edges):
+            next_x = x[end:edges[bucket + 2]].mean()
+            next_y = y[end:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Area of the triangle made by the previous kept point, each point in this bucket and the next average
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        indices[bucket + 1] = previous
+    return indices
+
+
+def decimate_indices(times, temps, method='minmax', max_points=4000):
+    """Return the sorted positions of the readings to draw, at most about max_points of them.
+
+    method is 'minmax', 'lttb' or None (None keeps every reading).
+    """
+    y = np.asarray(temps, dtype=np.float64)
+    n = len(y)
+    if method is None or n <= max_points:
+        return np.arange(n)
+
+    missing = np.isnan(y)
+    if method == 'minmax':
+        indices = minmax_indices(y, max_points // 2)
+    elif method == 'lttb':
+        # Only the readings that have a temperature take part, their positions are mapped back after
+        present = np.flatnonzero(~missing)
+        x = np.asarray(times).astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+        indices = present[lttb_indices(x[present], y[present], max_points)] if len(present) else present
+    else:
+        raise ValueError(f"Unknown decimation method '{method}', use 'minmax', 'lttb' or None")
+
+    # Keep the first reading of every run of missing temperatures so the line breaks at the gap
+    gap_starts = np.flatnonzero(missing & ~np.concatenate([[False], missing[:-1]]))
+    return np.unique(np.concatenate([indices, gap_starts, [0, n - 1]]))
+
+
+def decimate_frame(df, method='minmax', max_points=4000):
+    """Return the rows of a HOBO DataFrame to plot (all of them if method is None)."""
+    if method is None:
+        return df
+    return df.iloc[decimate_indices(df[DATE_COLUMN], df[TEMP_COLUMN], method, max_points)]
+
+
+#%% Single plot
+def temperature_figure(times, temps, title='Temperature Over Time'):
+    """Draw the temperature over time plot used for the exported files and return the Figure."""
+    fig = Figure(figsize=(12, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(times, temps, color='blue', marker='o', linestyle='-')
+    ax.set_title(title)
+    ax.set_xlabel('Date Time')
+    ax.set_ylabel(TEMP_COLUMN)
+    ax.grid(True)
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+    return fig
+
+
+def plot_exported_csv(csv_file, save_dir, dpi=100, decimation='minmax', max_points=4000):
+    """Plot one exported .csv file and save it as {file name}_plot.png in save_dir. Returns the png path.
+
+    decimation and max_points choose how the readings are downsampled before drawing (see decimate_indices).
+    """
+    df = decimate_frame(hobo_io.read_exported_csv(csv_file), decimation, max_points)
+    fig = temperature_figure(df[DATE_COLUMN], df[TEMP_COLUMN])
+
+    plot_file_name = os.path.splitext(os.path.basename(csv_file))[0] + '_plot.png'
+    plot_path = os.path.join(save_dir, plot_file_name)
+    fig.savefig(plot_path, dpi=dpi)
+
+    # Free the figure straight away so memory doesn't grow with the number of plots
+    fig.clear()
+    return plot_path
+
+
+#%% Batch plots
+def plot_exported_files(csv_files, save_dir, mode='process', workers=None, dpi=100, decimation='minmax', max_points=4000):
+    """Save a plot for every exported .csv file in csv_files. Returns the png paths in the same order.
+
+    mode is 'serial', 'thread' or 'process'. Each worker only holds one figure at a time, so the
+    memory used stays the same however many files there are.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    count = len(csv_files)
+    if mode == 'serial':
+        return [plot_exported_csv(csv_file, save_dir, dpi, decimation, max_points) for csv_file in csv_files]
+
+    if mode == 'thread':
+        executor_class = ThreadPoolExecutor
+    elif mode == 'process':
+        executor_class = ProcessPoolExecutor
+    else:
+        raise ValueError(f"Unknown plot mode '{mode}', use 'serial', 'thread' or 'process'")
+
+    with executor_class(max_workers=workers) as executor:
+        return list(executor.map(plot_exported_csv, csv_files, [save_dir] * count, [dpi] * count,
+                                 [decimation] * count, [max_points] * count))
@@ -0,0 +1,311 @@
+#%% HOBO duplicate QC helpers
+# These functions are used by QAQC_V1.7.3.py for the checks and calculations done on the
+# duplicate ('a' and 'b') files. They work on whole columns at once instead of row by row,
+# which is what keeps them fast on year-long files.
+
+#%% Imports
+import os
+
+import numpy as np
+import pandas as pd
+
+import hobo_rules
+from hobo_io import DATE_COLUMN, TEMP_COLUMN, file_time_span, temps_as_float64, wall_clock
+
+
+#%% Deployment log and trimming
+def deployment_table(filtered_deployment_df):
+    """Return the deployment log as a DataFrame indexed by 'Offloaded Filename'.
+
+    If a file name is listed more than once the last row is kept (the same as the old dictionary).
+    The 'Date In Time In' and 'Date Out Time Out' columns are made naive (see hobo_io.wall_clock).
+    """
+    deployment_data = filtered_deployment_df.drop_duplicates('Offloaded Filename', keep='last').copy()
+    for column in ['Date In Time In', 'Date Out Time Out']:
+        if column in deployment_data.columns:
+            deployment_data[column] = wall_clock(deployment_data[column])
+    return deployment_data.set_index('Offloaded Filename')
+
+
+def iterate_files(df_files):
+    """Yield (site_code, file_number, file_identifier, file_info) for every file in df_files."""
+    for site_code, site_data in df_files.items():
+        for file_number, file_data in site_data.items():
+            for file_identifier, file_info in file_data.items():
+                yield site_code, file_number, file_identifier, file_info
+
+
+def trim_to_deployment(df_files, deployment_data):
+    """Trim every DataFrame in df_files to its [Date In Time In, Date Out Time Out] window, in place.
+
+    The timestamps of all files are put end to end in one long array, each reading is joined to the
+    deployment window of its file, and one mask is calculated for all files at once. The mask is then
+    split back into the separate files. Files without a deployment window (not in the deployment log,
+    or a missing Date In Time In/Date Out Time Out) are emptied and their names are returned.
+    """
+    entries = [file_info for _, _, _, file_info in iterate_files(df_files)]
+    if not entries:
+        return []
+    file_names = [file_info['File Name'] for file_info in entries]
+    lengths = np.array([len(file_info['DataFrame']) for file_info in entries])
+
+    # Deployment window of each file (NaT if the file is not in the deployment log)
+    windows = deployment_data[['Date In Time In', 'Date Out Time Out']].reindex(file_names)
+    no_window = windows.isna().any(axis=1).to_numpy()
+    missing = [name for name, skip in zip(file_names, no_window) if skip]
+
+    # One long table: the time of every reading next to the window of the file it came from
+    times = np.concatenate([file_info['DataFrame'][DATE_COLUMN].to_numpy(dtype='datetime64[ns]') for file_info in entries])
+    starts = np.repeat(wall_clock(windows['Date In Time In']), lengths)
+    ends = np.repeat(wall_clock(windows['Date Out Time Out']), lengths)
+    keep = (times >= starts) & (times <= ends)
+
+    # Split the mask back into the separate files
+    for file_info, file_keep in zip(entries, np.split(keep, np.cumsum(lengths)[:-1])):
+        file_info['DataFrame'] = file_info['DataFrame'][file_keep]
+    return missing
+
+
+def check_file_spans(csv_files, deployment_data):
+    """Compare the first and last reading of every raw file with its deployment window, without reading the files.
+
+    Returns a DataFrame indexed by file name with the 'First Reading' and 'Last Reading' of the file
+    (see hobo_io.file_time_span), its 'Date In Time In' and 'Date Out Time Out', and 'Starts Late'/'Ends Early'
+    which are True when the logger started after the deployment or stopped before the recovery.
+    Files that are not in the deployment log have NaT windows and are never late or early.
+    """
+    file_names = [os.path.splitext(os.path.basename(csv_file))[0] for csv_file in csv_files]
+    spans = pd.DataFrame([file_time_span(csv_file) for csv_file in csv_files],
+                         index=pd.Index(file_names, name='Offloaded Filename'),
+                         columns=['First Reading', 'Last Reading'], dtype='datetime64[ns]')
+    windows = deployment_data[['Date In Time In', 'Date Out Time Out']].reindex(file_names)
+    for column in ['Date In Time In', 'Date Out Time Out']:
+        spans[column] = wall_clock(windows[column])
+    spans['Starts Late'] = spans['First Reading'] > spans['Date In Time In']
+    spans['Ends Early'] = spans['Last Reading'] < spans['Date Out Time Out']
+    return spans
+
+
+#%% Matching the duplicates by time
+def match_duplicate_times(df_a, df_b, tolerance='1min'):
+    """Pair every 'a' reading with the 'b' reading closest in time (within the tolerance).
+
+    Both files are sorted by 'Date Time, GMT-04:00' and joined in one pass (pd.merge_asof), so the
+    readings are compared by timestamp instead of by their position in the file. Each 'b' reading is
+    used at most once. Returns (temp_b, unmatched_a, unmatched_b) where temp_b is the matched 'b'
+    temperature on df_a's index (NaN where there was no match) and the other two are the number of
+    readings in each file that found no partner.
+    """
+    # Keep the original row positions so the result can be put back in df_a's order
+    a_times = pd.DataFrame({DATE_COLUMN: df_a[DATE_COLUMN].to_numpy(), 'a_row': np.arange(len(df_a))})
+    b_times = pd.DataFrame({DATE_COLUMN: df_b[DATE_COLUMN].to_numpy(), 'b_row': np.arange(len(df_b)),
+                            'b_time': df_b[DATE_COLUMN].to_numpy()})
+    a_times = a_times.dropna(subset=[DATE_COLUMN]).sort_values(DATE_COLUMN, kind='stable')
+    b_times = b_times.dropna(subset=[DATE_COLUMN]).sort_values(DATE_COLUMN, kind='stable')
+
+    matched = pd.merge_asof(a_times, b_times, on=DATE_COLUMN, direction='nearest',
+                            tolerance=pd.Timedelta(tolerance))
+    matched = matched.dropna(subset=['b_row'])
+
+    # If two 'a' readings picked the same 'b' reading, only the closest one keeps it
+    matched['gap'] = (matched[DATE_COLUMN] - matched['b_time']).abs()
+    matched = matched.sort_values('gap', kind='stable').drop_duplicates('b_row')
+
+    a_rows = matched['a_row'].to_numpy()
+    b_rows = matched['b_row'].to_numpy().astype(np.int64)
+    temp_b = np.full(len(df_a), np.nan)
+    temp_b[a_rows] = temps_as_float64(df_b[TEMP_COLUMN])[b_rows]
+
+    unmatched_a = len(df_a) - len(a_rows)
+    unmatched_b = len(df_b) - len(b_rows)
+    return pd.Series(temp_b, index=df_a.index, name='Temp B'), unmatched_a, unmatched_b
+
+
+#%% Consensus of any number of duplicate loggers
+# The duplicate loggers of a site code and file number are 'a', 'b' and any further letters, except
+# the offset loggers 'c' and 'd' (the files renamed in the Checking the lengths cell), which are
+# aligned with align_loggers instead. 'merged' is the result of that alignment.
+OFFSET_IDENTIFIERS = ('c', 'd')
+
+
+def split_identifiers(identifiers):
+    """Return (duplicate identifiers with 'a' first, offset identifiers) of one site code and file number."""
+    duplicates = sorted((identifier for identifier in identifiers
+                         if identifier not in OFFSET_IDENTIFIERS and identifier != 'merged'),
+                        key=lambda identifier: (identifier != 'a', identifier))
+    offsets = [identifier for identifier in identifiers if identifier in OFFSET_IDENTIFIERS]
+    return duplicates, offsets
+
+
+def stack_duplicates(frames, tolerance='1min'):
+    """Stack the temperatures of any number of duplicate loggers into one 2-D array on the first logger's readings.
+
+    frames is a dictionary of identifier -> DataFrame with the reference logger ('a') first. Every other
+    logger is matched to the reference by time with match_duplicate_times. Returns (temps, unmatched):
+    a float64 array with a row per reference reading and a column per logger (NaN where a logger had no
+    reading within the tolerance), and {identifier: number of readings without a match}. For the
+    reference that is the number of its readings that are missing at least one other logger.
+    """
+    identifiers = list(frames)
+    reference = frames[identifiers[0]]
+    temps = np.empty((len(reference), len(identifiers)))
+    temps[:, 0] = temps_as_float64(reference[TEMP_COLUMN])
+    unmatched = {identifiers[0]: 0}
+    for column, identifier in enumerate(identifiers[1:], start=1):
+        matched, _, unmatched[identifier] = match_duplicate_times(reference, frames[identifier], tolerance)
+        temps[:, column] = matched.to_numpy()
+    unmatched[identifiers[0]] = int(np.isnan(temps[:, 1:]).any(axis=1).sum())
+    return temps, unmatched
+
+
+def duplicate_consensus(temps, threshold=0.2, method='mean'):
+    """Compare any number of duplicate loggers and return their consensus temperature, all in one pass over the array.
+
+    temps has a row per reading and a column per logger (see stack_duplicates). Returns a dictionary of arrays:
+        pairwise  - |difference| of every pair of loggers, a column per pair in the order of pairs
+        pairs     - the (column, column) of every pairwise column
+        spread    - the largest difference between the loggers of a row (the 'Temperature_Difference')
+        average   - the mean (or median, method='median') of the loggers of a row
+        consensus - average where spread is at or below the threshold, NaN above it
+        flag      - True where spread is above the threshold
+    Rows with fewer than two readings have NaN spread, average and consensus and are not flagged.
+    For two loggers this is the same as the 'a'/'b' difference and average.
+    """
+    first, second = np.triu_indices(temps.shape[1], k=1)
+    pairwise = np.abs(temps[:, first] - temps[:, second])
+    spread = np.fmax.reduce(pairwise, axis=1) if len(first) else np.full(len(temps), np.nan)
+
+    readings = (~np.isnan(temps)).sum(axis=1)
+    enough = readings >= 2
+    average = np.full(len(temps), np.nan)
+    if method == 'median':
+        average[enough] = np.nanmedian(temps[enough], axis=1)
+    elif method == 'mean':
+        average[enough] = np.nansum(temps[enough], axis=1) / readings[enough]
+    else:
+        raise ValueError(f"method must be 'mean' or 'median', not {method!r}")
+
+    flag = spread > threshold
+    consensus = np.where(spread <= threshold, average, np.nan)
+    return {'pairwise': pairwise, 'pairs': list(zip(first.tolist(), second.tolist())), 'spread': spread,
+            'average': average, 'consensus': consensus, 'flag': flag}
+
+
+def comparison_frame(df_a, temps, identifiers, result):
+    """Return the Provisional Duplicates comparison of one site code and file number.
+
+    The '#' and date of the 'a' readings, a 'Temp A', 'Temp B', ... column per logger, and the
+    'Temperature_Difference', 'Average_temp' and 'Flag' from duplicate_consensus.
+    """
+    columns = {'#': df_a['#'].to_numpy(), DATE_COLUMN: df_a[DATE_COLUMN].to_numpy()}
+    columns.update({f"Temp {identifier.upper()}": temps[:, i] for i, identifier in enumerate(identifiers)})
+    columns.update({'Temperature_Difference': result['spread'], 'Average_temp': result['average'], 'Flag': result['flag']})
+    return pd.DataFrame(columns, index=df_a.index)
+
+
+#%% Trying different thresholds
+def threshold_sweep(differences, thresholds):
+    """Return the flagged readings and flagged intervals of every site code and file number for a list of thresholds.
+
+    differences is a dictionary of (site code, file number) -> the 'Temperature_Difference' of its
+    readings in time order. A reading is flagged when its difference is above the threshold, and a
+    flagged interval is a run of flagged readings one after the other. The differences of each file
+    are sorted once and every threshold is counted with a binary search (np.searchsorted), so trying
+    many thresholds costs about the same as trying one. A run starts at every reading that is above
+    the threshold while the reading before it is not, i.e. the threshold lies between the two, so
+    the runs are counted the same way from the sorted min(difference, previous difference).
+    Returns a DataFrame with a row per site code, file number and threshold.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    rows = []
+    for (site_code, file_number), difference in differences.items():
+        difference = np.asarray(difference, dtype=np.float64)
+        previous = np.concatenate([[-np.inf], difference[:-1]])
+        previous[np.isnan(previous)] = -np.inf  # a reading after a missing one can start a run
+        run_starts = np.minimum(difference, previous)
+
+        sorted_difference = np.sort(difference[~np.isnan(difference)])
+        sorted_run_starts = np.sort(run_starts[~np.isnan(run_starts)])
+        flagged = len(sorted_difference) - np.searchsorted(sorted_difference, thresholds, side='right')
+        still_flagged = len(sorted_run_starts) - np.searchsorted(sorted_run_starts, thresholds, side='right')
+        rows.append(pd.DataFrame({'site_code': site_code, 'file_number': file_number, 'threshold': thresholds,
+                                  'readings': len(sorted_difference), 'flagged': flagged,
+                                  'flagged_intervals': flagged - still_flagged}))
+    if not rows:
+        return pd.DataFrame(columns=['site_code', 'file_number', 'threshold', 'readings', 'flagged', 'flagged_intervals'])
+    return pd.concat(rows, ignore_index=True)
+
+
+def sweep_summary(sweep):
+    """Return the totals of a threshold_sweep per threshold: the number of calculation files, flagged readings and flagged intervals."""
+    summary = sweep.groupby('threshold')[['readings', 'flagged', 'flagged_intervals']].sum()
+    summary.insert(0, 'calculation_files', (sweep['flagged'] > 0).groupby(sweep['threshold']).sum())
+    summary['flagged_percent'] = 100 * summary['flagged'] / summary['readings']
+    return summary
+
+
+#%% Aligning any number of loggers on one timeline
+def logging_interval(frames):
+    """Return the most common time between readings of the loggers in frames (the shortest if they differ), or None if no logger has two readings."""
+    steps = [np.diff(np.sort(frames[identifier][DATE_COLUMN].dropna().to_numpy(dtype='datetime64[ns]')).view(np.int64))
+             for identifier in frames]
+    codes = np.repeat(np.arange(len(steps)), [len(logger_steps) for logger_steps in steps])
+    nominal = hobo_rules.nominal_intervals(codes, np.concatenate(steps), len(steps))
+    nominal = nominal[nominal > 0]
+    return pd.Timedelta(seconds=int(nominal.min())) if len(nominal) else None
+
+
+def align_loggers(frames, tolerance=None):
+    """Put the readings of any number of loggers on one shared timeline.
+
+    frames is a dictionary of identifier -> DataFrame, e.g. {'c': df_c, 'd': df_d}. The readings of the
+    first logger are the starting rows. Every other logger is then matched to the rows in one pass
+    (pd.merge_asof): each reading goes to the row closest in time if it is within the tolerance, and
+    each row takes at most one reading per logger (the closest). Readings without a row get a row of
+    their own, so no reading is lost and the next logger can be matched to them too.
+    The tolerance defaults to half the logging interval (logging_interval), so offset loggers that
+    sample half an interval apart, like 'c' and 'd', still share a row.
+    Returns (times, temps, identifiers): the time of every row (the reading that started it), a
+    float64 array with a row per time and a column per logger (NaN where a logger has no reading),
+    and the identifiers in column order.
+    """
+    identifiers = list(frames)
+    if tolerance is None:
+        interval = logging_interval(frames)
+        tolerance = interval / 2 if interval is not None else 0
+    tolerance = pd.Timedelta(tolerance)
+
+    times = np.array([], dtype='datetime64[ns]')
+    wide = np.empty((0, len(identifiers)))
+    for column, identifier in enumerate(identifiers):
+        readings = pd.DataFrame({DATE_COLUMN: frames[identifier][DATE_COLUMN].to_numpy(dtype='datetime64[ns]'),
+                                 'temp': temps_as_float64(frames[identifier][TEMP_COLUMN])})
+        readings = readings.dropna(subset=[DATE_COLUMN]).sort_values(DATE_COLUMN, kind='stable')
+        readings['reading'] = np.arange(len(readings))
+        rows = pd.DataFrame({DATE_COLUMN: times, 'row': np.arange(len(times)), 'row_time': times})
+
+        matched = pd.merge_asof(readings, rows, on=DATE_COLUMN, direction='nearest', tolerance=tolerance)
+        matched = matched.dropna(subset=['row'])
+        # If two readings picked the same row, only the closest one keeps it
+        matched['gap'] = (matched[DATE_COLUMN] - matched['row_time']).abs()
+        matched = matched.sort_values('gap', kind='stable').drop_duplicates('row')
+
+        # The readings that found no row are added as new rows, and the rows are put back in time order
+        new_rows = np.ones(len(readings), dtype=bool)
+        new_rows[matched['reading'].to_numpy()] = False
+        new_times = readings[DATE_COLUMN].to_numpy()[new_rows]
+        new_wide = np.full((len(new_times), len(identifiers)), np.nan)
+        new_wide[:, column] = readings['temp'].to_numpy()[new_rows]
+        wide[matched['row'].to_numpy().astype(np.int64), column] = matched['temp'].to_numpy()
+        times = np.concatenate([times, new_times])
+        wide = np.concatenate([wide, new_wide])
+        order = np.argsort(times, kind='stable')
+        times, wide = times[order], wide[order]
+    return times, wide, identifiers
+
+
+def aligned_frame(times, temps, identifiers):
+    """Return the result of align_loggers as a DataFrame with the date column and a 'Temp, °C_{identifier}' column per logger."""
+    columns = {DATE_COLUMN: times}
+    columns.update({f"{TEMP_COLUMN}_{identifier}": temps[:, i] for i, identifier in enumerate(identifiers)})
+    return pd.DataFrame(columns)
@@ -0,0 +1,278 @@
+#%% QC rules for every reading
+# Besides the a/b difference, the readings used to be checked by eye on the plot of every file.
+# These rules check every reading of every logger at once with array operations on the long table
+# (see hobo_long.py) or the parquet archive (hobo_io.read_archive), so a multi-year archive takes
+# seconds instead of hours of scrolling through plots. Every reading gets a flag number where each
+# rule sets its own bit, so one small uint8 column says which rules a reading failed:
+#   1  RANGE     - the temperature is outside the gross range limits
+#   2  SPIKE     - the temperature is far from the median of the readings around it
+#   4  RATE      - the temperature changed faster than the largest rate allowed since the reading before
+#   8  FLATLINE  - the reading is part of a long run of identical readings (a stuck sensor)
+# e.g. a flag of 6 is a spike that was also too fast a change. 0 passed every rule.
+#
+# The limits are set in a rules dictionary (DEFAULT_RULES holds the defaults for reef water).
+
+#%% Imports
+import numpy as np
+import pandas as pd
+
+from hobo_io import DATE_COLUMN, TEMP_COLUMN, temps_as_float64
+
+RANGE = 1
+SPIKE = 2
+RATE = 4
+FLATLINE = 8
+FLAG_NAMES = {RANGE: 'range', SPIKE: 'spike', RATE: 'rate', FLATLINE: 'flatline'}
+
+DEFAULT_RULES = {
+    'min_temp': 20.0,           # °C, lowest believable reef water temperature
+    'max_temp': 35.0,           # °C, highest believable reef water temperature
+    'spike_window': 5,          # readings in the centered median window (odd)
+    'spike_limit': 1.0,         # °C away from the window median that counts as a spike
+    'max_rate': 2.0,            # °C per hour between two readings
+    'flatline_readings': 12,    # identical readings in a row that count as a stuck sensor (3 hours at 15 minutes)
+    'flatline_tolerance': 0.0005,  # °C, readings closer than this count as identical
+}
+
+
+#%% Ordering the readings
+def series_codes(df, groups):
+    """Return an integer code per reading for the logger series it belongs to.
+
+    groups is a column name (e.g. 'file_name' for the long table) or a list of them (e.g.
+    ['site_code', 'file_number'] for the parquet archive).
+    """
+    if isinstance(groups, str) and isinstance(df[groups].dtype, pd.CategoricalDtype):
+        return df[groups].cat.codes.to_numpy().astype(np.int64)
+    return df.groupby(groups, observed=True, sort=False).ngroup().to_numpy().astype(np.int64)
+
+
+#%% The rules
+def spike_medians(temps, window, chunk_size=1_000_000):
+    """Return the centered rolling median of temps (NaN for the first and last window // 2 readings).
+
+    The median is taken over the whole array in chunks of chunk_size readings, so the memory used
+    stays at about window x chunk_size numbers whatever the length of the archive.
+    """
+    half = window // 2
+    medians = np.full(len(temps), np.nan)
+    for start in range(0, max(len(temps) - 2 * half, 0), chunk_size):
+        stop = min(start + chunk_size, len(temps) - 2 * half)
+        windows = np.lib.stride_tricks.sliding_window_view(temps[start:stop + 2 * half], window)
+        medians[start + half:stop + half] = np.median(windows, axis=1)
+    return medians
+
+
+def run_rules(df, rules=None, groups='file_name'):
+    """Check every reading of df against the rules and return a uint8 flag per reading (see the top of this file).
+
+    df is the long table or the parquet archive: one row per reading with the date, the temperature
+    and the groups column(s) that tell the logger series apart. The readings don't have to be in order,
+    they are sorted by series and time once and the flags are returned in the order of df. Rules that
+    compare a reading with the ones around it never look across two series, and readings too close to
+    the start or end of a series for a full spike window are not spike checked.
+    """
+    rules = dict(DEFAULT_RULES, **(rules or {}))
+    codes = series_codes(df, groups)
+    times = df[DATE_COLUMN].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    order = np.lexsort((times, codes))
+    codes, times = codes[order], times[order]
+    temps = temps_as_float64(df[TEMP_COLUMN].to_numpy())[order]
+    flags = np.zeros(len(temps), dtype=np.uint8)
+    if not len(temps):
+        return flags
+
+    # Position of every reading inside its series
+    series_starts = np.flatnonzero(np.diff(codes, prepend=codes[0] - 1))
+    lengths = np.diff(np.append(series_starts, len(codes)))
+    position = np.arange(len(codes)) - np.repeat(series_starts, lengths)
+    to_end = np.repeat(lengths, lengths) - position - 1
+    has_previous = position > 0
+
+    # Gross range
+    flags[(temps < rules['min_temp']) | (temps > rules['max_temp'])] |= RANGE
+
+    # Spike: far from the median of the window around the reading
+    half = rules['spike_window'] // 2
+    medians = spike_medians(temps, rules['spike_window'])
+    full_window = (position >= half) & (to_end >= half)
+    flags[full_window & (np.abs(temps - medians) > rules['spike_limit'])] |= SPIKE
+
+    # Rate of change since the reading before, in °C per hour
+    step = np.diff(temps, prepend=np.nan)
+    hours = np.diff(times, prepend=times[0]) / 3.6e12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.abs(step) / hours
+    flags[has_previous & (hours > 0) & (rate > rules['max_rate'])] |= RATE
+
+    # Flatline: runs of identical readings; a new run starts at every change and at every new series
+    same = has_previous & (np.abs(step) <= rules['flatline_tolerance'])
+    runs = np.cumsum(~same)
+    run_lengths = np.bincount(runs)
+    flags[run_lengths[runs] >= rules['flatline_readings']] |= FLATLINE
+
+    # Back to the order of df
+    result = np.empty_like(flags)
+    result[order] = flags
+    return result
+
+
+#%% Reporting
+def flag_names(flag):
+    """Return the names of the rules set in one flag number, e.g. flag_names(6) -> ['spike', 'rate']."""
+    return [name for bit, name in FLAG_NAMES.items() if flag & bit]
+
+
+def flag_summary(df, flags, groups='file_name'):
+    """Return the number of readings and of readings failing each rule per logger series, the series with flags first."""
+    counts = pd.DataFrame({name: (flags & bit) > 0 for bit, name in FLAG_NAMES.items()}, index=df.index)
+    counts['flagged'] = flags > 0
+    keys = [df[column] for column in ([groups] if isinstance(groups, str) else groups)]
+    summary = counts.groupby(keys, observed=True, sort=False).sum()
+    summary.insert(0, 'readings', counts.groupby(keys, observed=True, sort=False).size())
+    return summary.sort_values('flagged', ascending=False, kind='stable')
+
+
+#%% Sampling interval checks
+# The a/b row counts only show that two files differ in length. These checks sort the readings of
+# each logger by time once and look at the time between every two readings (np.diff of the int64
+# timestamps) to find:
+#   gap        - one or more readings are missing (the step is about two or more intervals)
+#   duplicate  - the same timestamp twice
+#   irregular  - any other step that is off the nominal interval by more than the tolerance
+# Readings that were not in time order in df are counted on their own (out_of_order), so a shuffled
+# table (e.g. the parquet archive) is checked the same as the files.
+# The nominal interval of each logger is its most common step rounded to the grid (whole minutes by
+# default), so a clock that runs a little fast or slow does not change it. Steps of the same kind one
+# after the other are reported as one event (run-length encoded), e.g. a 2 day gap is one row, not 192.
+# The offset column of the summary is how far the readings drifted from the nominal grid that starts
+# at the first reading (up to half an interval either way), which shows clock drift even when every
+# single step is within the tolerance, e.g. a logger that reads every 10:02 instead of every 10:00.
+INTERVAL_OK, INTERVAL_GAP, INTERVAL_DUPLICATE, INTERVAL_IRREGULAR = 0, 1, 2, 3
+INTERVAL_KINDS = {INTERVAL_GAP: 'gap', INTERVAL_DUPLICATE: 'duplicate', INTERVAL_IRREGULAR: 'irregular'}
+
+
+def nominal_intervals(codes, steps, n_series):
+    """Return the most common step (in whole seconds) of every series, 0 for series with fewer than two readings.
+
+    codes and steps are only the steps inside a series. Every (series, step) pair is packed into one
+    int64 and sorted once, so all series are done together.
+    """
+    seconds = np.clip(steps // 10**9, 0, 2**40 - 1)
+    keys = np.sort(codes * 2**40 + seconds, kind='stable')  # the keys are nearly sorted already
+    nominal = np.zeros(n_series, dtype=np.int64)
+    if not len(keys):
+        return nominal
+    starts = np.flatnonzero(np.diff(keys, prepend=keys[0] - 1))
+    counts = np.diff(np.append(starts, len(keys)))
+    key_codes = keys[starts] // 2**40
+    # The most common step of each series: the largest count, taking the smallest step on a tie
+    best = np.lexsort((-counts, key_codes))
+    first_of_series = best[np.flatnonzero(np.diff(key_codes[best], prepend=-1))]
+    nominal[key_codes[first_of_series]] = keys[starts[first_of_series]] % 2**40
+    return nominal
+
+
+def time_order(codes, times):
+    """Return the row order that sorts the readings by series and time, or None if they already are.
+
+    The files of the long table are normally each in time order, so the rows are only put in series
+    order (a quick stable sort, skipped if they already are) and the full sort by time is only done
+    if that does not leave every series in time order.
+    """
+    order = None
+    if not (codes[1:] >= codes[:-1]).all():
+        order = np.argsort(codes, kind='stable')
+        codes, times = codes[order], times[order]
+    if ((times[1:] >= times[:-1]) | (codes[1:] != codes[:-1])).all():
+        return order
+    by_time = np.lexsort((times, codes))
+    return by_time if order is None else order[by_time]
+
+
+def interval_check(df, groups='file_name', tolerance='30s', grid='1min'):
+    """Check the time between the readings of every logger series in df at once.
+
+    df is the long table (or the parquet archive with groups=['site_code', 'file_number']). The
+    readings don't have to be in order, they are sorted by series and time once. The most common step
+    of a series is rounded to the grid to give its nominal interval (steps shorter than the grid are
+    kept as they are). Returns (summary, events):
+        summary - per series: readings, nominal_interval, gaps, duplicates, irregular (number of
+                  events of each kind), missing_readings, out_of_order (readings that came before
+                  an earlier reading in df) and max_offset (largest drift off the nominal grid)
+        events  - one row per run of steps of the same kind: the series, kind, start and end (the
+                  readings before and after the run), steps and missing_readings (gaps only)
+    """
+    keys = [groups] if isinstance(groups, str) else list(groups)
+    codes = series_codes(df, groups)
+    times = df[DATE_COLUMN].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    order = time_order(codes, times)
+    if order is not None:
+        codes, times = codes[order], times[order]
+    inside = np.diff(codes, prepend=-1) == 0  # the step to this reading is inside one series
+    series_starts = np.flatnonzero(~inside)
+    lengths = np.diff(np.append(series_starts, len(times)))
+    # Number the series that have readings 0, 1, 2, ... (files left empty by the trims have no codes)
+    codes = np.repeat(np.arange(len(series_starts)), lengths)
+    n_series = len(series_starts)
+    rows = (lambda positions: positions) if order is None else (lambda positions: order[positions])
+
+    steps = np.diff(times, prepend=times[:1])
+    most_common = nominal_intervals(codes[inside], steps[inside], n_series) * 10**9
+    grid = pd.Timedelta(grid).value
+    nominal = np.where(most_common >= grid, np.rint(most_common / grid).astype(np.int64) * grid, most_common)
+    expected = np.repeat(nominal, lengths)
+    # The tolerance is at most half the interval, so a step can't be both regular and a gap
+    window = np.repeat(np.minimum(pd.Timedelta(tolerance).value, nominal // 2), lengths)
+
+    kinds = np.zeros(len(times), dtype=np.int8)
+    has_nominal = inside & (expected > 0)
+    deviation = steps - expected
+    kinds[has_nominal & (np.abs(deviation) > window)] = INTERVAL_IRREGULAR
+    kinds[has_nominal & (deviation >= expected - window)] = INTERVAL_GAP
+    kinds[inside & (steps == 0)] = INTERVAL_DUPLICATE
+    # Missing readings are only worked out for the (few) gap steps
+    gaps = np.flatnonzero(kinds == INTERVAL_GAP)
+    missing = np.rint(steps[gaps] / expected[gaps]).astype(np.int64) - 1
+    cumulative_missing = np.concatenate([[0], np.cumsum(missing)])
+
+    # Run-length encode the steps: a run ends where the kind or the series changes
+    run_starts = np.flatnonzero((np.diff(kinds, prepend=INTERVAL_OK) != 0) | ~inside)
+    run_starts = run_starts[kinds[run_starts] != INTERVAL_OK]
+    run_ends = run_starts + 1
+    if len(run_starts):
+        # Extend every run over the following steps of the same kind in the same series
+        change = np.flatnonzero((np.diff(kinds, append=INTERVAL_OK) != 0) | np.append(~inside[1:], True))
+        run_ends = change[np.searchsorted(change, run_starts)] + 1
+    events = df[keys].iloc[rows(run_starts)].reset_index(drop=True)
+    events['kind'] = pd.Categorical.from_codes(kinds[run_starts] - 1, list(INTERVAL_KINDS.values()))
+    events['start'] = pd.to_datetime(times[run_starts - 1])
+    events['end'] = pd.to_datetime(times[run_ends - 1])
+    events['steps'] = run_ends - run_starts
+    events['missing_readings'] = (cumulative_missing[np.searchsorted(gaps, run_ends)]
+                                  - cumulative_missing[np.searchsorted(gaps, run_starts)])
+
+    # Drift off the nominal grid that starts at the first reading of each series
+    period = np.maximum(nominal, 1)
+    offset = times - np.repeat(times[series_starts] - period // 2, lengths)
+    np.remainder(offset, np.repeat(period, lengths), out=offset)
+    offset -= np.repeat(period // 2, lengths)
+    max_offset = np.maximum.reduceat(np.abs(offset), series_starts) if len(offset) else np.zeros(0, dtype=np.int64)
+    max_offset[nominal == 0] = 0
+
+    # In time order the row numbers of a series only go down where a reading was out of order in df
+    out_of_order = np.zeros(n_series, dtype=np.int64)
+    if order is not None:
+        out_of_order = np.bincount(codes[inside & (np.diff(order, prepend=0) < 0)], minlength=n_series)
+
+    event_codes = codes[run_starts]
+    summary = df[keys].iloc[rows(series_starts)].reset_index(drop=True)
+    summary['readings'] = lengths
+    summary['nominal_interval'] = pd.to_timedelta(nominal)
+    for kind, name in INTERVAL_KINDS.items():
+        summary[f"{name}s" if name != 'irregular' else name] = np.bincount(
+            event_codes[kinds[run_starts] == kind], minlength=n_series)
+    summary['missing_readings'] = np.bincount(codes[gaps], weights=missing, minlength=n_series).astype(np.int64)
+    summary['out_of_order'] = out_of_order
+    summary['max_offset'] = pd.to_timedelta(max_offset)
+    return summary.set_index(keys), events
@@ -0,0 +1,36 @@
+#%% Run the HOBO QAQC pipeline from the command line
+# Runs the stages of hobo_pipeline.py with the folders and settings from a config file, so the
+# SOP can be run without the notebook and without editing folder paths in the cells.
+# Stages whose inputs did not change since the last run are loaded from the stage cache.
+#
+# Examples:
+#   python run_qaqc.py qaqc_config.ini                    run everything
+#   python run_qaqc.py qaqc_config.ini --until duplicates  stop after the duplicate checks
+#   python run_qaqc.py qaqc_config.ini --force trim        rerun trim and every stage after it
+#   python run_qaqc.py qaqc_config.ini --verbose --log-file qaqc.log
+
+#%% Imports
+import argparse
+
+import hobo_log
+import hobo_pipeline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the HOBO logger QAQC stages.")
+    parser.add_argument('config', help="pipeline config file (see qaqc_config.example.ini)")
+    parser.add_argument('--until', choices=hobo_pipeline.STAGES, default=hobo_pipeline.STAGES[-1],
+                        help="last stage to run (default: %(default)s)")
+    parser.add_argument('--force', choices=hobo_pipeline.STAGES, nargs='+', default=[],
+                        help="stages to rerun even if their inputs did not change")
+    parser.add_argument('--verbose', action='store_true', help="also show the messages about every single file")
+    parser.add_argument('--log-file', help="file every message (including the per file ones) is added to")
+    args = parser.parse_args(argv)
+
+    hobo_log.setup(quiet=not args.verbose, log_file=args.log_file)
+    config = hobo_pipeline.load_config(args.config)
+    hobo_pipeline.run_pipeline(config, until=args.until, force=args.force)
+
+
+if __name__ == '__main__':
+    main()
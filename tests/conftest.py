@@ -0,0 +1,7 @@
+#%% Test setup
+# The helper modules sit next to QAQC_V1.7.3.py in the top folder, so it is put on the path
+# to import them the same way the notebook does.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,52 @@
+#%% Tests of the incremental processing manifest
+import pandas as pd
+
+import hobo_io
+
+
+def write_files(folder, contents):
+    """Write {file name: text} to .csv files in folder and return their paths."""
+    paths = []
+    for file_name, text in contents.items():
+        path = folder / f"{file_name}.csv"
+        path.write_text(text)
+        paths.append(str(path))
+    return paths
+
+
+def test_select_changed_groups_only_keeps_new_or_changed_groups(tmp_path):
+    csv_files = write_files(tmp_path, {'BT_TCSR41_2301': 'one', 'BT_TCCB08_2301': 'two', 'BT_TCMT24_2301': 'three'})
+    df_files = {site_code: {'2301': {'a': {'DataFrame': None, 'File Name': f"BT_{site_code}_2301"}}}
+                for site_code in ['TCSR41', 'TCCB08', 'TCMT24']}
+    deployment_df = pd.DataFrame({'Offloaded Filename': [f"BT_{site_code}_2301" for site_code in df_files],
+                                  'Depth': [10, 20, 30]})
+
+    # First run: every group is new
+    manifest = hobo_io.load_manifest(None)
+    fingerprints = hobo_io.group_fingerprints(df_files, csv_files, deployment_df, manifest)
+    assert hobo_io.select_changed_groups(df_files, fingerprints, manifest) == df_files
+    for site_code in df_files:
+        hobo_io.record_group(manifest, site_code, '2301', fingerprints[hobo_io.group_key(site_code, '2301')], [])
+
+    # Nothing changed
+    fingerprints = hobo_io.group_fingerprints(df_files, csv_files, deployment_df, manifest)
+    assert hobo_io.select_changed_groups(df_files, fingerprints, manifest) == {}
+
+    # One raw file and one deployment log row changed
+    (tmp_path / 'BT_TCSR41_2301.csv').write_text('one, offloaded again')
+    deployment_df.loc[deployment_df['Offloaded Filename'] == 'BT_TCMT24_2301', 'Depth'] = 31
+    fingerprints = hobo_io.group_fingerprints(df_files, csv_files, deployment_df, manifest)
+    assert set(hobo_io.select_changed_groups(df_files, fingerprints, manifest)) == {'TCSR41', 'TCMT24'}
+
+
+def test_record_group_deletes_outputs_that_were_not_written_again(tmp_path):
+    old_output, new_output = write_files(tmp_path, {'BT_TCSR41_2210_2301': '', 'BT_TCSR41_2210_2302': ''})
+    manifest = hobo_io.load_manifest(None)
+    fingerprint = {'files': {}, 'deployment': {}}
+
+    hobo_io.record_group(manifest, 'TCSR41', '2301', fingerprint, [old_output])
+    removed = hobo_io.record_group(manifest, 'TCSR41', '2301', fingerprint, [new_output])
+
+    assert removed == [old_output]
+    assert not (tmp_path / 'BT_TCSR41_2210_2301.csv').exists()
+    assert manifest['groups']['TCSR41_2301']['outputs'] == [new_output]
@@ -0,0 +1,74 @@
+#%% Tests of the duplicate, trimming and offset helpers
+import numpy as np
+import pandas as pd
+
+import hobo_qc
+from hobo_io import DATE_COLUMN, TEMP_COLUMN
+
+
+def logger_frame(times, temps):
+    return pd.DataFrame({'#': np.arange(1, len(times) + 1), DATE_COLUMN: times, TEMP_COLUMN: temps})
+
+
+def test_duplicate_consensus_is_nan_above_the_threshold():
+    temps = np.array([[27.0, 27.1], [27.0, 27.3], [27.0, 27.2], [27.0, np.nan]])
+    result = hobo_qc.duplicate_consensus(temps, threshold=0.2)
+
+    np.testing.assert_allclose(result['spread'][:3], [0.1, 0.3, 0.2])
+    np.testing.assert_allclose(result['consensus'][[0, 2]], [27.05, 27.1])
+    assert np.isnan(result['consensus'][1])
+    assert result['flag'].tolist() == [False, True, False, False]
+    # A row with a single reading has no consensus but is not flagged either
+    assert np.isnan(result['consensus'][3])
+
+
+def test_duplicate_consensus_median_of_three_loggers():
+    temps = np.array([[27.0, 27.05, 27.5], [27.0, 27.05, 27.1]])
+    result = hobo_qc.duplicate_consensus(temps, threshold=0.2, method='median')
+    assert np.isnan(result['consensus'][0])
+    assert result['consensus'][1] == 27.05
+    assert result['pairs'] == [(0, 1), (0, 2), (1, 2)]
+
+
+def test_trim_to_deployment_keeps_the_readings_inside_the_window():
+    times = pd.date_range('2023-01-01 00:00', periods=10, freq='1h')
+    df_files = {'TCSR41': {'2301': {
+        'a': {'DataFrame': logger_frame(times, np.full(10, 27.0)), 'File Name': 'BT_TCSR41_2301'},
+        'b': {'DataFrame': logger_frame(times, np.full(10, 27.0)), 'File Name': 'BT_TCSR41_2301_b'},
+    }}}
+    deployment_data = hobo_qc.deployment_table(pd.DataFrame({
+        'Offloaded Filename': ['BT_TCSR41_2301'],
+        # The log times are read as local times, the wall clock time shown is what counts
+        'Date In Time In': [pd.Timestamp('2023-01-01 02:00', tz='America/Puerto_Rico')],
+        'Date Out Time Out': [pd.Timestamp('2023-01-01 05:00', tz='America/Puerto_Rico')],
+    }))
+    missing = hobo_qc.trim_to_deployment(df_files, deployment_data)
+
+    kept = df_files['TCSR41']['2301']['a']['DataFrame'][DATE_COLUMN]
+    assert list(kept) == list(times[2:6])
+    # The 'b' file is not in the deployment log, so it is emptied and reported
+    assert missing == ['BT_TCSR41_2301_b']
+    assert df_files['TCSR41']['2301']['b']['DataFrame'].empty
+
+
+def test_align_loggers_puts_half_interval_offset_readings_on_one_row():
+    times = pd.date_range('2023-01-01', periods=8, freq='15min')
+    df_c = logger_frame(times, np.arange(8.0))
+    df_d = logger_frame(times + pd.Timedelta('7min 30s'), np.arange(8.0) + 100)
+
+    aligned_times, temps, identifiers = hobo_qc.align_loggers({'c': df_c, 'd': df_d})
+
+    assert identifiers == ['c', 'd']
+    assert list(aligned_times) == list(times)
+    np.testing.assert_array_equal(temps[:, 1] - temps[:, 0], np.full(8, 100.0))
+
+
+def test_align_loggers_keeps_readings_without_a_partner():
+    times = pd.date_range('2023-01-01', periods=4, freq='15min')
+    df_c = logger_frame(times, np.arange(4.0))
+    df_d = logger_frame(times[[0, 2]] + pd.Timedelta('20s'), np.array([10.0, 12.0]))
+
+    aligned_times, temps, _ = hobo_qc.align_loggers({'c': df_c, 'd': df_d}, tolerance='1min')
+
+    assert len(aligned_times) == 4
+    np.testing.assert_array_equal(temps[:, 1], [10.0, np.nan, 12.0, np.nan])
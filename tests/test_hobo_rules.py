@@ -0,0 +1,77 @@
+#%% Tests of the QC rules and the sampling interval check
+import numpy as np
+import pandas as pd
+
+import hobo_rules
+from hobo_io import DATE_COLUMN, TEMP_COLUMN
+
+
+def long_table(series):
+    """Make a long table from {file_name: (times, temps)}."""
+    names = [name for name, (times, _) in series.items() for _ in range(len(times))]
+    return pd.DataFrame({
+        'file_name': pd.Categorical(names, categories=list(series)),
+        DATE_COLUMN: np.concatenate([pd.DatetimeIndex(times).to_numpy() for times, _ in series.values()]),
+        TEMP_COLUMN: np.concatenate([np.asarray(temps, dtype=np.float32) for _, temps in series.values()]),
+    })
+
+
+def test_run_rules_sets_one_bit_per_rule():
+    times = pd.date_range('2023-01-01', periods=40, freq='15min')
+    temps = 27 + 0.01 * np.arange(40)
+    temps[5] = 40.0          # out of range, a spike and a fast change
+    temps[20:35] = 27.5      # stuck sensor
+    flags = hobo_rules.run_rules(long_table({'x': (times, temps)}))
+
+    assert flags.dtype == np.uint8
+    assert flags[5] & hobo_rules.RANGE and flags[5] & hobo_rules.SPIKE and flags[5] & hobo_rules.RATE
+    assert not flags[5] & hobo_rules.FLATLINE
+    assert (flags[20:35] & hobo_rules.FLATLINE).all()
+    assert (flags[:3] == 0).all() and flags[15] == 0
+
+
+def test_run_rules_does_not_look_across_series():
+    times = pd.date_range('2023-01-01', periods=10, freq='15min')
+    # The second series starts 5 °C warmer, which is not a fast change inside either series
+    flags = hobo_rules.run_rules(long_table({'x': (times, np.full(10, 27.0)), 'y': (times, np.full(10, 32.0))}),
+                                 {'flatline_readings': 100})
+    assert (flags == 0).all()
+
+
+def test_run_rules_returns_flags_in_the_order_of_df():
+    times = pd.date_range('2023-01-01', periods=10, freq='15min')
+    temps = np.full(10, 27.0)
+    temps[4] = 10.0
+    df = long_table({'x': (times, temps)})
+    flags = hobo_rules.run_rules(df, {'flatline_readings': 100})
+    reversed_flags = hobo_rules.run_rules(df.iloc[::-1].reset_index(drop=True), {'flatline_readings': 100})
+    assert flags[4] & hobo_rules.RANGE
+    assert np.array_equal(reversed_flags, flags[::-1])
+
+
+def test_interval_check_finds_gaps_duplicates_and_irregular_steps():
+    times = list(pd.date_range('2023-01-01', periods=20, freq='15min'))
+    times = times[:5] + times[8:]                           # 3 readings missing
+    times.insert(10, times[9])                             # a duplicate time
+    times[14] = times[14] + pd.Timedelta('5min')           # one reading logged late
+    summary, events = hobo_rules.interval_check(long_table({'x': (times, np.full(len(times), 27.0))}))
+
+    row = summary.loc['x']
+    assert row['nominal_interval'] == pd.Timedelta('15min')
+    assert row['gaps'] == 1 and row['missing_readings'] == 3
+    assert row['duplicates'] == 1
+    assert row['irregular'] == 1  # the late reading is one run of two irregular steps
+    gap = events[events['kind'] == 'gap'].iloc[0]
+    assert gap['start'] == times[4] and gap['end'] == times[5]
+
+
+def test_interval_check_rounds_the_interval_to_the_grid_and_sorts_by_time():
+    times = pd.date_range('2023-01-01', periods=12, freq='15min') + pd.Timedelta('1s')
+    steps = pd.to_timedelta(np.array([0, 1, -1] * 4), unit='s')
+    df = long_table({'x': (times + steps, np.full(12, 27.0))}).iloc[::-1]
+    summary, events = hobo_rules.interval_check(df)
+
+    row = summary.loc['x']
+    assert row['nominal_interval'] == pd.Timedelta('15min')
+    assert row['gaps'] == 0 and row['irregular'] == 0 and len(events) == 0
+    assert row['out_of_order'] == 11